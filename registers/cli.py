@@ -31,4 +31,5 @@ cli.add_command(commands.init_command)
 cli.add_command(commands.patch_group)
 cli.add_command(commands.record_group)
 cli.add_command(commands.schema_group)
+cli.add_command(commands.serve_command)
 cli.add_command(commands.value_group)
@@ -17,4 +17,5 @@ from .blob import blob_group
 from .context import context_group
 from .patch import patch_group
 from .schema import schema_group
+from .serve import serve_command
 from .value import value_group
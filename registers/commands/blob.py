@@ -11,7 +11,7 @@ This module implements the blob command group.
 import json
 from io import StringIO
 import click
-from .. import rsf, xsv, Register, Blob, validator
+from .. import rsf, xsv, Register, Blob
 from ..exceptions import RegistersException
 from . import utils
 
@@ -72,7 +72,7 @@ def validate_blob(blob, rsf_file):
         schema = register.schema()
 
         data = json.loads(blob)
-        validator.validate(data, schema)
+        schema.compile_validator().validate(data)
 
         blob = Blob(data)
 
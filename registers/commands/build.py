@@ -9,19 +9,204 @@ This module implements the build command.
 """
 
 import json
+import os
 import shutil
-from zipfile import ZipFile
+import time
+from operator import attrgetter
+from hashlib import sha256
+from gzip import GzipFile
+from io import RawIOBase
 from pathlib import Path
-from typing import List, Union, Dict, cast, IO
+from tempfile import TemporaryDirectory
+from typing import (List, Union, Dict, Optional, Callable, Tuple, cast,
+                    BinaryIO, IO)
 import pkg_resources
 import yaml
 import click
 from jinja2 import Environment, PackageLoader
-from .. import rsf, Register, Entry, Record, Cardinality
-from ..exceptions import RegistersException
-from . import utils
+from .. import rsf, Register, Entry, Record, Cardinality, Hash
+from ..exceptions import RegistersException, CommandError
+from . import utils, writers
+from .utils import FragmentCache
+from .estimate import Estimator
+from .profiler import Profiler
 from .utils import error
 
+try:
+    import brotli  # type: ignore
+except ImportError:
+    brotli = None  # type: ignore
+
+
+def gzip_stream(stream: BinaryIO) -> BinaryIO:
+    """
+    Wraps the given stream to compress what is written to it with gzip. The
+    modification time is fixed so the result is reproducible across builds.
+    """
+
+    return cast(BinaryIO, GzipFile(fileobj=stream, mode="wb",
+                                   compresslevel=9, mtime=0))
+
+
+class BrotliStream(RawIOBase):
+    """
+    Wraps a stream to compress what is written to it with brotli. Closing it
+    flushes the compressor and leaves the wrapped stream open.
+    """
+
+    def __init__(self, stream: BinaryIO):
+        super().__init__()
+        self.stream = stream
+        self.compressor = brotli.Compressor()
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self.stream.write(self.compressor.process(bytes(data)))
+
+        return len(data)
+
+    def close(self):
+        if not self.closed:
+            self.stream.write(self.compressor.finish())
+
+        super().close()
+
+
+def brotli_stream(stream: BinaryIO) -> BinaryIO:
+    """
+    Wraps the given stream to compress what is written to it with brotli.
+    """
+
+    return cast(BinaryIO, BrotliStream(stream))
+
+
+COMPRESSORS: Dict[str, Callable[[BinaryIO], BinaryIO]] = {
+    "gzip": gzip_stream,
+    "br": brotli_stream,
+}
+COMPRESSED_SUFFIXES = {"gzip": ".gz", "br": ".br"}
+COMPRESSIBLE_SUFFIXES = [".csv", ".json", ".rsf"]
+PAGE_SIZE = 5000
+SHARD_WIDTH = 2
+MUTABLE_RESOURCES = ["archive.zip",
+                     "commands.rsf",
+                     "entries/index.csv",
+                     "entries/index.json",
+                     "items/index.csv",
+                     "items/index.json",
+                     "openapi.json",
+                     "records/index.csv",
+                     "records/index.json",
+                     "register.json"]
+ARCHIVE_FAMILIES = ["items index", "entries index", "records index"]
+ARCHIVE_FULL_FAMILIES = ["items", "entries"] + ARCHIVE_FAMILIES
+
+
+def parse_encodings(_ctx, _param, value: Optional[str]) -> List[str]:
+    """
+    Parses a comma separated list of encodings, e.g. ``gzip,br``.
+    """
+
+    if value is None:
+        return []
+
+    encodings = [token.strip() for token in value.split(",")
+                 if token.strip()]
+    unknown = [encoding for encoding in encodings
+               if encoding not in COMPRESSORS]
+
+    if unknown:
+        expected = ", ".join(COMPRESSORS.keys())
+        raise click.BadParameter(
+            f"Unknown encoding {', '.join(unknown)}. Expected {expected}.")
+
+    return encodings
+
+
+class Partition:
+    """
+    Selects the part of the build a node writes.
+
+    The default partition writes everything. ``--shard i/n`` writes the i-th
+    of n deterministic slices of the per-object files and nothing else:
+    items and records are partitioned by hash and entries by range.
+    ``--merge`` writes everything but the per-object files.
+    """
+
+    def __init__(self, number: int = 1, count: int = 1,
+                 indexes: bool = True, objects: bool = True):
+        self.number = number
+        self.count = count
+        self.indexes = indexes
+        self.objects = objects
+
+    @classmethod
+    def shard(cls, number: int, count: int) -> "Partition":
+        """
+        The per-object files of the given shard.
+        """
+
+        return cls(number, count, indexes=False)
+
+    @classmethod
+    def merge(cls) -> "Partition":
+        """
+        Everything but the per-object files.
+        """
+
+        return cls(objects=False)
+
+    def item(self, blob_hash: Hash) -> bool:
+        """
+        Checks if the given item belongs to the partition.
+        """
+
+        return self._bucket(blob_hash.digest)
+
+    def entry(self, position: int, total: int) -> bool:
+        """
+        Checks if the given entry belongs to the partition.
+
+        >>> [Partition(2, 3).entry(position, 8) for position in range(1, 9)]
+        [False, False, False, True, True, True, False, False]
+        """
+
+        size = -(-total // self.count)
+
+        return (position - 1) // size == self.number - 1
+
+    def record(self, key: str) -> bool:
+        """
+        Checks if the given record belongs to the partition.
+        """
+
+        return self._bucket(sha256(key.encode("utf-8")).hexdigest())
+
+    def _bucket(self, digest: str) -> bool:
+        return int(digest[:8], 16) % self.count == self.number - 1
+
+
+def parse_shard(_ctx, _param, value: Optional[str]) -> Optional[Partition]:
+    """
+    Parses a shard expressed as ``i/n``, e.g. ``2/4``.
+    """
+
+    if value is None:
+        return None
+
+    try:
+        number, count = [int(token) for token in value.split("/")]
+    except ValueError:
+        raise click.BadParameter(f"Expected i/n but got {value}.")
+
+    if not 1 <= number <= count:
+        raise click.BadParameter(
+            f"Expected a shard between 1 and {count} but got {number}.")
+
+    return Partition.shard(number, count)
+
 
 @click.command(name="build")
 @click.argument("rsf_files", type=click.Path(exists=True),
@@ -30,12 +215,85 @@ from .utils import error
                                              "cloudfoundry",
                                              "docker"]),
               help="Publication target")
-def build_command(rsf_files, target):
+@click.option("--output-format", type=click.Choice(writers.OUTPUT_FORMATS),
+              default="directory", show_default=True,
+              help="Write a directory tree or a single SQLite or tar file.")
+@click.option("--writer", "writer_mode",
+              type=click.Choice(["sync", "threads"]), default="sync",
+              show_default=True,
+              help="Write files synchronously or from a pool of I/O \
+threads (directory output only).")
+@click.option("--precompress", "encodings", callback=parse_encodings,
+              metavar="gzip[,br]",
+              help="Write pre-compressed siblings for every resource.")
+@click.option("--jobs", type=click.IntRange(min=1),
+              help="Number of parallel workers. Defaults to the number of \
+CPUs.")
+@click.option("--shard-dirs", is_flag=True,
+              help="Spread items and records in hash prefixed directories.")
+@click.option("--blob-store", type=click.Path(file_okay=False),
+              help="Keep every item once in the given content-addressed \
+store and link it into the build (directory output only).")
+@click.option("--archive-level", type=click.IntRange(min=0, max=9),
+              default=6, show_default=True,
+              help="Compression level of archive.zip. 0 stores the files \
+uncompressed.")
+@click.option("--archive-full", is_flag=True,
+              help="Include every item and entry file in archive.zip.")
+@click.option("--shard", "partition", callback=parse_shard, metavar="i/n",
+              help="Write only the i-th of n slices of the item, entry and \
+record files.")
+@click.option("--merge", is_flag=True,
+              help="Write everything but the item, entry and record files.")
+@click.option("--estimate", is_flag=True,
+              help="Predict the files, bytes and time of the build out of a \
+sample, without building it.")
+@click.option("--profile", is_flag=True,
+              help="Print the time, memory and output of each phase.")
+@click.option("--profile-json", type=click.Path(dir_okay=False),
+              help="Write the profile of each phase to the given JSON file.")
+def build_command(rsf_files, target, output_format, writer_mode, encodings,
+                  jobs, shard_dirs, blob_store, archive_level, archive_full,
+                  partition, merge, estimate, profile, profile_json):
+    """
+    Builds the static version of the given RSF_FILES.
+    """
+
+    if estimate:
+        for rsf_file in rsf_files:
+            estimate_register(rsf_file, encodings=encodings,
+                              shard_dirs=shard_dirs,
+                              archive_full=archive_full)
+
+        return
+
+    if partition and merge:
+        raise click.UsageError("--shard and --merge are mutually exclusive.")
+
+    if merge:
+        partition = Partition.merge()
+
     for rsf_file in rsf_files:
-        build_register(rsf_file, target)
+        profiler = Profiler(profile or profile_json is not None)
+
+        build_register(rsf_file, target, encodings=encodings, jobs=jobs,
+                       shard_dirs=shard_dirs, output_format=output_format,
+                       archive_level=archive_level,
+                       archive_full=archive_full, profiler=profiler,
+                       partition=partition, writer_mode=writer_mode,
+                       blob_store=blob_store)
+
+        if profile:
+            profiler.echo()
 
+        if profile_json:
+            profiler.dump(profile_json)
 
-def build_register(rsf_file, target):
+
+def build_register(rsf_file, target, *, encodings=None, jobs=None,
+                   shard_dirs=False, output_format="directory",
+                   archive_level=6, archive_full=False, profiler=None,
+                   partition=None, writer_mode="sync", blob_store=None):
     """
     Builds the static version of the register. Derives all required files such
     that a static web server conforms to the REST API specification (V1).
@@ -54,6 +312,15 @@ def build_register(rsf_file, target):
             │  ├── 2.json
             .  .
             .  .
+            │  ├── index.csv
+            │  ├── index.csv.offsets
+            │  ├── index.json
+            │  ├── index.json.offsets
+            │  ├── pages
+            │  │  ├── 1.csv
+            │  │  ├── 1.json
+            .  .  .
+            │  │  └── index.json
             ├── items
             │  ├── sha-256:cc524b28...b22dc1f27ed35da34564.csv
             │  ├── sha-256:cc524b28...b22dc1f27ed35da34564.json
@@ -67,8 +334,11 @@ def build_register(rsf_file, target):
             │  ├── purple
             │  │  ├── entries.csv
             │  │  └── entries.json
+            │  ├── pages
+            .  .  .
             │  ├── index.csv
             │  └── index.json
+            ├── etags.json
             └── register.json
 
     Note that the name of the file RSF_FILE is not used for any part of the
@@ -80,44 +350,249 @@ def build_register(rsf_file, target):
     If the publication target `--target` is specified it will generate the
     appropriate rewrite and redirect rules such that the API behaves as close
     as possible to the original reference implementation.
+
+    Caching
+    =======
+
+    Items and entries never change once published so the nginx based
+    targets serve them as immutable, with a strong ETag made of their hash or
+    number. Any other resource is served with a strong ETag derived from the
+    register version recorded in `etags.json`. Pre-compressed siblings get an
+    ETag of their own.
+
+    Staging
+    =======
+
+    The build is written to ``build/.staging`` and swapped in place of the
+    published one once complete, so the published build is never partial
+    and is left untouched if the build fails. Files whose content has not
+    changed since the published build are hardlinked from it instead of
+    being written again. Directories are exchanged atomically where the
+    platform supports it (``renameat2`` on Linux). Node shards are written
+    in place.
+
+    Sharded directories
+    ===================
+
+    If `--shard-dirs` is given, items and records are spread over
+    directories named after the first two hex characters of the item hash
+    and the sha-256 of the record key respectively:
+
+        \b
+        items/cc/sha-256:cc524b28...b22dc1f27ed35da34564.json
+        records/3a/purple.json
+        records/3a/purple/entries.json
+
+    The nginx based targets rewrite the public URLs to this layout. It is not
+    available for the netlify target.
+
+    Blob store
+    ==========
+
+    If `--blob-store DIR` is given, item files (and their pre-compressed
+    siblings) are written once into DIR, named after the sha-256 of their
+    content, and hardlinked into the build, or symlinked when DIR is on
+    another filesystem. Files already in the store are not written again so
+    builds of registers sharing items, or rebuilds of the same register,
+    write mostly nothing for items. It requires the directory output format.
+
+    Archive
+    =======
+
+    The archive ``archive.zip`` holds the items, entries and records indexes
+    and the register context. It is streamed while the build runs, with the
+    members compressed in parallel at the `--archive-level` compression
+    level. If `--archive-full` is given it also holds every item and entry
+    file.
+
+    Node shards
+    ===========
+
+    A build can be split across n nodes sharing the build directory. Each
+    node runs `--shard i/n` (from 1/n to n/n) to write a deterministic slice
+    of the item, entry and record files: items and records are partitioned
+    by hash and entries by range. Then `--merge` writes everything else,
+    including the target files and the archive, which it reads from the
+    shards' output when `--archive-full` is given. The result is identical
+    to a build on a single node. Neither step clears the build directory
+    and both require the directory output format.
+
+    Estimate
+    ========
+
+    If `--estimate` is given nothing is built. Instead, it prints the
+    predicted number of files, bytes (raw and gzip) and time for each family
+    of resources, out of a sample of each family written to a temporary
+    directory. Time is for a single worker on the local disk.
+
+    Profile
+    =======
+
+    If `--profile` or `--profile-json` is given, the build records the wall
+    time, CPU time, tracemalloc peak, peak RSS, files and bytes written for
+    each phase: load, blobs, entries, records, trails, commands, context,
+    openapi, etags and archive. Archive members are compressed in the
+    background so the archive phase only accounts for finishing it. Tracing
+    memory allocations slows the build down noticeably.
+
+    Output format
+    =============
+
+    If `--output-format` is ``sqlite`` or ``tar`` the same resources are
+    written to a single file, ``build/web-colours.sqlite`` or
+    ``build/web-colours.tar``, instead of a directory tree. The SQLite
+    database has a ``resources`` table with the path, content type and
+    content of every resource. Both can be served locally with
+    ``registers serve``. Publication targets require the directory format.
+
+    Writer
+    ======
+
+    With `--writer threads` the files are handed over to a pool of `--jobs`
+    I/O threads through a bounded queue instead of being written one by one,
+    which pays off on filesystems with a high latency per file. It requires
+    the directory output format. The files and bytes written and the
+    throughput are reported at the end of the build.
+
+    Pre-compression
+    ===============
+
+    If `--precompress` is given, every CSV, JSON and RSF resource gets a
+    ``.gz`` (gzip) and/or ``.br`` (brotli) sibling. The nginx based targets
+    serve the ``.gz`` files with ``gzip_static``. Brotli requires the
+    ``brotli`` Python package.
     """
 
+    profiler = profiler or Profiler(enabled=False)
+    partition = partition or Partition()
+    staging = output_path = None
+    profiler.start()
+
     try:
-        cmds = rsf.read(rsf_file)
+        with profiler.phase("load"):
+            source_size = os.path.getsize(rsf_file)
+            register, canonical = load_register(rsf_file)
+
+        if shard_dirs and target == "netlify":
+            raise CommandError(
+                "Sharded directories are not supported by netlify.")
+
+        if target and output_format != "directory":
+            raise CommandError(
+                f"Publication targets are not supported by the \
+{output_format} output format.")
 
-        with utils.progressbar(range(1, len(cmds)),
-                               label="Loading register") as bar:
-            register = Register(cmds, lambda: bar.update(1))
+        if writer_mode == "threads" and output_format != "directory":
+            raise CommandError(
+                f"The threaded writer is not supported by the \
+{output_format} output format.")
 
-        utils.check_readiness(register)
+        if blob_store and output_format != "directory":
+            raise CommandError(
+                f"The blob store is not supported by the {output_format} \
+output format.")
 
-        build_path = Path(f"build/{register.uid}")
+        is_node = not (partition.indexes and partition.objects)
 
-        if build_path.exists():
-            shutil.rmtree(build_path)
+        if is_node and output_format != "directory":
+            raise CommandError(
+                f"Node shards are not supported by the {output_format} \
+output format.")
 
-        build_path.mkdir(parents=True)
+        output_path = Path(f"build/{register.uid}")
+        previous = None
 
-        if target == "netlify":
-            build_target_resource("_redirects", "netlify", build_path)
+        if output_format != "directory":
+            output_path = output_path.with_suffix(f".{output_format}")
 
-        if target == "docker":
-            build_docker(build_path)
+        if is_node:
+            staging = build_path = output_path
+        else:
+            staging = build_path = staging_path(output_path)
+            remove_path(staging)
 
-        if target == "cloudfoundry":
-            build_cloudfoundry(build_path, register)
+            if output_format == "directory" and output_path.is_dir():
+                previous = output_path
+
+        if output_format != "directory":
+            build_path.parent.mkdir(parents=True, exist_ok=True)
+        else:
+            build_path.mkdir(parents=True, exist_ok=True)
+
+        if partition.indexes:
+            build_targets(build_path, register, target, shard_dirs)
 
         if target in ["cloudfoundry", "docker"]:
             build_path = build_path.joinpath("public")
-            build_path.mkdir()
+            build_path.mkdir(exist_ok=True)
+            previous = previous and previous.joinpath("public")
+
+        store = writers.BlobStore(Path(blob_store)) if blob_store else None
+        started = time.perf_counter()
+
+        with make_writer(output_format, build_path, register.uid,
+                         encodings=encodings, jobs=jobs,
+                         archive_level=archive_level,
+                         archive_full=archive_full,
+                         archive=partition.indexes,
+                         threaded=writer_mode == "threads", store=store,
+                         previous=previous) as writer:
+            profiler.writer = writer
+
+            with profiler.phase("blobs"):
+                build_blobs(writer, register, shard_dirs, partition)
+
+                if not partition.objects and archive_full:
+                    archive_resources(writer, build_path,
+                                      blob_resources(register, shard_dirs))
+
+            entries = entry_cache()
+
+            with profiler.phase("entries"):
+                build_entries(writer, register, partition, entries)
 
-        build_blobs(build_path.joinpath("items"), register)
-        build_entries(build_path.joinpath("entries"), register)
-        build_records(build_path.joinpath("records"), register)
-        build_commands(build_path, register)
-        build_context(build_path.joinpath("register"), register)
-        build_archive(build_path, register)
-        build_openapi(build_path, register)
+                if not partition.objects and archive_full:
+                    archive_resources(writer, build_path,
+                                      entry_resources(register))
+
+            with profiler.phase("records"):
+                build_records(writer, register, shard_dirs, partition)
+
+            with profiler.phase("trails"):
+                build_trails(writer, register, shard_dirs, partition,
+                             entries)
+
+            if partition.indexes:
+                with profiler.phase("commands"):
+                    build_commands(writer, register, rsf_file,
+                                   source_size=source_size,
+                                   canonical=canonical)
+
+                with profiler.phase("context"):
+                    build_context(writer, register)
+
+                with profiler.phase("openapi"):
+                    build_openapi(writer, register)
+
+                with profiler.phase("etags"):
+                    build_etags(writer, register,
+                                available_encodings(encodings))
+
+            with profiler.phase("archive"):
+                writer.close()
+
+        if staging != output_path:
+            publish(staging, output_path)
+
+        utils.note(throughput(writer, time.perf_counter() - started))
+
+        if previous:
+            utils.note(f"Reused {writer.reused} unchanged files from the \
+previous build.")
+
+        if store:
+            utils.note(f"Linked {store.linked} files from {blob_store}, \
+{store.written} of them new.")
 
         click.secho("Built {} for target {}".format(register.uid, target),
                     fg="green",
@@ -126,125 +601,545 @@ def build_register(rsf_file, target):
     except RegistersException as err:
         error(str(err))
 
+    finally:
+        if staging is not None and staging != output_path:
+            remove_path(staging)
+
+        profiler.stop()
+
 
-def build_blobs(path: Path, register: Register):
+def load_register(rsf_file: str) -> Tuple[Register, bool]:
     """
-    Generates all blob files.
+    Loads the register from the given RSF file and checks it is ready to be
+    built. Also tells whether the file is canonical (see
+    ``rsf.read_canonical``).
+    """
+
+    cmds, canonical = rsf.read_canonical(rsf_file)
+
+    with utils.progressbar(range(1, len(cmds)),
+                           label="Loading register") as bar:
+        register = Register(cmds, lambda: bar.update(1))
+
+    utils.check_readiness(register)
+
+    return register, canonical
+
+
+def estimate_register(rsf_file: str, *,
+                      encodings: Optional[List[str]] = None,
+                      shard_dirs: bool = False, archive_full: bool = False):
+    """
+    Estimates the files, bytes (raw and gzip) and time of each family of
+    resources of the build out of a sample of them, without building it.
     """
 
-    if path.exists():
-        path.rmdir()
-    path.mkdir()
+    try:
+        started = time.perf_counter()
+        register, _ = load_register(rsf_file)
+        elapsed = time.perf_counter() - started
+
+        with TemporaryDirectory() as tmp:
+            estimator = Estimator(Path(tmp), encodings=encodings,
+                                  suffixes=COMPRESSIBLE_SUFFIXES)
+            estimator.add("load", 0, 0, 0, elapsed)
+            estimate_resources(estimator, register, shard_dirs, archive_full)
+
+        estimator.echo()
+
+    except RegistersException as err:
+        error(str(err))
+
+
+def estimate_resources(estimator: Estimator, register: Register,
+                       shard_dirs: bool = False, archive_full: bool = False):
+    """
+    Estimates every family of resources of the build.
+    """
 
     sch = register.schema()
-    headers = [attr.uid for attr in sch.attributes]
+    blobs = list(register.log.blobs.items())
+    entries = register.log.entries
+    records = list(register.records().items())
+    items_cache = FragmentCache([attr.uid for attr in sch.attributes])
+    entries_cache = entry_cache()
+    records_cache = FragmentCache(Record.headers(sch))
+
+    def pages(total):
+        return 2 * -(-total // PAGE_SIZE) + 1
+
+    estimator.measure(
+        "items", blobs,
+        lambda writer, pair: utils.write_fragment_resource(
+            writer, blob_resource(pair[0], shard_dirs),
+            items_cache.get(*pair), items_cache.header))
+    estimator.measure(
+        "items index", blobs,
+        lambda writer, sample: utils.write_fragments_resource(
+            writer, "items/index", [items_cache.get(*pair)
+                                    for pair in sample],
+            items_cache.header, keys=[repr(key) for key, _ in sample]),
+        per_element=False)
+    estimator.measure(
+        "entries", entries,
+        lambda writer, entry: utils.write_fragments_resource(
+            writer, f"entries/{entry.position}",
+            [entries_cache.get(entry.position, entry)],
+            entries_cache.header))
+    estimator.measure(
+        "entries index", entries,
+        lambda writer, sample: utils.write_fragments_resource(
+            writer, "entries/index", entries_cache.collection(sample),
+            entries_cache.header, offsets=True),
+        per_element=False)
+    estimator.measure(
+        "entries pages", entries,
+        lambda writer, sample: build_pages(
+            writer, "entries/pages", entries_cache.collection(sample),
+            entries_cache.header),
+        per_element=False, files=pages(len(entries)))
+    estimator.measure(
+        "records", records,
+        lambda writer, pair: utils.write_fragment_resource(
+            writer, shard_path("records", pair[0], key_shard(pair[0])
+                               if shard_dirs else None),
+            records_cache.get(*pair), records_cache.header))
+    estimator.measure(
+        "records index", records,
+        lambda writer, sample: utils.write_fragments_resource(
+            writer, "records/index", [records_cache.get(*pair)
+                                      for pair in sample],
+            records_cache.header, keys=[key for key, _ in sample]),
+        per_element=False)
+    estimator.measure(
+        "records pages", records,
+        lambda writer, sample: build_pages(
+            writer, "records/pages", [records_cache.get(*pair)
+                                      for pair in sample],
+            records_cache.header, [key for key, _ in sample]),
+        per_element=False, files=pages(len(records)))
+    estimator.measure(
+        "trails", records,
+        lambda writer, pair: build_record_trail(
+            writer, shard_path("records", pair[0], key_shard(pair[0])
+                               if shard_dirs else None),
+            register.trail(pair[0]), entries_cache))
+    estimator.measure(
+        "commands", register.commands,
+        lambda writer, sample: writer.write(
+            "commands.rsf", "".join(f"{command}\n"
+                                    for command in sample).encode("utf-8")),
+        per_element=False)
+
+    names = ARCHIVE_FULL_FAMILIES if archive_full else ARCHIVE_FAMILIES
+    archived = [family for family in estimator.families
+                if family["family"] in names]
+
+    size = sum(family["json-gzip-bytes"] for family in archived)
+
+    estimator.add("archive", 1, size, size,
+                  sum(family["json-gzip-time"] for family in archived))
+
+
+def staging_path(path: Path) -> Path:
+    """
+    The path the given build output is written to before being published.
+
+    >>> staging_path(Path("build/country.sqlite")).as_posix()
+    'build/.staging/country.sqlite'
+    """
+
+    return path.parent.joinpath(".staging", path.name)
+
+
+def publish(staging: Path, path: Path):
+    """
+    Swaps the staging build in place of the published one and removes the
+    latter.
+
+    Single files are replaced with an atomic rename. A directory cannot be
+    renamed over a non-empty directory so both are exchanged atomically
+    where the platform supports it, otherwise the published one is renamed
+    aside first and is missing for the time between both renames.
+    """
+
+    if staging.is_dir() and path.exists():
+        if not writers.exchange(staging, path):
+            aside = staging.with_name(f"{staging.name}.old")
+            remove_path(aside)
+            os.replace(path, aside)
+            os.replace(staging, path)
+            staging = aside
+
+        remove_path(staging)
+
+    else:
+        os.replace(staging, path)
+
+    try:
+        staging.parent.rmdir()
+    except OSError:
+        pass
+
+
+def remove_path(path: Path):
+    """
+    Removes the given file or directory tree if it exists.
+    """
+
+    if path.is_dir() and not path.is_symlink():
+        shutil.rmtree(path)
+    elif path.exists() or path.is_symlink():
+        path.unlink()
+
+
+def make_writer(output_format: str, path: Path, uid: str, *,
+                encodings: Optional[List[str]] = None,
+                jobs: Optional[int] = None, archive_level: int = 6,
+                archive_full: bool = False, archive: bool = True,
+                threaded: bool = False,
+                store: Optional[writers.BlobStore] = None,
+                previous: Optional[Path] = None) -> writers.Writer:
+    """
+    Creates the writer for the given output format, wrapped to stream the
+    archive unless disabled and to write the pre-compressed siblings if any
+    encoding is given.
+    """
+
+    writer = writers.make_writer(output_format, path, threaded=threaded,
+                                 jobs=jobs, store=store, previous=previous)
+
+    if "br" in (encodings or []) and brotli is None:
+        utils.note("Skipping brotli: the brotli package is not installed.")
+
+    encodings = available_encodings(encodings)
+
+    if encodings:
+        compressors = {COMPRESSED_SUFFIXES[encoding]: COMPRESSORS[encoding]
+                       for encoding in encodings}
+        writer = writers.CompressingWriter(writer, compressors,
+                                           COMPRESSIBLE_SUFFIXES, jobs)
+
+    if not archive:
+        return writer
+
+    return writers.ArchiveWriter(writer, uid, archive_level, archive_full,
+                                 jobs)
+
+
+def available_encodings(encodings: Optional[List[str]]) -> List[str]:
+    """
+    Filters out the encodings that cannot be produced, i.e. brotli when the
+    brotli package is not installed.
+    """
+
+    return [encoding for encoding in encodings or []
+            if encoding != "br" or brotli is not None]
+
+
+def throughput(writer: writers.Writer, elapsed: float) -> str:
+    """
+    Summarises what the writer wrote in the given time.
+
+    >>> writer = writers.Writer()
+    >>> writer.files, writer.bytes = 10, 4 * 1024 * 1024
+    >>> throughput(writer, 2)
+    'Wrote 10 files (4.0 MiB) in 2.0s, 2.0 MiB/s'
+    """
+
+    size = writer.bytes / 1024 / 1024
+    rate = size / elapsed if elapsed else 0
+
+    return f"Wrote {writer.files} files ({size:.1f} MiB) in {elapsed:.1f}s, \
+{rate:.1f} MiB/s"
+
+
+def build_targets(path: Path, register: Register, target: Optional[str],
+                  shard_dirs: bool = False):
+    """
+    Generates the files for the given publication target.
+    """
+
+    if target == "netlify":
+        build_target_resource("_redirects", "netlify", path)
+
+    if target == "docker":
+        build_docker(path, shard_dirs)
+
+    if target == "cloudfoundry":
+        build_cloudfoundry(path, register, shard_dirs)
+
+
+def build_blobs(writer: writers.Writer, register: Register,
+                shard_dirs: bool = False, partition: Partition = Partition()):
+    """
+    Generates all blob files.
+    """
+
+    sch = register.schema()
+    cache = FragmentCache([attr.uid for attr in sch.attributes])
     collection = register.log.blobs
 
-    write_resource(path.joinpath("index"),
-                   {repr(k): v for k, v in collection.items()},
-                   headers)
+    if partition.indexes:
+        utils.write_fragments_resource(writer, "items/index",
+                                       cache.collection(collection),
+                                       cache.header,
+                                       keys=[repr(k) for k in collection])
+
+    if not partition.objects:
+        return
 
     with utils.progressbar(collection.items(),
                            label='Building blobs') as bar:
 
         for key, blob in bar:
-            write_resource(path.joinpath(repr(key)), blob, headers)
+            if partition.item(key):
+                utils.write_fragment_resource(writer,
+                                              blob_resource(key, shard_dirs),
+                                              cache.get(key, blob),
+                                              cache.header)
 
 
-def build_entries(path: Path, register: Register):
+def entry_cache() -> FragmentCache:
     """
-    Generates all entry files.
+    Creates the cache for entry fragments, shared by the entry files and the
+    record trails.
     """
 
-    if path.exists():
-        path.rmdir()
+    return FragmentCache(Entry.headers(), key=attrgetter("position"))
 
-    path.mkdir()
 
-    headers = Entry.headers()
+def build_entries(writer: writers.Writer, register: Register,
+                  partition: Partition = Partition(),
+                  cache: Optional[FragmentCache] = None):
+    """
+    Generates all entry files.
+    """
+
+    cache = cache or entry_cache()
     collection = register.log.entries
 
-    write_resource(path.joinpath("index"), collection, headers)
+    if partition.indexes:
+        fragments = cache.collection(collection)
+
+        utils.write_fragments_resource(writer, "entries/index", fragments,
+                                       cache.header, offsets=True)
+        build_pages(writer, "entries/pages", fragments, cache.header)
+
+    if not partition.objects:
+        return
 
     with utils.progressbar(collection, label='Building entries') as bar:
         for entry in bar:
-            write_resource(path.joinpath(repr(entry.position)),
-                           [entry], headers)
+            if partition.entry(entry.position, len(collection)):
+                utils.write_fragments_resource(
+                    writer, f"entries/{entry.position}",
+                    [cache.get(entry.position, entry)], cache.header)
 
 
-def build_records(path: Path, register: Register):
+def build_records(writer: writers.Writer, register: Register,
+                  shard_dirs: bool = False,
+                  partition: Partition = Partition()):
     """
     Generates all record files.
     """
 
-    if path.exists():
-        path.rmdir()
-
-    path.mkdir()
-
     sch = register.schema()
-    headers = Record.headers(sch)
+    cache = FragmentCache(Record.headers(sch))
     collection = register.records()
 
-    write_resource(path.joinpath("index"), collection, headers)
+    if partition.indexes:
+        fragments = cache.collection(collection)
+        keys = list(collection.keys())
+
+        utils.write_fragments_resource(writer, "records/index", fragments,
+                                       cache.header, keys=keys)
+        build_pages(writer, "records/pages", fragments, cache.header, keys)
+
+    if not partition.objects:
+        return
 
     with utils.progressbar(collection.items(),
                            label='Building records') as bar:
         for key, record in bar:
-            write_resource(path.joinpath(key), record, headers)
+            if partition.record(key):
+                shard = key_shard(key) if shard_dirs else None
 
-            build_record_trail(path.joinpath(key), register.trail(key))
+                utils.write_fragment_resource(
+                    writer, shard_path("records", key, shard),
+                    cache.get(key, record), cache.header)
 
 
-def build_record_trail(path: Path, trail: List[Entry]):
+def build_trails(writer: writers.Writer, register: Register,
+                 shard_dirs: bool = False,
+                 partition: Partition = Partition(),
+                 cache: Optional[FragmentCache] = None):
     """
-    Generates the record trail.
+    Generates the trail of every record.
     """
 
-    if path.exists():
-        path.rmdir()
+    if not partition.objects:
+        return
 
-    path.mkdir()
-    path = path.joinpath("entries")
+    cache = cache or entry_cache()
 
-    write_resource(path, trail, headers=Entry.headers())
+    with utils.progressbar(register.records().keys(),
+                           label='Building trails') as bar:
+        for key in bar:
+            if partition.record(key):
+                shard = key_shard(key) if shard_dirs else None
 
+                build_record_trail(writer, shard_path("records", key, shard),
+                                   register.trail(key), cache)
 
-def build_commands(path: Path, register: Register):
+
+def blob_resource(blob_hash: Hash, shard_dirs: bool = False) -> str:
     """
-    Generates all RSF files.
+    Composes the resource name (without extension) for the given item.
     """
-    with open(f"{path}/commands.rsf", "w") as stream:
-        stream.write(rsf.dump(register.commands))
 
+    shard = blob_hash.digest[:SHARD_WIDTH] if shard_dirs else None
 
-def build_context(path: Path, register: Register):
+    return shard_path("items", repr(blob_hash), shard)
+
+
+def blob_resources(register: Register, shard_dirs: bool = False) -> List[str]:
     """
-    Generates context files.
+    The JSON resources of every item, in build order.
     """
 
-    context = register.context()
+    return [f"{blob_resource(key, shard_dirs)}.json"
+            for key in register.log.blobs.keys()]
 
-    utils.write_json_resource(path, context)
 
+def entry_resources(register: Register) -> List[str]:
+    """
+    The JSON resources of every entry, in build order.
+    """
+
+    return [f"entries/{entry.position}.json"
+            for entry in register.log.entries]
 
-def build_archive(path: Path, register: Register):
+
+def archive_resources(writer: writers.Writer, path: Path, names: List[str]):
     """
-    Generates the archive (zip) file.
+    Adds the given resources, already written to the build directory by the
+    shards, to the archive.
     """
 
-    with ZipFile(f"{path}/archive.zip", "w") as archive:
-        archive.write(f"{path}/items/index.json",
-                      f"{register.uid}/item/index.json")
-        archive.write(f"{path}/entries/index.json",
-                      f"{register.uid}/entry/index.json")
-        archive.write(f"{path}/records/index.json",
-                      f"{register.uid}/record/index.json")
-        archive.write(f"{path}/register.json",
-                      f"{register.uid}/register.json")
+    if not isinstance(writer, writers.ArchiveWriter):
+        return
+
+    with utils.progressbar(names, label="Archiving shards") as bar:
+        for name in bar:
+            writer.include(name, path.joinpath(name).read_bytes())
 
 
-def build_openapi(path: Path, register: Register):
+def shard_path(prefix: str, name: str, shard: Optional[str]) -> str:
+    """
+    Composes the resource name for the given name optionally nested in the
+    given shard directory.
+
+    >>> shard_path("records", "GB", "b4")
+    'records/b4/GB'
+    """
+
+    if shard is None:
+        return f"{prefix}/{name}"
+
+    return f"{prefix}/{shard}/{name}"
+
+
+def key_shard(key: str) -> str:
+    """
+    Computes the shard for a record key.
+
+    >>> key_shard("GB")
+    'b4'
+    """
+
+    return sha256(key.encode("utf-8")).hexdigest()[:SHARD_WIDTH]
+
+
+def build_pages(writer: writers.Writer, prefix: str,
+                fragments: List[utils.Fragment], header: str,
+                keys: Optional[List[str]] = None, size: int = PAGE_SIZE):
+    """
+    Generates the collection split in pages of a fixed size and a manifest
+    with the range of elements each page holds.
+
+    Pages have one element per line so the nginx lua module can serve a
+    `start`/`limit` slice by reading one or two pages.
+    """
+
+    pages = []
+
+    for number, offset in enumerate(range(0, len(fragments), size), 1):
+        chunk = fragments[offset:offset + size]
+        chunk_keys = keys[offset:offset + size] if keys is not None else None
+
+        utils.write_fragments_resource(writer, f"{prefix}/{number}", chunk,
+                                       header, keys=chunk_keys, lines=True)
+
+        pages.append({"page": number,
+                      "start": offset + 1,
+                      "end": offset + len(chunk)})
+
+    manifest = {"page-size": size,
+                "total": len(fragments),
+                "pages": pages}
+
+    utils.write_json_resource(writer, f"{prefix}/index", manifest)
+
+
+def build_record_trail(writer: writers.Writer, name: str, trail: List[Entry],
+                       cache: Optional[FragmentCache] = None):
+    """
+    Generates the record trail.
+    """
+
+    cache = cache or entry_cache()
+
+    utils.write_fragments_resource(writer, f"{name}/entries",
+                                   cache.collection(trail), cache.header)
+
+
+def build_commands(writer: writers.Writer, register: Register,
+                   source: Optional[str] = None, *,
+                   source_size: Optional[int] = None,
+                   canonical: bool = False):
+    """
+    Generates all RSF files.
+
+    The source RSF file the register was read from is copied as is when it
+    is ``canonical``, i.e. exactly the serialisation of the register
+    commands (see ``rsf.read_canonical``) and, if ``source_size`` is given,
+    still has the size it had when the register was loaded, so its root hash
+    is the one computed while loading it. Otherwise the commands are
+    serialised one by one.
+    """
+
+    if (source is not None and canonical and register.commands and
+            source_size in (None, os.path.getsize(source))):
+        writer.copy("commands.rsf", Path(source))
+        return
+
+    with writer.open_text("commands.rsf") as stream:
+        for command in register.commands:
+            stream.write(f"{command}\n")
+
+
+def build_context(writer: writers.Writer, register: Register):
+    """
+    Generates context files.
+    """
+
+    context = register.context()
+
+    utils.write_json_resource(writer, "register", context)
+
+
+def build_openapi(writer: writers.Writer, register: Register):
     """
     Generates the openapi file.
     """
@@ -263,11 +1158,70 @@ def build_openapi(path: Path, register: Register):
 
     openapi["components"]["schemas"]["Item"]["properties"] = item_props
 
-    with open(path.joinpath("openapi.json"), "w") as handle:
-        handle.write(json.dumps(openapi))
+    writer.write("openapi.json", json.dumps(openapi).encode("utf-8"))
 
 
-def build_cloudfoundry(path: Path, register: Register):
+def build_etags(writer: writers.Writer, register: Register,
+                encodings: Optional[List[str]] = None):
+    """
+    Generates the manifest with the register version, the pre-compressed
+    encodings and the ETags for the mutable resources and their
+    pre-compressed siblings.
+
+    The version is derived from the root hashes of both the log and the
+    metalog so any change to the data or the metadata yields a new version.
+    """
+
+    version = register_version(register)
+    encodings = encodings or []
+    resources = {}
+
+    for name in MUTABLE_RESOURCES:
+        resources[name] = resource_etag(version, name)
+
+        if Path(name).suffix in COMPRESSIBLE_SUFFIXES:
+            for encoding in encodings:
+                sibling = f"{name}{COMPRESSED_SUFFIXES[encoding]}"
+                resources[sibling] = resource_etag(version, name, encoding)
+
+    utils.write_json_resource(writer, "etags",
+                              {"version": version,
+                               "encodings": encodings,
+                               "resources": resources})
+
+
+def register_version(register: Register) -> str:
+    """
+    Computes the register version out of the log and metalog root hashes.
+    """
+
+    roots = f"{register.log.digest()}{register.metalog.digest()}"
+
+    return sha256(roots.encode("utf-8")).hexdigest()
+
+
+def resource_etag(version: str, name: str,
+                  encoding: Optional[str] = None) -> str:
+    """
+    Composes the strong ETag for the given resource. Each representation
+    (csv, json) and content coding (gzip, br) gets its own ETag.
+
+    >>> resource_etag("abc", "records/index.json")
+    '"abc.json"'
+    >>> resource_etag("abc", "records/index.json", "gzip")
+    '"abc.json.gzip"'
+    """
+
+    tag = f"{version}.{Path(name).suffix[1:]}"
+
+    if encoding:
+        tag = f"{tag}.{encoding}"
+
+    return f'"{tag}"'
+
+
+def build_cloudfoundry(path: Path, register: Register,
+                       shard_dirs: bool = False):
     """
     Creates files for the cloudfoundry target.
     """
@@ -281,7 +1235,8 @@ def build_cloudfoundry(path: Path, register: Register):
         env = Environment(loader=PackageLoader("registers", "data"),
                           autoescape=True)
         template = env.get_template("nginx/nginx.conf")
-        handle.write(template.render(port="{{port}}"))
+        handle.write(template.render(port="{{port}}",
+                                     shard_dirs=shard_dirs))
 
     with open(path.joinpath("manifest.yml"), "w") as handle:
         filename = "data/cloudfoundry/manifest.yml"
@@ -293,7 +1248,7 @@ def build_cloudfoundry(path: Path, register: Register):
         handle.write(yaml.dump(manifest))
 
 
-def build_docker(path: Path):
+def build_docker(path: Path, shard_dirs: bool = False):
     """
     Creates files for the docker target.
     """
@@ -307,7 +1262,7 @@ def build_docker(path: Path):
         env = Environment(loader=PackageLoader("registers", "data"),
                           autoescape=True)
         template = env.get_template("nginx/default.conf")
-        handle.write(template.render(port=80))
+        handle.write(template.render(port=80, shard_dirs=shard_dirs))
 
 
 def build_lua_resources(path: Path):
@@ -315,7 +1270,7 @@ def build_lua_resources(path: Path):
     Creates files for nginx lua files.
     """
 
-    path.joinpath("lua").mkdir()
+    path.joinpath("lua").mkdir(parents=True, exist_ok=True)
 
     build_target_resource("lua/registers.lua", "nginx", path)
     build_target_resource("lua/utils.lua", "nginx", path)
@@ -338,12 +1293,3 @@ def _attr_schema(attribute) -> Union[str, Dict]:
         return {"type": "string"}
 
     return {"type": "array", "items": {"type": "string"}}
-
-
-def write_resource(path: Path, obj, headers):
-    """
-    Generates the pair of files (csv, json) for the given object.
-    """
-
-    utils.write_csv_resource(path, obj, headers)
-    utils.write_json_resource(path, obj)
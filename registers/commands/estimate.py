@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+
+"""
+This module implements the build size and time estimator.
+
+
+:copyright: © 2019 Crown Copyright (Government Digital Service)
+:license: MIT, see LICENSE for more details.
+"""
+
+import gzip
+import random
+import time
+from pathlib import Path, PurePosixPath
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from . import utils
+from .writers import DirectoryWriter, Writer
+
+
+SAMPLE_SIZE = 200
+
+
+class SampleWriter(DirectoryWriter):
+    """
+    Directory writer that keeps what it writes so it can be measured.
+    """
+
+    def __init__(self, root: Path):
+        super().__init__(root)
+        self.resources: List[Tuple[str, bytes]] = []
+
+    def _write(self, name: str, data: bytes):
+        super()._write(name, data)
+        self.resources.append((name, data))
+
+    def open(self, name: str):
+        return Writer.open(self, name)
+
+    def reset(self):
+        """
+        Forgets everything written so far.
+        """
+
+        self.files = 0
+        self.bytes = 0
+        self.resources = []
+
+
+class Estimator:
+    """
+    Predicts the files, bytes (raw and gzip) and time of each family of
+    resources of a build by writing a sample of it to a temporary directory
+    and scaling the measures up to the size of the family.
+
+    Time accounts for serialising and writing the sample on the temporary
+    directory with a single worker, plus compressing it when the build
+    pre-compresses resources.
+    """
+
+    def __init__(self, root: Path, sample_size: int = SAMPLE_SIZE,
+                 encodings: Optional[List[str]] = None,
+                 suffixes: Optional[List[str]] = None):
+        self.writer = SampleWriter(root)
+        self.sample_size = sample_size
+        self.encodings = encodings or []
+        self.suffixes = suffixes or []
+        self.families: List[Dict[str, Any]] = []
+        self._random = random.Random(0)
+
+    def measure(self, family: str, elements: List,
+                write: Callable[[Writer, Any], None],
+                per_element: bool = True, files: Optional[int] = None):
+        """
+        Estimates the given family.
+
+        If ``per_element`` is true ``write`` is called with each element of
+        the sample and every measure is scaled. Otherwise it is called once
+        with the whole sample and the number of files is taken as is, or
+        from ``files`` when given.
+        """
+
+        total = len(elements)
+        sample = self._random.sample(elements, min(self.sample_size, total))
+        scale = total / len(sample) if sample else 0
+
+        self.writer.reset()
+        started = time.perf_counter()
+
+        if per_element:
+            for element in sample:
+                write(self.writer, element)
+        else:
+            write(self.writer, sample)
+
+        elapsed = time.perf_counter() - started
+        started = time.perf_counter()
+        compressed = {name: len(gzip.compress(data))
+                      for name, data in self.writer.resources}
+        compress_time = time.perf_counter() - started
+
+        count = self.writer.files
+        siblings = len([name for name in compressed
+                        if PurePosixPath(name).suffix in self.suffixes])
+
+        if per_element:
+            count = round(count * scale)
+            siblings = round(siblings * scale)
+        elif files is not None:
+            siblings = round(siblings * files / max(count, 1))
+            count = files
+
+        estimate = {
+            "family": family,
+            "files": count + siblings * len(self.encodings),
+            "bytes": round(self.writer.bytes * scale),
+            "gzip-bytes": round(sum(compressed.values()) * scale),
+            "time": elapsed * scale,
+            "json-gzip-bytes": round(sum(
+                size for name, size in compressed.items()
+                if name.endswith(".json")) * scale),
+            "json-gzip-time": compress_time * scale,
+        }
+
+        if self.encodings:
+            estimate["bytes"] += estimate["gzip-bytes"] * len(self.encodings)
+            estimate["time"] += compress_time * scale * len(self.encodings)
+
+        self.families.append(estimate)
+
+        return estimate
+
+    def add(self, family: str, files: int, size: int, compressed: int,
+            seconds: float):
+        """
+        Adds a family estimated by other means.
+        """
+
+        self.families.append({"family": family,
+                              "files": files,
+                              "bytes": size,
+                              "gzip-bytes": compressed,
+                              "time": seconds})
+
+    def report(self) -> List[Dict[str, Any]]:
+        """
+        The estimate of every family and their total.
+        """
+
+        keys = ["files", "bytes", "gzip-bytes", "time"]
+        rows = [{key: family[key] for key in ["family"] + keys}
+                for family in self.families]
+        total = {key: sum(row[key] for row in rows) for key in keys}
+        total["family"] = "total"
+
+        return rows + [total]
+
+    def echo(self):
+        """
+        Prints the estimate as a table.
+        """
+
+        headers = ["family", "files", "bytes", "gzip-bytes", "time"]
+
+        utils.echo_table(headers, [[format_estimate(key, row[key])
+                                    for key in headers]
+                                   for row in self.report()])
+
+
+def format_estimate(key: str, value) -> str:
+    """
+    Formats an estimate for the table.
+
+    >>> format_estimate("bytes", 5 * 1024 * 1024)
+    '5.0MiB'
+    >>> format_estimate("time", 90.5)
+    '1m30s'
+    """
+
+    if key in ["bytes", "gzip-bytes"]:
+        return f"{value / 1024 / 1024:.1f}MiB"
+
+    if key == "time":
+        minutes, seconds = divmod(round(value), 60)
+
+        return f"{minutes}m{seconds:02d}s" if minutes else f"{value:.1f}s"
+
+    return str(value)
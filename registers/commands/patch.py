@@ -8,14 +8,29 @@ This module implements the patch command group.
 :license: MIT, see LICENSE for more details.
 """
 
+import csv
+import json
+import os
+import shutil
+from collections import ChainMap, Counter
 from datetime import datetime
+from tempfile import NamedTemporaryFile, TemporaryFile
+from typing import Any, Callable, Dict, List, Optional, cast
 import click
-from .. import rsf, xsv, Register, Patch
-from ..exceptions import RegistersException
+from .. import index, merkle, rsf, validator, xsv, Register, Patch, Entry, Hash
+from ..entry import Scope
+from ..exceptions import (RegistersException, CommandError, DuplicatedEntry,
+                          ValidationError)
 from ..core import format_timestamp
+from ..rsf import Command
 from . import utils
 
 
+MAX_ERRORS = 1000
+REPORT_FIELDS = ["row", "column", "value", "reason"]
+SPOOL_CHUNK_SIZE = 64 * 1024
+
+
 @click.group(name="patch")
 def patch_group():
     """
@@ -32,7 +47,26 @@ patch.")
               help="An RSF file with valid metadata")
 @click.option("--apply", "apply_flag", is_flag=True,
               help="Apply the patch to the given RSF file.")
-def create_command(xsv_file, rsf_file, timestamp, apply_flag):
+@click.option("--jobs", type=click.IntRange(min=1),
+              help="Coerce and validate rows in parallel with the given \
+number of processes.")
+@click.option("--value-cache-size", type=click.IntRange(min=0),
+              default=validator.VALUE_CACHE_SIZE, show_default=True,
+              help="Number of value checks to memoise. 0 turns it off.")
+@click.option("--report", "report_file", type=click.Path(dir_okay=False),
+              help="Validate every row and write the errors found to the \
+given file, as CSV if it ends with `.csv` and as JSON otherwise.")
+@click.option("--max-errors", type=click.IntRange(min=1), default=MAX_ERRORS,
+              show_default=True,
+              help="Stop collecting errors for `--report` after this many.")
+@click.option("--skip-unchanged", is_flag=True,
+              help="Leave out rows identical to the current record.")
+@click.option("--index", "index_flag", is_flag=True,
+              help="Keep the register index in a sidecar next to the RSF \
+file and only read what was appended since.")
+def create_command(xsv_file, rsf_file, timestamp, apply_flag, jobs,
+                   value_cache_size, report_file, max_errors, skip_unchanged,
+                   index_flag):
     """
     Creates an RSF patch from XSV_FILE.
 
@@ -42,38 +76,94 @@ def create_command(xsv_file, rsf_file, timestamp, apply_flag):
 
     You must not use `;` as separator as it will conflict with cardinality 'n'
     value separator.
+
+    Rows are read, coerced and validated one at a time and the RSF commands
+    are written to a temporary file as they are produced, so memory does
+    not grow with the size of XSV_FILE. The file is printed, or appended to
+    the RSF file with `--apply`, once the whole patch is valid.
+
+    With `--jobs` rows are coerced and validated in chunks by a pool of
+    processes. The result is identical to the serial one.
+
+    The outcome of checking each value against its datatype is memoised in
+    a bounded LRU cache as the same values tend to repeat across rows. Its
+    hits and misses are reported on stderr, except with `--jobs` where each
+    worker process has its own cache.
+
+    With `--report` every row is validated instead of stopping at the first
+    invalid one. Each error is reported with its row number (1 being the
+    first row after the header), column, value and reason. The patch is not
+    sealed nor applied if any error is found.
+
+    With `--skip-unchanged` rows whose blob is the same as the one of the
+    current record for their key are left out of the patch instead of
+    failing as duplicated entries, so a full export can be re-imported as a
+    minimal patch. If every row is unchanged there is no patch to create or
+    apply and only the counts are reported.
+
+    The register is not loaded. Only the Merkle frontier of its log, the
+    latest blob hash for every key and its metadata are read from the RSF
+    file. With `--index` they are kept in RSF_FILE.index so later patches
+    only read what was appended to the RSF file since.
     """
 
-    try:
-        patch = create(xsv_file, rsf_file, timestamp,
-                       apply_flag=apply_flag)
+    report: Optional[List[Dict[str, Any]]] = [] if report_file else None
+    counts: "Counter[str]" = Counter()
+    sidecar = index.sidecar_path(rsf_file) if index_flag else None
 
+    try:
         if apply_flag:
-            number = len(patch.commands)
+            number = create_apply(xsv_file, rsf_file, timestamp, jobs=jobs,
+                                  value_cache_size=value_cache_size,
+                                  report=report, max_errors=max_errors,
+                                  skip_unchanged=skip_unchanged,
+                                  counts=counts, sidecar=sidecar)
             msg = f"Appended {number} changes to {rsf_file}"
 
             utils.success(msg)
 
         else:
-            for command in patch.commands:
-                click.echo(command)
+            create_echo(xsv_file, rsf_file, timestamp, jobs=jobs,
+                        value_cache_size=value_cache_size, report=report,
+                        max_errors=max_errors, skip_unchanged=skip_unchanged,
+                        counts=counts, sidecar=sidecar)
+
+        if skip_unchanged:
+            utils.note(f"Skipped {counts['skipped']} unchanged rows, found \
+{counts['changed']} changed and {counts['new']} new.", err=not apply_flag)
+
+        if counts["cache-hits"] or counts["cache-misses"]:
+            utils.note(f"Value cache: {counts['cache-hits']} hits, \
+{counts['cache-misses']} misses.", err=True)
 
     except RegistersException as err:
         utils.error(str(err))
 
+    finally:
+        if report is not None:
+            write_report(report_file, report)
+
 
 @patch_group.command(name="apply")
-@click.argument("patch_file")
+@click.argument("patch_files", nargs=-1, required=True,
+                type=click.Path(exists=True))
 @click.option("--rsf", "rsf_file", required=True, type=click.Path(exists=True),
               help="An RSF file with valid metadata")
-def apply_command(patch_file, rsf_file):
+def apply_command(patch_files, rsf_file):
     """
-    Applies PATCH_FILE to the given RSF file.
+    Applies every PATCH_FILE, in the given order, to the given RSF file.
+
+    A directory can be given instead of a patch file, in which case the
+    `.rsf` files it contains are applied in name order.
+
+    The register is loaded once and each patch is checked against the state
+    left by the previous ones. The patches are appended in a single write
+    only if all of them are valid.
     """
 
     try:
-        patch = apply(patch_file, rsf_file)
-        number = len(patch.commands)
+        patches = apply_all(patch_paths(patch_files), rsf_file)
+        number = sum(len(patch.commands) for patch in patches)
         msg = f"Appended {number} changes to {rsf_file}"
 
         utils.success(msg)
@@ -82,36 +172,223 @@ def apply_command(patch_file, rsf_file):
         utils.error(str(err))
 
 
-def create(xsv_file: str, rsf_file: str,
-           timestamp: str, apply_flag: bool = False) -> Patch:
+def create(xsv_file: str, rsf_file: str, timestamp: str,
+           emit: Callable[[Command], None], *, jobs: Optional[int] = None,
+           value_cache_size: Optional[int] = None,
+           report: Optional[List[Dict[str, Any]]] = None,
+           max_errors: int = MAX_ERRORS, skip_unchanged: bool = False,
+           counts: Optional["Counter[str]"] = None,
+           state: Optional[index.Index] = None) -> int:
     """
-    Creates an RSF patch.
+    Creates a sealed RSF patch, handing every command over to ``emit`` as it
+    is produced. Returns the number of commands, which is 0 when every row
+    is left out by ``skip_unchanged`` as nothing is emitted then.
+
+    The register is never loaded: the start and end root hashes and the
+    duplicate checks come from the register index, ``state``, read from the
+    RSF file when not given. It is left untouched.
+
+    When ``report`` is given every row is validated and each error found is
+    appended to it until ``max_errors`` is reached. If there is any, a
+    ``CommandError`` is raised instead of sealing the patch.
+
+    With ``skip_unchanged`` rows whose blob digest is the one of the current
+    record for their key are left out. The number of skipped, changed and
+    new rows is added up in ``counts`` when given, as well as the hits and
+    misses of the value cache when rows are validated in this process.
     """
 
-    cmds = rsf.read(rsf_file)
-    register = Register(cmds)
+    state = state or index.load(rsf_file)
 
-    utils.check_readiness(register)
+    utils.check_readiness(state.metadata())
 
-    schema = register.schema()
+    schema = state.schema()
+    schema.compile_validator(value_cache_size)
+    frontier = merkle.Frontier.restore(state.frontier.nodes,
+                                       state.frontier.width)
+    records: "ChainMap[str, Hash]" = ChainMap({}, state.records)
+    errors: List[ValidationError] = []
+    number = 2
+    counts = Counter() if counts is None else counts
 
     with open(xsv_file, "r", newline="") as handle:
-        blobs = xsv.deserialise(handle, schema)
-        patch = Patch(schema, blobs, timestamp)
-        start_root_hash = register.log.digest()
+        for row, blob in _read(handle, schema, jobs, report):
+            if blob is None:
+                if len(cast(list, report)) >= max_errors:
+                    break
 
-        errors = register.apply(patch)
+                continue
 
-        if errors:
-            utils.error(errors)
+            key = cast(str, blob.get(schema.primary_key))
+            digest = blob.digest()
+            unchanged = key in records and records[key] == digest
 
-        end_root_hash = register.log.digest()
-        patch.seal(start_root_hash, end_root_hash)
+            if unchanged and skip_unchanged:
+                counts["skipped"] += 1
+                continue
 
-        if apply_flag:
-            return _apply(patch, rsf_file)
+            entry = Entry(key, Scope.User, timestamp, digest)
+
+            if number == 2:
+                emit(rsf.assert_root_hash(state.digest()))
+
+            emit(rsf.add_item(blob))
+            emit(rsf.append_entry(entry))
+            number += 2
+
+            if unchanged:
+                errors.append(DuplicatedEntry(key, blob))
+
+                if report is None:
+                    continue
+
+                report.append({"row": row, "column": schema.primary_key,
+                               "value": key, "reason": str(errors[-1])})
+
+                if len(report) >= max_errors:
+                    break
+
+                continue
+
+            counts["changed" if key in records else "new"] += 1
+            records[key] = digest
+            entry.set_position(frontier.width + 1)
+            frontier.append(entry.bytes())
+
+    cache = schema.compile_validator().cache
+
+    if cache is not None:
+        counts["cache-hits"] += cache.hits
+        counts["cache-misses"] += cache.misses
+
+    if report:
+        if len(report) >= max_errors:
+            raise CommandError(f"Stopped after {len(report)} errors.")
+
+        raise CommandError(f"Found {len(report)} errors.")
+
+    if errors:
+        utils.error(errors)
+
+    if number == 2 and counts["skipped"]:
+        return 0
+
+    if number == 2:
+        raise CommandError("A patch must receive some data")
+
+    emit(rsf.assert_root_hash(Hash("sha-256", frontier.root_hash.hex())))
+
+    return number
+
+
+def _read(handle, schema, jobs: Optional[int],
+          report: Optional[List[Dict[str, Any]]]):
+    """
+    Yields the row number and blob of each row of the XSV stream. In
+    collecting mode the errors of an invalid row are appended to ``report``
+    and ``None`` is yielded in place of the blob.
+    """
+
+    if report is None:
+        yield from enumerate(xsv.deserialise_stream(handle, schema, jobs), 1)
+        return
+
+    for row, (blob, cell_errors) in enumerate(
+            xsv.deserialise_report(handle, schema, jobs), 1):
+        report.extend({"row": row, "column": error.column,
+                       "value": error.value, "reason": error.reason}
+                      for error in cell_errors)
+
+        yield row, blob
+
+
+def write_report(filename: str, report: List[Dict[str, Any]]):
+    """
+    Writes a validation report as CSV if the filename ends with `.csv` and
+    as JSON otherwise.
+    """
+
+    with open(filename, "w", newline="") as stream:
+        if filename.endswith(".csv"):
+            writer = csv.DictWriter(stream, fieldnames=REPORT_FIELDS)
+            writer.writeheader()
+            writer.writerows(report)
+        else:
+            json.dump(report, stream, indent=2)
+
+
+def create_echo(xsv_file: str, rsf_file: str, timestamp: str, *,
+                jobs: Optional[int] = None,
+                value_cache_size: Optional[int] = None,
+                report: Optional[List[Dict[str, Any]]] = None,
+                max_errors: int = MAX_ERRORS, skip_unchanged: bool = False,
+                counts: Optional["Counter[str]"] = None,
+                sidecar: Optional[str] = None) -> int:
+    """
+    Creates an RSF patch and prints it once complete, so nothing is printed
+    for an invalid patch. Returns the number of commands.
+    """
+
+    state = index.load(rsf_file, sidecar)
+
+    with TemporaryFile("w+", encoding="utf-8") as spool:
+        def emit(command: Command):
+            spool.write(f"{command}\n")
+
+        number = create(xsv_file, rsf_file, timestamp, emit, jobs=jobs,
+                        value_cache_size=value_cache_size, report=report,
+                        max_errors=max_errors, skip_unchanged=skip_unchanged,
+                        counts=counts, state=state)
+        spool.seek(0)
+
+        for chunk in iter(lambda: spool.read(SPOOL_CHUNK_SIZE), ""):
+            click.echo(chunk, nl=False)
+
+    return number
+
+
+def create_apply(xsv_file: str, rsf_file: str, timestamp: str, *,
+                 jobs: Optional[int] = None,
+                 value_cache_size: Optional[int] = None,
+                 report: Optional[List[Dict[str, Any]]] = None,
+                 max_errors: int = MAX_ERRORS, skip_unchanged: bool = False,
+                 counts: Optional["Counter[str]"] = None,
+                 sidecar: Optional[str] = None) -> int:
+    """
+    Creates an RSF patch and appends it to the given RSF file once complete.
+    Returns the number of commands of the sealed patch.
+
+    The index sidecar, if given, is brought up to date with the patch.
+    """
+
+    state = index.load(rsf_file, sidecar)
+    directory = os.path.dirname(os.path.abspath(rsf_file))
+
+    with NamedTemporaryFile("w+", dir=directory, suffix=".rsf") as temp:
+        emitted: List[Command] = []
+
+        def emit(command: Command):
+            # The start root hash asserts the current end of the RSF file.
+            if emitted:
+                temp.write(f"{command}\n")
+            else:
+                emitted.append(command)
+
+        number = create(xsv_file, rsf_file, timestamp, emit, jobs=jobs,
+                        value_cache_size=value_cache_size, report=report,
+                        max_errors=max_errors, skip_unchanged=skip_unchanged,
+                        counts=counts, state=state)
+        temp.seek(0)
+
+        if number:
+            with open(rsf_file, "a") as handle:
+                shutil.copyfileobj(temp, handle)
 
-        return patch
+    if sidecar:
+        state.update(rsf_file)
+        index.dump(state, sidecar)
+
+    return number
 
 
 def apply(patch_file: str, rsf_file: str) -> Patch:
@@ -119,34 +396,76 @@ def apply(patch_file: str, rsf_file: str) -> Patch:
     Applies an RSF patch.
     """
 
-    cmds = rsf.read(rsf_file)
-    register = Register(cmds)
+    return apply_all([patch_file], rsf_file)[0]
+
+
+def apply_all(patch_files: List[str], rsf_file: str) -> List[Patch]:
+    """
+    Applies the given RSF patches in order, loading the register once.
+
+    Every patch is validated against the register as left by the previous
+    ones, so the start root hash of a sealed patch has to match the end root
+    hash of the previous patch. Nothing is appended unless all of them are
+    valid.
+    """
+
+    register = Register(rsf.read(rsf_file))
 
     utils.check_readiness(register)
 
     schema = register.schema()
+    patches: List[Patch] = []
 
-    patch_cmds = rsf.read(patch_file)
-    patch = Patch(schema, patch_cmds)
-    errors = register.apply(patch)
+    for patch_file in patch_files:
+        patch = Patch(schema, rsf.read(patch_file))
 
-    if errors:
-        utils.error(errors)
+        try:
+            errors = register.apply(patch)
+        except RegistersException as err:
+            raise CommandError(f"{patch_file}: {err}")
+
+        if errors:
+            utils.error([f"{patch_file}: {error}" for error in errors])
 
-    return _apply(patch, rsf_file)
+        patches.append(patch)
 
+    return _apply(patches, rsf_file)
 
-def _apply(patch: Patch, rsf_file: str) -> Patch:
+
+def _apply(patches: List[Patch], rsf_file: str) -> List[Patch]:
     """
-    Applies a patch and saves RSF to the given file.
+    Applies the patches and saves RSF to the given file in a single write,
+    synced to disk.
     """
 
-    if patch.is_sealed():
-        cmds = patch.commands[1:]
-    else:
-        cmds = patch.commands
+    lines: List[str] = []
+
+    for patch in patches:
+        cmds = patch.commands[1:] if patch.is_sealed() else patch.commands
+        lines.extend(f"{cmd}\n" for cmd in cmds)
 
     with open(rsf_file, "a") as handle:
-        handle.writelines([f"{cmd}\n" for cmd in cmds])
+        handle.write("".join(lines))
+        handle.flush()
+        os.fsync(handle.fileno())
+
+    return patches
+
+
+def patch_paths(paths: List[str]) -> List[str]:
+    """
+    Expands every directory in the given list of paths to the `.rsf` files it
+    contains, in name order.
+    """
+
+    result: List[str] = []
+
+    for path in paths:
+        if os.path.isdir(path):
+            result.extend(sorted(os.path.join(path, name)
+                                 for name in os.listdir(path)
+                                 if name.endswith(".rsf")))
+        else:
+            result.append(path)
 
-    return patch
+    return result
@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+
+"""
+This module implements the per-phase profiler for the build command.
+
+
+:copyright: © 2019 Crown Copyright (Government Digital Service)
+:license: MIT, see LICENSE for more details.
+"""
+
+import json
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Union
+from . import utils
+from .writers import Writer
+
+try:
+    import resource
+except ImportError:
+    resource = None  # type: ignore
+
+
+Measure = Union[str, int, float]
+
+
+class Profiler:
+    """
+    Records the wall time, CPU time, memory and output of each phase of a
+    build.
+
+    Memory is the tracemalloc peak of the phase and the peak resident set
+    size of the process so far. Files and bytes are read from the writer
+    once it is set. When disabled every phase is a no-op.
+    """
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self.writer: Optional[Writer] = None
+        self.phases: List[Dict[str, Measure]] = []
+
+    def start(self):
+        """
+        Starts tracing memory allocations.
+        """
+
+        if self.enabled and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def stop(self):
+        """
+        Stops tracing memory allocations.
+        """
+
+        if self.enabled and tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """
+        Measures the enclosed block as the given phase.
+        """
+
+        if not self.enabled:
+            yield
+            return
+
+        if hasattr(tracemalloc, "reset_peak"):
+            tracemalloc.reset_peak()
+
+        files, written = self._output()
+        wall = time.perf_counter()
+        cpu = time.process_time()
+
+        yield
+
+        _, peak = tracemalloc.get_traced_memory()
+        end_files, end_written = self._output()
+
+        self.phases.append({
+            "phase": name,
+            "wall": round(time.perf_counter() - wall, 6),
+            "cpu": round(time.process_time() - cpu, 6),
+            "peak-memory": peak,
+            "max-rss": max_rss(),
+            "files": end_files - files,
+            "bytes": end_written - written,
+        })
+
+    def _output(self):
+        if self.writer is None:
+            return 0, 0
+
+        return self.writer.files, self.writer.bytes
+
+    def report(self) -> Dict:
+        """
+        The measures of every phase and their total.
+        """
+
+        total: Dict[str, Measure] = {"phase": "total"}
+
+        for key in ["wall", "cpu", "files", "bytes"]:
+            total[key] = round(sum(phase[key]  # type: ignore
+                                   for phase in self.phases), 6)
+
+        for key in ["peak-memory", "max-rss"]:
+            total[key] = max([phase[key] for phase in self.phases],
+                             default=0)
+
+        return {"phases": self.phases, "total": total}
+
+    def dump(self, filename: str):
+        """
+        Writes the report as JSON.
+        """
+
+        with open(filename, "w") as stream:
+            json.dump(self.report(), stream, indent=2)
+
+    def echo(self):
+        """
+        Prints the report as a table.
+        """
+
+        report = self.report()
+        rows = report["phases"] + [report["total"]]
+        headers = ["phase", "wall", "cpu", "peak-memory", "max-rss",
+                   "files", "bytes"]
+
+        utils.echo_table(headers, [[format_measure(key, row[key])
+                                    for key in headers]
+                                   for row in rows])
+
+
+def format_measure(key: str, value: Measure) -> str:
+    """
+    Formats a measure for the table.
+
+    >>> format_measure("wall", 1.23456)
+    '1.235s'
+    >>> format_measure("max-rss", 3 * 1024 * 1024)
+    '3.0MiB'
+    """
+
+    if key in ["wall", "cpu"]:
+        return f"{value:.3f}s"
+
+    if key in ["peak-memory", "max-rss", "bytes"]:
+        return f"{int(value) / 1024 / 1024:.1f}MiB"
+
+    return str(value)
+
+
+def max_rss() -> int:
+    """
+    The peak resident set size of the process in bytes or 0 if the platform
+    does not report it.
+    """
+
+    if resource is None:
+        return 0
+
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    return usage if sys.platform == "darwin" else usage * 1024
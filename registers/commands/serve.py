@@ -0,0 +1,297 @@
+# -*- coding: utf-8 -*-
+
+"""
+This module implements the serve command.
+
+
+:copyright: © 2019 Crown Copyright (Government Digital Service)
+:license: MIT, see LICENSE for more details.
+"""
+
+import json
+import re
+import struct
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qs
+from wsgiref.simple_server import make_server
+import click
+from . import utils
+from .build import SHARD_WIDTH, key_shard, shard_path
+from .writers import Store, open_store
+
+
+ALIASES = {
+    "": "openapi.json",
+    "register": "register.json",
+    "download-register": "archive.zip",
+    "download-rsf": "commands.rsf",
+    "commands": "commands.rsf",
+    "entries": "entries/index",
+    "records": "records/index",
+    "items": "items/index",
+}
+LEGACY_RE = re.compile(r"^(record|entry|item)/")
+LEGACY = {"record": "records/", "entry": "entries/", "item": "items/"}
+FORMAT_RE = re.compile(r"^(.*)\.(csv|json)$")
+ITEM_RE = re.compile(r"^items/(sha-256:[a-f\d]{64})$")
+RECORD_RE = re.compile(r"^records/(.+?)(/entries)?$")
+STATUS = {200: "200 OK",
+          400: "400 Bad Request",
+          404: "404 Not Found"}
+
+
+@click.command(name="serve")
+@click.argument("build_file", type=click.Path(exists=True, dir_okay=False))
+@click.option("--host", default="127.0.0.1", show_default=True)
+@click.option("--port", type=int, default=8000, show_default=True)
+def serve_command(build_file, host, port):
+    """
+    Serves the REST API (V1) from the BUILD_FILE generated by
+    `registers build --output-format sqlite|tar`.
+
+    It is meant to try and benchmark a build locally, not for production.
+    """
+
+    app = Application(open_store(build_file))
+
+    with make_server(host, port, app) as server:
+        utils.note(f"Serving {build_file} on http://{host}:{port}")
+
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+
+class HttpError(Exception):
+    """
+    Error with the same payload as the nginx lua module.
+    """
+
+    def __init__(self, status: int, kind: str, message: str):
+        super().__init__(message)
+        self.status = status
+        self.payload = {"type": kind, "message": message}
+
+    @classmethod
+    def not_found(cls):
+        """
+        Resource not found.
+        """
+
+        return cls(404, "not_found", "404 Not Found")
+
+    @classmethod
+    def unexpected_parameter(cls, message):
+        """
+        Invalid query parameter.
+        """
+
+        return cls(400, "unexpected_parameter", message)
+
+
+class Application:
+    """
+    WSGI application mapping the REST API (V1) paths to the resources of a
+    single-file build, mirroring the nginx configuration.
+    """
+
+    def __init__(self, store: Store):
+        self.store = store
+
+    def __call__(self, environ, start_response):
+        try:
+            query = parse_qs(environ.get("QUERY_STRING", ""))
+            name = resolve(environ.get("PATH_INFO", "/"),
+                           environ.get("HTTP_ACCEPT"))
+            content_type, body = self.get(name, query)
+            status = 200
+
+        except HttpError as err:
+            status = err.status
+            content_type = "application/json"
+            body = json.dumps(err.payload).encode("utf-8")
+
+        start_response(STATUS[status],
+                       [("Content-Type", content_type),
+                        ("Content-Length", str(len(body)))])
+
+        return [body]
+
+    def get(self, name: str,
+            query: Dict[str, List[str]]) -> Tuple[str, bytes]:
+        """
+        Reads the given resource, or the slice requested by the `start` and
+        `limit` query parameters for the entries and records indexes.
+        """
+
+        start = query.get("start", [None])[0]
+        limit = query.get("limit", [None])[0]
+        collection, _, fmt = name.partition("/index.")
+        sliced = start is not None or limit is not None
+
+        if collection == "entries" and limit is not None:
+            return self.paginate(collection, fmt, start, limit)
+
+        if collection == "entries" and start is not None:
+            return self.tail(name, start)
+
+        if collection == "records" and sliced:
+            return self.paginate(collection, fmt, start, limit)
+
+        return self.read(name)
+
+    def read(self, name: str) -> Tuple[str, bytes]:
+        """
+        Reads the given resource falling back to the sharded layout.
+        """
+
+        for candidate in [name, sharded(name)]:
+            resource = candidate and self.store.get(candidate)
+
+            if resource:
+                return resource
+
+        raise HttpError.not_found()
+
+    def tail(self, name: str, start_arg: str) -> Tuple[str, bytes]:
+        """
+        Reads the index from the `start` element onwards using the offsets
+        sidecar.
+        """
+
+        start = toint(start_arg)
+
+        if start is None:
+            raise HttpError.unexpected_parameter(
+                f"Expected an integer but got {start_arg}")
+
+        content_type, data = self.read(name)
+        _, sidecar = self.read(f"{name}.offsets")
+        position = (max(start, 1) - 1) * 8
+
+        if position + 8 > len(sidecar):
+            raise HttpError.not_found()
+
+        (header_size,) = struct.unpack_from(">Q", sidecar)
+        (offset,) = struct.unpack_from(">Q", sidecar, position)
+
+        return content_type, data[:header_size] + data[offset:]
+
+    def paginate(self, collection: str, fmt: str, start_arg: Optional[str],
+                 limit_arg: Optional[str]) -> Tuple[str, bytes]:
+        """
+        Reads a `start`/`limit` slice out of the fixed-size pages.
+        """
+
+        _, body = self.read(f"{collection}/pages/index.json")
+        manifest = json.loads(body)
+        size = manifest["page-size"]
+        start = toint(start_arg or "1")
+        limit = toint(limit_arg or str(size))
+
+        if start is None or start < 1:
+            raise HttpError.unexpected_parameter(
+                f"Expected a positive integer but got {start_arg}")
+
+        if limit is None or limit < 1 or limit > size:
+            raise HttpError.unexpected_parameter(
+                f"Expected an integer between 1 and {size} but got \
+{limit_arg}")
+
+        if start > manifest["total"]:
+            raise HttpError.not_found()
+
+        last = min(start + limit - 1, manifest["total"])
+        first_page = (start - 1) // size + 1
+        last_page = (last - 1) // size + 1
+        separator = b"\r\n" if fmt == "csv" else b"\n"
+        content_type = ""
+        opening = closing = b""
+        elements: List[bytes] = []
+
+        for number in range(first_page, last_page + 1):
+            content_type, page = self.read(
+                f"{collection}/pages/{number}.{fmt}")
+            lines = page.split(separator)[:-1]
+            opening = lines.pop(0)
+
+            if fmt == "json":
+                closing = lines.pop()
+                lines = [line.rstrip(b",") for line in lines]
+
+            elements.extend(lines)
+
+        skip = start - (first_page - 1) * size - 1
+        result = elements[skip:skip + last - start + 1]
+
+        if fmt == "csv":
+            return content_type, separator.join([opening] + result) + \
+                separator
+
+        return content_type, b"".join([opening, separator,
+                                       b",\n".join(result), separator,
+                                       closing, separator])
+
+
+def resolve(path: str, accept: Optional[str]) -> str:
+    """
+    Maps a REST API (V1) path to the name of the resource in the build.
+
+    >>> resolve("/records", "text/csv")
+    'records/index.csv'
+    >>> resolve("/entries/3.json", None)
+    'entries/3.json'
+    >>> resolve("/download-rsf", None)
+    'commands.rsf'
+    """
+
+    name = LEGACY_RE.sub(lambda match: LEGACY[match.group(1)],
+                         path.strip("/"))
+    fmt = "csv" if accept and accept.startswith("text/csv") else "json"
+    match = FORMAT_RE.match(name)
+
+    if match:
+        name, fmt = match.groups()
+
+    name = ALIASES.get(name, name)
+
+    if name.endswith((".json", ".rsf", ".zip")):
+        return name
+
+    return f"{name}.{fmt}"
+
+
+def sharded(name: str) -> Optional[str]:
+    """
+    Maps an item or record resource name to the sharded layout
+    (`registers build --shard-dirs`).
+
+    >>> sharded("records/GB/entries.json")
+    'records/b4/GB/entries.json'
+    """
+
+    name, dot, fmt = name.rpartition(".")
+    item = ITEM_RE.match(name)
+    record = RECORD_RE.match(name)
+
+    if item:
+        digest = item.group(1)[len("sha-256:"):]
+
+        return f"{shard_path('items', item.group(1), digest[:SHARD_WIDTH])}\
+{dot}{fmt}"
+
+    if record and not name.startswith(("records/index", "records/pages/")):
+        key, trail = record.group(1), record.group(2) or ""
+
+        return f"{shard_path('records', key, key_shard(key))}{trail}{dot}{fmt}"
+
+    return None
+
+
+def toint(value: str) -> Optional[int]:
+    """
+    Parses a non-negative integer.
+    """
+
+    return int(value) if value.isdigit() else None
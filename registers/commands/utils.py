@@ -8,12 +8,16 @@ This module implements helper functions for the CLI commands.
 :license: MIT, see LICENSE for more details.
 """
 
+import csv
 import json
-from typing import List
-from pathlib import Path
+import struct
+from io import StringIO
+from typing import (Any, Callable, Dict, Hashable, Iterable, List,
+                    NamedTuple, Optional, Union)
 import click
 from .. import xsv, Register, Blob, Entry, Record, Hash, Schema, Attribute
 from ..exceptions import CommandError
+from .writers import Writer
 
 
 def error(message):
@@ -30,12 +34,12 @@ def error(message):
     exit(1)
 
 
-def note(message):
+def note(message, err=False):
     """
-    Sends a message to stdout.
+    Sends a message to stdout, or to stderr if ``err`` is true.
     """
 
-    click.secho(message, fg="yellow", bold=True)
+    click.secho(message, fg="yellow", bold=True, err=err)
 
 
 def success(message):
@@ -75,6 +79,24 @@ def serialise_json(obj, stream, compact=False):
                   cls=JsonEncoder)
 
 
+def _compact_json(obj) -> str:
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':'),
+                      cls=JsonEncoder)
+
+
+def _pretty_json(obj) -> str:
+    return json.dumps(obj, ensure_ascii=False, indent=2, cls=JsonEncoder)
+
+
+def _nest(text: str) -> str:
+    """
+    Indents every line but the first one level (two spaces) so a document
+    serialised with ``indent=2`` can be embedded in a collection.
+    """
+
+    return text.replace("\n", "\n  ")
+
+
 class JsonEncoder(json.JSONEncoder):
     """
     JSON encoder for registers types.
@@ -112,19 +134,197 @@ def progressbar(iterable, **kwargs):
     return bar
 
 
-def write_csv_resource(path: Path, obj, headers):
+def echo_table(headers: List[str], rows: List[List[str]]):
+    """
+    Prints the given rows as a table with the first column aligned to the
+    left and the rest to the right.
+    """
+
+    cells = [headers] + rows
+    widths = [max(len(row[idx]) for row in cells)
+              for idx in range(len(headers))]
+
+    for row in cells:
+        click.echo("  ".join([row[0].ljust(widths[0])] +
+                             [cell.rjust(width) for cell, width
+                              in zip(row[1:], widths[1:])]))
+
+
+def write_csv_resource(writer: Writer, name: str, obj, headers):
     """
-    Writes the given object to a file as CSV.
+    Writes the given object to the resource ``name`` as CSV.
     """
 
-    with open(f"{path}.csv", "w") as stream:
+    with writer.open_text(f"{name}.csv") as stream:
         xsv.serialise(stream, obj, headers)
 
 
-def write_json_resource(path: Path, obj):
+def write_json_resource(writer: Writer, name: str, obj):
     """
-    Writes the given object to a file as JSON.
+    Writes the given object to the resource ``name`` as JSON.
     """
 
-    with open(f"{path}.json", "w") as stream:
+    with writer.open_text(f"{name}.json") as stream:
         serialise_json(obj, stream)
+
+
+OFFSET_FORMAT = ">Q"
+
+
+class Fragment(NamedTuple):
+    """
+    The serialisation of an object: a JSON document (``indent=2``, the layout
+    of every JSON resource) and a CSV row (CRLF terminated). The object is
+    kept for the compact layout of pages.
+    """
+
+    json: str
+    csv: str
+    obj: Any
+
+
+class FragmentCache:
+    """
+    Per-build cache of the serialisation of the objects of a collection so
+    each of them is encoded to JSON and CSV exactly once, no matter how many
+    resources (index, pages, per-object files, trails) include it.
+
+    Elements of a dictionary are identified by their key and elements of a
+    list by the given ``key`` function.
+    """
+
+    def __init__(self, headers: List[str],
+                 key: Optional[Callable[[Any], Hashable]] = None):
+        self.headers = headers
+        self.key = key
+        self._fragments: Dict[Hashable, Fragment] = {}
+        self._buffer = StringIO()
+        self._writer = csv.writer(self._buffer)
+        self.header = self._row(headers)
+
+    def get(self, key: Hashable, obj) -> Fragment:
+        """
+        The fragment for the given object.
+        """
+
+        fragment = self._fragments.get(key)
+
+        if fragment is None:
+            row = xsv.serialise_object(obj, self.headers)
+            fragment = Fragment(_pretty_json(obj), self._row(row), obj)
+            self._fragments[key] = fragment
+
+        return fragment
+
+    def collection(self, collection: Union[List, Dict]) -> List[Fragment]:
+        """
+        The fragments for every element of the given collection.
+        """
+
+        if isinstance(collection, Dict):
+            return [self.get(key, value) for key, value in collection.items()]
+
+        if self.key is None:
+            raise ValueError("A key function is required for lists.")
+
+        return [self.get(self.key(element), element)
+                for element in collection]
+
+    def _row(self, row: List[str]) -> str:
+        self._buffer.seek(0)
+        self._buffer.truncate()
+        self._writer.writerow(row)
+
+        return self._buffer.getvalue()
+
+
+def write_fragment_resource(writer: Writer, name: str, fragment: Fragment,
+                            header: str):
+    """
+    Writes the pair of resources (csv, json) for a single object.
+    """
+
+    writer.write(f"{name}.csv", f"{header}{fragment.csv}".encode("utf-8"))
+    writer.write(f"{name}.json", fragment.json.encode("utf-8"))
+
+
+def write_fragments_resource(writer: Writer, name: str,
+                             fragments: List[Fragment], header: str,
+                             keys: Optional[List[str]] = None,
+                             offsets: bool = False, lines: bool = False):
+    """
+    Writes the pair of resources (csv, json) for a collection out of its
+    fragments, with the same layout as ``write_resource``. If ``keys`` is
+    given the JSON is an object with the fragments as the values of those
+    keys.
+
+    If ``lines`` is true the JSON has one compact element per line instead
+    so it can be sliced by line without parsing it.
+
+    If ``offsets`` is true each resource gets a sidecar ``.offsets``
+    resource with the byte offset of every element.
+    """
+
+    opening, closing = ("{", "}") if keys is not None else ("[", "]")
+
+    if lines:
+        elements = [_compact_json(fragment.obj) for fragment in fragments]
+        labels = [f"{_compact_json(key)}:" for key in keys or []]
+        indent = ""
+    else:
+        elements = [_nest(fragment.json) for fragment in fragments]
+        labels = [f"{_compact_json(key)}: " for key in keys or []]
+        indent = "  "
+
+    if keys is not None:
+        elements = [f"{indent}{label}{element}"
+                    for label, element in zip(labels, elements)]
+    elif indent:
+        elements = [f"{indent}{element}" for element in elements]
+
+    if lines:
+        opening_json = f"{opening}\n"
+        footer = f"\n{closing}\n" if elements else f"{closing}\n"
+    elif elements:
+        opening_json, footer = f"{opening}\n", f"\n{closing}"
+    else:
+        opening_json, footer = opening, closing
+
+    _write_with_offsets(writer, f"{name}.csv", header,
+                        (fragment.csv for fragment in fragments), "", "",
+                        offsets)
+    _write_with_offsets(writer, f"{name}.json", opening_json, elements,
+                        ",\n", footer, offsets)
+
+
+def _write_with_offsets(writer: Writer, name: str, header: str,
+                        elements: Iterable[str], separator: str, footer: str,
+                        offsets: bool = True):
+    """
+    Writes the header, the elements and the footer to the given resource and
+    the offset where each element starts to the sidecar resource.
+
+    Offsets are 8 byte big-endian unsigned integers. The first offset is also
+    the length of the header so a slice from the nth element is the header
+    followed by the content of the resource from the nth offset onwards.
+    """
+
+    positions = []
+    encoded_separator = separator.encode("utf-8")
+
+    with writer.open(name) as stream:
+        position = stream.write(header.encode("utf-8"))
+
+        for idx, element in enumerate(elements):
+            if idx > 0:
+                position += stream.write(encoded_separator)
+
+            positions.append(position)
+            position += stream.write(element.encode("utf-8"))
+
+        stream.write(footer.encode("utf-8"))
+
+    if offsets:
+        writer.write(f"{name}.offsets",
+                     b"".join(struct.pack(OFFSET_FORMAT, position)
+                              for position in positions))
@@ -0,0 +1,906 @@
+# -*- coding: utf-8 -*-
+
+"""
+This module implements the output backends for the build command.
+
+A writer receives every resource of a build identified by its path relative
+to the build root (e.g. ``items/index.json``) and stores it either as a file
+in a directory tree, as a row in a SQLite database or as a member of a tar
+archive.
+
+
+:copyright: © 2019 Crown Copyright (Government Digital Service)
+:license: MIT, see LICENSE for more details.
+"""
+
+import ctypes
+import os
+import re
+import shutil
+import sqlite3
+import struct
+import tarfile
+import zlib
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import partial
+from hashlib import sha256
+from io import BytesIO, TextIOWrapper
+from pathlib import Path, PurePosixPath
+from queue import Queue
+from threading import Lock, Thread, get_ident
+from typing import (BinaryIO, Callable, Deque, Dict, Iterator, List,
+                    Optional, Set, TextIO, Tuple)
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None  # type: ignore
+
+try:
+    renameat2 = ctypes.CDLL(None, use_errno=True).renameat2
+    renameat2.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_int,
+                          ctypes.c_char_p, ctypes.c_uint]
+except (AttributeError, OSError, TypeError):
+    renameat2 = None  # type: ignore
+
+
+CONTENT_TYPES = {
+    ".csv": "text/csv; charset=UTF-8",
+    ".json": "application/json",
+    ".rsf": "application/uk-gov-rsf",
+    ".zip": "application/zip",
+    ".gz": "application/gzip",
+    ".br": "application/x-brotli",
+}
+DEFAULT_CONTENT_TYPE = "application/octet-stream"
+OUTPUT_FORMATS = ["directory", "sqlite", "tar"]
+STORED_RE = re.compile(r"^items/(?:[a-f\d]+/)?sha-256:[a-f\d]{64}\.")
+
+
+def content_type(name: str) -> str:
+    """
+    Guesses the content type of a resource from its extension.
+
+    >>> content_type("records/index.csv")
+    'text/csv; charset=UTF-8'
+    >>> content_type("entries/index.json.offsets")
+    'application/octet-stream'
+    """
+
+    return CONTENT_TYPES.get(PurePosixPath(name).suffix, DEFAULT_CONTENT_TYPE)
+
+
+class Writer:
+    """
+    Base class for the build output backends. Keeps count of the files and
+    bytes written, and of the files reused from a previous build.
+
+    Subclasses must implement ``_write``. Resources are buffered in memory
+    before being handed over unless the subclass overrides ``open``.
+    """
+
+    def __init__(self):
+        self.files = 0
+        self.bytes = 0
+        self.reused = 0
+
+    def write(self, name: str, data: bytes):
+        """
+        Writes the given bytes as the resource ``name``.
+        """
+
+        self._write(name, data)
+        self.files += 1
+        self.bytes += len(data)
+
+    @contextmanager
+    def open(self, name: str) -> Iterator[BinaryIO]:
+        """
+        Opens a binary stream for the resource ``name``.
+        """
+
+        buffer = BytesIO()
+        yield buffer
+        self.write(name, buffer.getvalue())
+
+    @contextmanager
+    def open_text(self, name: str) -> Iterator[TextIO]:
+        """
+        Opens a UTF-8 text stream for the resource ``name``.
+        """
+
+        with self.open(name) as stream:
+            text = TextIOWrapper(stream, encoding="utf-8", newline="")
+            yield text
+            text.flush()
+            text.detach()
+
+    def copy(self, name: str, source: Path):
+        """
+        Writes the content of the given file as the resource ``name``.
+        """
+
+        with open(source, "rb") as handle, self.open(name) as stream:
+            shutil.copyfileobj(handle, stream)
+
+    def close(self):
+        """
+        Flushes any pending resource.
+        """
+
+    def _write(self, name: str, data: bytes):
+        raise NotImplementedError
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_args):
+        self.close()
+
+
+class DirectoryWriter(Writer):
+    """
+    Writes every resource as a file under the given root directory.
+
+    When a blob store is given, items are written once into the store and
+    linked into the build instead. When a previous build is given, files
+    whose content has not changed are hardlinked from it instead of being
+    written again.
+
+    Existing files are replaced rather than truncated, as they may be
+    hardlinks into the blob store or the previous build (e.g. when building
+    in place with ``--shard`` or ``--merge``).
+    """
+
+    def __init__(self, root: Path, store: Optional["BlobStore"] = None,
+                 previous: Optional[Path] = None):
+        super().__init__()
+        self.root = root
+        self.store = store
+        self.previous = previous
+        self._dirs: Set[Path] = set()
+        self._lock = Lock()
+
+    @contextmanager
+    def open(self, name: str) -> Iterator[BinaryIO]:
+        if self.store and self.store.accepts(name):
+            with super().open(name) as stream:
+                yield stream
+            return
+
+        with create(self._path(name)) as stream:
+            yield stream
+            self.files += 1
+            self.bytes += stream.tell()
+
+    def _write(self, name: str, data: bytes):
+        self._save(name, self._path(name), data)
+
+    def _save(self, name: str, path: Path, data: bytes):
+        if self.store and self.store.accepts(name):
+            self.store.link(data, path)
+            return
+
+        if self.previous and self._reuse(name, path, data):
+            return
+
+        with create(path) as stream:
+            stream.write(data)
+
+    def _reuse(self, name: str, path: Path, data: bytes) -> bool:
+        source = self.previous.joinpath(name)  # type: ignore
+
+        try:
+            if source.stat().st_size != len(data) or \
+               source.read_bytes() != data:
+                return False
+
+            os.link(source, path)
+
+        except OSError:
+            return False
+
+        with self._lock:
+            self.reused += 1
+
+        return True
+
+    def copy(self, name: str, source: Path):
+        """
+        Copies the given file as the resource ``name``, as a reflink where
+        the filesystem supports it. Hardlinks are not an option because the
+        source may be appended to later (``registers patch apply``).
+        """
+
+        target = self._path(name)
+
+        if not reflink(source, target):
+            shutil.copyfile(source, target)
+
+        self.files += 1
+        self.bytes += target.stat().st_size
+
+    def _path(self, name: str) -> Path:
+        path = self.root.joinpath(name)
+
+        if path.parent not in self._dirs:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            self._dirs.add(path.parent)
+
+        return path
+
+
+class ThreadedDirectoryWriter(DirectoryWriter):
+    """
+    Directory writer that hands every file over to a pool of I/O threads
+    through a bounded queue, so the build is not held back by the latency
+    of each open/write/close (e.g. on network filesystems).
+
+    Directories are created by the calling thread before the file is queued
+    so a file never races the creation of its parent. Streamed resources
+    (``open``) and copies are written synchronously.
+    """
+
+    def __init__(self, root: Path, jobs: Optional[int] = None,
+                 queue_size: int = 1024, store: Optional["BlobStore"] = None,
+                 previous: Optional[Path] = None):
+        super().__init__(root, store, previous)
+        self._queue: "Queue[Optional[Tuple[str, Path, bytes]]]" = Queue(
+            maxsize=queue_size)
+        self._error: Optional[Exception] = None
+        self._threads = [Thread(target=self._work, daemon=True)
+                         for _ in range(jobs or os.cpu_count() or 1)]
+
+        for thread in self._threads:
+            thread.start()
+
+    def _write(self, name: str, data: bytes):
+        self._check()
+        self._queue.put((name, self._path(name), data))
+
+    def _work(self):
+        while True:
+            task = self._queue.get()
+
+            if task is None:
+                return
+
+            # Any error is kept for the calling thread and the worker carries
+            # on draining the queue so a full queue never blocks the build.
+            try:
+                self._save(*task)
+            except Exception as err:  # pylint: disable=broad-except
+                self._error = self._error or err
+
+    def _check(self):
+        if self._error is not None:
+            raise self._error
+
+    def close(self):
+        for _ in self._threads:
+            self._queue.put(None)
+
+        for thread in self._threads:
+            thread.join()
+
+        self._check()
+
+
+class SqliteWriter(Writer):
+    """
+    Writes every resource as a row of the ``resources`` table keyed by path
+    with its content type. The whole build is a single transaction.
+    """
+
+    SCHEMA = """
+        CREATE TABLE resources (
+            path TEXT PRIMARY KEY,
+            content_type TEXT NOT NULL,
+            content BLOB NOT NULL
+        )
+    """
+    BATCH_SIZE = 1000
+
+    def __init__(self, filename: Path):
+        super().__init__()
+        self.connection = sqlite3.connect(str(filename))
+        self.connection.execute("PRAGMA journal_mode = OFF")
+        self.connection.execute("PRAGMA synchronous = OFF")
+        self.connection.execute(self.SCHEMA)
+        self._batch: List[Tuple[str, str, bytes]] = []
+
+    def _write(self, name: str, data: bytes):
+        self._batch.append((name, content_type(name), data))
+
+        if len(self._batch) >= self.BATCH_SIZE:
+            self._flush()
+
+    def _flush(self):
+        self.connection.executemany(
+            "INSERT OR REPLACE INTO resources VALUES (?, ?, ?)", self._batch)
+        self._batch = []
+
+    def close(self):
+        self._flush()
+        self.connection.commit()
+        self.connection.close()
+
+
+class TarWriter(Writer):
+    """
+    Writes every resource as a member of an uncompressed tar archive. The
+    archive is streamed so members are never read back.
+
+    Modification times are fixed so the result is reproducible across builds.
+    """
+
+    def __init__(self, filename: Path):
+        super().__init__()
+        self.archive = tarfile.open(str(filename), mode="w|",
+                                    format=tarfile.PAX_FORMAT)
+
+    def _write(self, name: str, data: bytes):
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        info.mode = 0o644
+        info.mtime = 0
+
+        self.archive.addfile(info, BytesIO(data))
+
+    def close(self):
+        self.archive.close()
+
+
+class PipelineWriter(Writer):
+    """
+    Base class for writers that wrap another writer and derive extra output
+    from some of the resources in a pool of threads while the build carries
+    on.
+
+    Results are handed over from the calling thread, in order, so the
+    wrapped writer does not need to be thread safe. Subclasses implement
+    ``accepts`` and ``process``.
+    """
+
+    def __init__(self, writer: Writer, jobs: Optional[int] = None):
+        # pylint: disable=super-init-not-called
+        jobs = jobs or os.cpu_count() or 1
+        self.writer = writer
+        self.executor = ThreadPoolExecutor(max_workers=jobs)
+        self._window = 4 * jobs
+        self._pending: Deque[Tuple[Callable, Future]] = deque()
+        self._closed = False
+
+    def accepts(self, name: str) -> bool:
+        """
+        Checks if the given resource has to be processed.
+        """
+
+        raise NotImplementedError
+
+    def process(self, name: str, data: bytes):
+        """
+        Processes the given resource, typically with ``submit``.
+        """
+
+        raise NotImplementedError
+
+    def submit(self, task: Callable, data: bytes, callback: Callable):
+        """
+        Runs ``task(data)`` in the pool and calls ``callback`` with the
+        result once every previously submitted task has been handed over.
+        """
+
+        self._pending.append((callback, self.executor.submit(task, data)))
+
+        while self._pending and (len(self._pending) > self._window
+                                 or self._pending[0][1].done()):
+            self._drain()
+
+    def write(self, name: str, data: bytes):
+        self.writer.write(name, data)
+
+        if self.accepts(name):
+            self.process(name, data)
+
+    def open(self, name: str):
+        if self.accepts(name):
+            return super().open(name)
+
+        return self.writer.open(name)
+
+    def copy(self, name: str, source: Path):
+        self.writer.copy(name, source)
+
+        if self.accepts(name):
+            self.process_file(name, source)
+
+    def process_file(self, name: str, source: Path):
+        """
+        Processes the given file once the wrapped writer has copied it. Reads
+        it whole and hands it over to ``process`` unless overridden.
+        """
+
+        self.process(name, source.read_bytes())
+
+    def _drain(self):
+        callback, future = self._pending.popleft()
+        callback(future.result())
+
+    def finish(self):
+        """
+        Called once every task has been handed over, before the wrapped
+        writer is closed.
+        """
+
+    def close(self):
+        if self._closed:
+            return
+
+        while self._pending:
+            self._drain()
+
+        self.executor.shutdown()
+        self.finish()
+        self.writer.close()
+        self._closed = True
+
+    @property  # type: ignore
+    def files(self):
+        return self.writer.files
+
+    @property  # type: ignore
+    def bytes(self):
+        return self.writer.bytes
+
+    @property  # type: ignore
+    def reused(self):
+        return self.writer.reused
+
+
+class CompressingWriter(PipelineWriter):
+    """
+    Wraps a writer and adds a compressed sibling (e.g. ``index.json.gz``) for
+    every resource with one of the given suffixes.
+
+    Compressors wrap a binary stream (see ``compress``). Copied files (e.g.
+    ``commands.rsf``) are compressed in chunks straight from disk instead of
+    being read in memory.
+    """
+
+    def __init__(self, writer: Writer,
+                 compressors: Dict[str, Callable[[BinaryIO], BinaryIO]],
+                 suffixes: List[str], jobs: Optional[int] = None):
+        super().__init__(writer, jobs)
+        self.compressors = compressors
+        self.suffixes = suffixes
+
+    def accepts(self, name: str) -> bool:
+        return PurePosixPath(name).suffix in self.suffixes
+
+    def process(self, name: str, data: bytes):
+        for suffix, wrap in self.compressors.items():
+            self.submit(partial(compress, wrap), data,
+                        partial(self.writer.write, f"{name}{suffix}"))
+
+    def process_file(self, name: str, source: Path):
+        for suffix, wrap in self.compressors.items():
+            with open(source, "rb") as handle, \
+                    self.writer.open(f"{name}{suffix}") as stream, \
+                    wrap(stream) as compressed:
+                shutil.copyfileobj(handle, compressed)
+
+
+def compress(wrap: Callable[[BinaryIO], BinaryIO], data: bytes) -> bytes:
+    """
+    Compresses the given data with a compressor that wraps a binary stream.
+
+    >>> from gzip import GzipFile, decompress
+    >>> decompress(compress(lambda stream: GzipFile(fileobj=stream,
+    ...                                              mode="wb"), b"[]"))
+    b'[]'
+    """
+
+    buffer = BytesIO()
+
+    with wrap(buffer) as stream:
+        stream.write(data)
+
+    return buffer.getvalue()
+
+
+ARCHIVE_MEMBERS = {
+    "items/index.json": "item/index.json",
+    "entries/index.json": "entry/index.json",
+    "records/index.json": "record/index.json",
+    "register.json": "register.json",
+}
+ARCHIVE_FULL_RE = re.compile(
+    r"^(?:items/(?:[a-f\d]{2}/)?(?P<item>sha-256:[a-f\d]{64})"
+    r"|entries/(?P<entry>\d+))\.json$")
+
+
+def archive_member(name: str, full: bool = False) -> Optional[str]:
+    """
+    Maps a resource to its name in the archive or ``None`` if it is not
+    part of it. Per-item and per-entry files are only part of the full
+    archive.
+
+    >>> archive_member("entries/index.json")
+    'entry/index.json'
+    >>> archive_member("entries/3.json", full=True)
+    'entry/3.json'
+    >>> archive_member("entries/3.json") is None
+    True
+    """
+
+    if name in ARCHIVE_MEMBERS:
+        return ARCHIVE_MEMBERS[name]
+
+    match = ARCHIVE_FULL_RE.match(name) if full else None
+
+    if match and match.group("item"):
+        return f"item/{match.group('item')}.json"
+
+    if match:
+        return f"entry/{match.group('entry')}.json"
+
+    return None
+
+
+class ArchiveWriter(PipelineWriter):
+    """
+    Wraps a writer and streams the JSON resources of the register into
+    ``archive.zip`` as they are written. Members are compressed in the pool
+    so the archive does not need a second pass over the build.
+    """
+
+    def __init__(self, writer: Writer, uid: str, level: int = 6,
+                 full: bool = False, jobs: Optional[int] = None):
+        super().__init__(writer, jobs)
+        self.uid = uid
+        self.level = level
+        self.full = full
+        self._context = writer.open("archive.zip")
+        self.archive = ZipStream(self._context.__enter__())
+
+    def accepts(self, name: str) -> bool:
+        return archive_member(name, self.full) is not None
+
+    def process(self, name: str, data: bytes):
+        member = f"{self.uid}/{archive_member(name, self.full)}"
+
+        self.submit(partial(deflate, level=self.level), data,
+                    partial(self.archive.add, member))
+
+    def include(self, name: str, data: bytes):
+        """
+        Adds the given resource to the archive without writing it.
+        """
+
+        if self.accepts(name):
+            self.process(name, data)
+
+    def finish(self):
+        self.archive.close()
+        self._context.__exit__(None, None, None)
+
+
+ZIP_DATE = (1 << 5) | 1  # 1980-01-01 so the result is reproducible.
+ZIP_LIMIT = 0xFFFFFFFF
+ZIP_UTF8 = 0x800
+
+
+def deflate(data: bytes, level: int = 6) -> Tuple[int, int, int, bytes]:
+    """
+    Compresses the given data as a zip member. Returns the compression
+    method, the CRC-32, the uncompressed size and the payload. Level 0
+    stores the data as is.
+    """
+
+    crc = zlib.crc32(data)
+
+    if level == 0:
+        return (0, crc, len(data), data)
+
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+
+    return (8, crc, len(data), compressor.compress(data) + compressor.flush())
+
+
+class ZipStream:
+    """
+    Writes a zip file sequentially out of members compressed beforehand with
+    ``deflate``. It switches to the zip64 extensions when sizes, offsets or
+    the number of members require it.
+    """
+
+    def __init__(self, stream: BinaryIO):
+        self.stream = stream
+        self.position = 0
+        self.directory: List[Tuple[bytes, int, int, int, int, int]] = []
+
+    def add(self, name: str, member: Tuple[int, int, int, bytes]):
+        """
+        Appends the given member.
+        """
+
+        method, crc, size, payload = member
+        encoded = name.encode("utf-8")
+        offset = self.position
+        extra = b""
+        sizes = (len(payload), size)
+
+        if max(sizes) >= ZIP_LIMIT:
+            extra = struct.pack("<HHQQ", 1, 16, size, len(payload))
+            sizes = (ZIP_LIMIT, ZIP_LIMIT)
+
+        self._emit(struct.pack("<IHHHHHIIIHH", 0x04034b50,
+                               45 if extra else 20, ZIP_UTF8, method, 0,
+                               ZIP_DATE, crc, *sizes, len(encoded),
+                               len(extra)),
+                   encoded, extra, payload)
+        self.directory.append((encoded, method, crc, len(payload), size,
+                               offset))
+
+    def close(self):
+        """
+        Writes the central directory.
+        """
+
+        start = self.position
+
+        for encoded, method, crc, compressed, size, offset in self.directory:
+            extra = b""
+            fields = (compressed, size, offset)
+
+            if max(fields) >= ZIP_LIMIT:
+                extra = struct.pack("<HHQQQ", 1, 24, size, compressed,
+                                    offset)
+                fields = (ZIP_LIMIT, ZIP_LIMIT, ZIP_LIMIT)
+
+            version = 45 if extra else 20
+
+            self._emit(struct.pack("<IHHHHHHIIIHHHHHII", 0x02014b50,
+                                   version, version, ZIP_UTF8, method, 0,
+                                   ZIP_DATE, crc, fields[0], fields[1],
+                                   len(encoded), len(extra), 0, 0, 0,
+                                   0o644 << 16, fields[2]),
+                       encoded, extra)
+
+        count = len(self.directory)
+        size = self.position - start
+
+        if count >= 0xFFFF or max(start, size) >= ZIP_LIMIT:
+            record = self.position
+
+            self._emit(struct.pack("<IQHHIIQQQQ", 0x06064b50, 44, 45, 45, 0,
+                                   0, count, count, size, start),
+                       struct.pack("<IIQI", 0x07064b50, 0, record, 1))
+
+        self._emit(struct.pack("<IHHHHIIH", 0x06054b50, 0, 0,
+                               min(count, 0xFFFF), min(count, 0xFFFF),
+                               min(size, ZIP_LIMIT), min(start, ZIP_LIMIT),
+                               0))
+
+    def _emit(self, *chunks: bytes):
+        for chunk in chunks:
+            self.stream.write(chunk)
+            self.position += len(chunk)
+
+
+class BlobStore:
+    """
+    Content-addressed store shared by the builds of several registers.
+
+    Every file is kept once under ``root`` named after the SHA-256 of its
+    content and hardlinked into each build, or symlinked when the build is
+    on another filesystem. Files already in the store are not written again.
+    Files are written to a temporary name and renamed so concurrent builds
+    sharing the store never see a partial file.
+    """
+
+    def __init__(self, root: Path):
+        self.root = root
+        self.written = 0
+        self.linked = 0
+        self._lock = Lock()
+
+    @staticmethod
+    def accepts(name: str) -> bool:
+        """
+        Whether the resource ``name`` is kept in the store: items and their
+        pre-compressed siblings.
+
+        >>> BlobStore.accepts("items/sha-256:" + "a" * 64 + ".json.gz")
+        True
+        >>> BlobStore.accepts("items/index.json")
+        False
+        """
+
+        return STORED_RE.match(name) is not None
+
+    def path(self, data: bytes) -> Path:
+        """
+        The path of the given content in the store.
+        """
+
+        digest = sha256(data).hexdigest()
+
+        return self.root.joinpath(digest[:2], digest)
+
+    def link(self, data: bytes, target: Path):
+        """
+        Stores the given content unless already stored and links it as the
+        target file.
+        """
+
+        source = self.path(data)
+
+        if not source.exists():
+            source.parent.mkdir(parents=True, exist_ok=True)
+            temp = source.with_name(
+                f"{source.name}.{os.getpid()}.{get_ident()}.tmp")
+            temp.write_bytes(data)
+            os.replace(temp, source)
+
+            with self._lock:
+                self.written += 1
+
+        try:
+            target.unlink()
+        except FileNotFoundError:
+            pass
+
+        try:
+            os.link(source, target)
+        except OSError:
+            os.symlink(source.resolve(), target)
+
+        with self._lock:
+            self.linked += 1
+
+
+FICLONE = 0x40049409
+AT_FDCWD = -100
+RENAME_EXCHANGE = 2
+
+
+def create(path: Path) -> BinaryIO:
+    """
+    Creates the given file for writing. An existing file is removed first
+    instead of being truncated, so the files it is hardlinked to are left
+    untouched.
+    """
+
+    try:
+        return open(path, "xb")
+    except FileExistsError:
+        path.unlink()
+
+        return open(path, "xb")
+
+
+def reflink(source: Path, target: Path) -> bool:
+    """
+    Clones the source file into the target sharing the data blocks
+    (copy-on-write). Returns ``False`` if the platform or the filesystem
+    does not support it, leaving the target as a new empty file.
+    """
+
+    with open(source, "rb") as src, create(target) as dst:
+        if fcntl is None:
+            return False
+
+        try:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+            return True
+        except OSError:
+            return False
+
+
+def exchange(source: Path, target: Path) -> bool:
+    """
+    Atomically swaps the source and target paths, which may be non-empty
+    directories. Returns ``False`` if the platform or the filesystem does
+    not support it.
+    """
+
+    if renameat2 is None:
+        return False
+
+    result = renameat2(AT_FDCWD, os.fsencode(source), AT_FDCWD,
+                       os.fsencode(target), RENAME_EXCHANGE)
+
+    return result == 0
+
+
+def make_writer(output_format: str, path: Path, *, threaded: bool = False,
+                jobs: Optional[int] = None,
+                store: Optional[BlobStore] = None,
+                previous: Optional[Path] = None) -> Writer:
+    """
+    Creates the writer for the given output format. ``path`` is the build
+    root for the ``directory`` format and the filename without extension for
+    the others. Only the ``directory`` format can be ``threaded``, link
+    items from a blob ``store`` or reuse the files of a ``previous`` build.
+    """
+
+    if output_format == "sqlite":
+        return SqliteWriter(path.with_suffix(".sqlite"))
+
+    if output_format == "tar":
+        return TarWriter(path.with_suffix(".tar"))
+
+    if threaded:
+        return ThreadedDirectoryWriter(path, jobs, store=store,
+                                       previous=previous)
+
+    return DirectoryWriter(path, store, previous)
+
+
+class Store:
+    """
+    Read access to a single-file build. ``get`` returns the content type and
+    content of the given resource or ``None`` if it does not exist.
+    """
+
+    def get(self, name: str) -> Optional[Tuple[str, bytes]]:
+        """
+        Reads the given resource.
+        """
+
+        raise NotImplementedError
+
+
+class SqliteStore(Store):
+    """
+    Reads resources from a build written by ``SqliteWriter``.
+    """
+
+    def __init__(self, filename: Path):
+        uri = f"{Path(filename).resolve().as_uri()}?mode=ro"
+        self.connection = sqlite3.connect(uri, uri=True,
+                                          check_same_thread=False)
+
+    def get(self, name: str) -> Optional[Tuple[str, bytes]]:
+        row = self.connection.execute(
+            "SELECT content_type, content FROM resources WHERE path = ?",
+            (name,)).fetchone()
+
+        return (row[0], bytes(row[1])) if row else None
+
+
+class TarStore(Store):
+    """
+    Reads resources from a build written by ``TarWriter``. The member index
+    is read once when the store is opened.
+    """
+
+    def __init__(self, filename: Path):
+        self.archive = tarfile.open(str(filename), mode="r:")
+        self.members: Dict[str, tarfile.TarInfo] = {
+            member.name: member for member in self.archive.getmembers()}
+
+    def get(self, name: str) -> Optional[Tuple[str, bytes]]:
+        member = self.members.get(name)
+
+        if member is None:
+            return None
+
+        stream = self.archive.extractfile(member)
+
+        return (content_type(name), stream.read()) if stream else None
+
+
+def open_store(filename: Path) -> Store:
+    """
+    Opens the store for the given single-file build based on its extension.
+    """
+
+    if Path(filename).suffix == ".tar":
+        return TarStore(filename)
+
+    return SqliteStore(filename)
@@ -1,15 +1,17 @@
 -- Functions in this module are expected to not depend on `ngx` and to be
 -- pure.
 
-local cjson = require("cjson.safe")
 local errors = require("errors")
 
 local M = {}
 
+M.OFFSET_SIZE = 8
+M.COMPRESSIBLE = {csv = true, json = true, rsf = true}
 
--- Takes a CSV (string) and returns a CSV (string) of the result of dropping
--- the first n rows where n is the given start_arg.
-function M.slice_csv(data, start_arg)
+
+-- Takes the `start` argument and returns the position in the offsets
+-- sidecar where the byte offset for that entry is stored.
+function M.offset_position(start_arg)
     local start = toint(start_arg)
 
     if start == nil then
@@ -17,65 +19,256 @@ function M.slice_csv(data, start_arg)
         return errors.unexpected_parameter(message), nil
     end
 
-    local lines = string.gmatch(data, "[^\n]+")
-    local header = lines()
-    local result = {}
+    return nil, (math.max(start, 1) - 1) * M.OFFSET_SIZE
+end
 
-    table.insert(result, header)
 
-    for line in lines do
-        local number = string.gsub(line, "^(%d+).+$", "%1")
+-- Decodes an offset (8 byte big-endian unsigned integer) as written by the
+-- build. Returns nil if the given bytes are not a complete offset.
+function M.decode_offset(bytes)
+    if bytes == nil or #bytes ~= M.OFFSET_SIZE then
+        return nil
+    end
 
-        if tonumber(number) >= start then
-            table.insert(result, line)
-        end
+    local result = 0
+
+    for idx = 1, M.OFFSET_SIZE do
+        result = result * 256 + string.byte(bytes, idx)
+    end
+
+    return result
+end
+
+
+-- Takes the pages manifest and the `start` and `limit` arguments and returns
+-- the numeric start and limit together with the first and last page
+-- covering the slice.
+--
+-- The limit defaults to the page size and it can't be larger so a slice is
+-- always covered by one or two pages.
+function M.page_range(manifest, start_arg, limit_arg)
+    local page_size = manifest["page-size"]
+    local start = toint(start_arg or "1")
+    local limit = toint(limit_arg or tostring(page_size))
+
+    if start == nil or start < 1 then
+        local message = "Expected a positive integer but got " .. start_arg
+        return errors.unexpected_parameter(message)
     end
 
-    if #result == 1 then
-        return errors.not_found(), nil
+    if limit == nil or limit < 1 or limit > page_size then
+        local message = "Expected an integer between 1 and " .. page_size ..
+                        " but got " .. limit_arg
+        return errors.unexpected_parameter(message)
     end
 
-    return nil, table.concat(result, "\n")
+    if start > manifest.total then
+        return errors.not_found()
+    end
+
+    local last = math.min(start + limit - 1, manifest.total)
+    local first_page = math.floor((start - 1) / page_size) + 1
+    local last_page = math.floor((last - 1) / page_size) + 1
+
+    return nil, {
+        start = start,
+        limit = limit,
+        first_page = first_page,
+        last_page = last_page
+    }
 end
 
 
--- Takes a JSON (string) and returns a JSON (string) of the result of dropping
--- the first n rows where n is the given start_arg.
-function M.slice_json(data, start_arg)
-    local start = toint(start_arg)
+-- Takes the list of pages (strings) starting at `range.first_page` and
+-- returns a string with the `range.limit` elements from `range.start`.
+--
+-- JSON pages hold one element per line between the opening and closing
+-- brackets. CSV pages hold a header followed by one row per CRLF terminated
+-- line.
+function M.slice_pages(pages, range, page_size, format)
+    local offset = (range.first_page - 1) * page_size
+    local from = range.start - offset
+    local to = from + range.limit - 1
+    local elements = {}
+    local opening, closing
 
-    if start == nil then
-        message = "Expected an integer but got " .. start_arg
-        return errors.unexpected_parameter(message), nil
+    for _, page in ipairs(pages) do
+        local lines
+
+        if format == "csv" then
+            lines = split(page, "\r\n")
+            opening = lines[1]
+            table.remove(lines, 1)
+        else
+            lines = split(page, "\n")
+            opening = lines[1]
+            table.remove(lines, 1)
+            closing = table.remove(lines)
+
+            for idx, line in ipairs(lines) do
+                lines[idx] = string.gsub(line, ",$", "")
+            end
+        end
+
+        for _, line in ipairs(lines) do
+            table.insert(elements, line)
+        end
     end
 
-    cjson.decode_array_with_array_mt(true)
+    local result = {}
+
+    for idx = from, math.min(to, #elements) do
+        table.insert(result, elements[idx])
+    end
 
-    local data = cjson.decode(data)
-    local result = drop(start, data)
+    if format == "csv" then
+        table.insert(result, 1, opening)
 
-    if #result == 0 then
-        return errors.not_found(), nil
+        return nil, table.concat(result, "\r\n") .. "\r\n"
     end
 
-    return nil, cjson.encode(result)
+    return nil, opening .. table.concat(result, ",") .. closing
 end
 
 
--- Drops the first `limit - 1` elements of the given iterable.
-function drop(limit, iterable)
+-- Splits the given string by the given (plain) separator dropping the empty
+-- trailing element.
+function split(str, separator)
     local result = {}
+    local position = 1
 
-    for idx, value in ipairs(iterable) do
-        if idx >= limit then
-            table.insert(result, value)
+    while true do
+        local first, last = string.find(str, separator, position, true)
+
+        if first == nil then
+            break
         end
+
+        table.insert(result, string.sub(str, position, first - 1))
+        position = last + 1
+    end
+
+    if position <= #str then
+        table.insert(result, string.sub(str, position))
     end
 
     return result
 end
 
 
+-- Quotes the given tag as a strong ETag, with the content coding appended
+-- if there is one.
+local function strong_etag(tag, coding)
+    if coding then
+        tag = tag .. "." .. coding
+    end
+
+    return '"' .. tag .. '"'
+end
+
+
+-- Composes the strong ETag for the given file from the register version.
+-- The file extension and the content coding are part of it so each
+-- representation (csv, json) and coding (gzip) has its own ETag. Returns nil
+-- if either the version or the extension is unknown.
+function M.etag(version, filename, coding)
+    local extension = filename and string.match(filename, "%.(%w+)$")
+
+    if version == nil or extension == nil then
+        return nil
+    end
+
+    return strong_etag(version .. "." .. extension, coding)
+end
+
+
+-- Composes the strong ETag of an item or an entry out of its URI: the item
+-- hash or the entry number, as neither changes once published. Returns nil
+-- for any other URI.
+function M.immutable_etag(uri, coding)
+    local digest, extension = string.match(uri or "",
+                                           "^/items/(sha%-256:%x+)%.(%w+)$")
+
+    if digest then
+        return strong_etag(digest .. "." .. extension, coding)
+    end
+
+    local number, extension = string.match(uri or "",
+                                           "^/entries/(%d+)%.(%w+)$")
+
+    if number then
+        return strong_etag("entry-" .. number .. "." .. extension, coding)
+    end
+
+    return nil
+end
+
+
+-- The content coding the given file is served with: gzip if the build wrote
+-- gzip siblings (`encodings` is the comma separated list recorded in
+-- `etags.json`), the file is compressible and the Accept-Encoding header
+-- accepts gzip. nginx only serves the gzip siblings (`gzip_static`) so any
+-- other coding is ignored. Returns nil for the identity coding.
+function M.content_coding(encodings, filename, header)
+    local extension = filename and string.match(filename, "%.(%w+)$")
+
+    if extension == nil or not M.COMPRESSIBLE[extension] then
+        return nil
+    end
+
+    if not string.find("," .. (encodings or "") .. ",", ",gzip,", 1, true) then
+        return nil
+    end
+
+    if M.accepts_gzip(header) then
+        return "gzip"
+    end
+
+    return nil
+end
+
+
+-- Checks if the given Accept-Encoding header value lists gzip without a zero
+-- quality, the same way nginx decides to serve the gzip sibling.
+function M.accepts_gzip(header)
+    if header == nil then
+        return false
+    end
+
+    for coding in string.gmatch(string.lower(header), "[^,]+") do
+        local name, params = string.match(coding, "^%s*([^;%s]+)%s*(.*)$")
+
+        if name == "gzip" then
+            local quality = tonumber(string.match(params, "q%s*=%s*([%d%.]+)"))
+
+            return quality == nil or quality > 0
+        end
+    end
+
+    return false
+end
+
+
+-- Checks if the given If-None-Match header value matches the given ETag.
+function M.etag_matches(header, etag)
+    if header == nil then
+        return false
+    end
+
+    if header == "*" then
+        return true
+    end
+
+    for candidate in string.gmatch(header, '[^,%s]+') do
+        if candidate == etag or candidate == "W/" .. etag then
+            return true
+        end
+    end
+
+    return false
+end
+
+
 function toint(str)
     if string.match(str, "%D") then
         return nil
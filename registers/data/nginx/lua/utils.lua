@@ -1,30 +1,229 @@
 -- This module depends on the global presence of `ngx`.
 
 local cjson = require("cjson.safe")
+local errors = require("errors")
 local registers = require("registers")
 
 local M = {}
 
+M.CHUNK_SIZE = 65536
+M.MANIFEST_TTL = 1
 
-function M.slice_csv()
-    M.slice("/entries/index.csv", registers.slice_csv)
+
+-- Serves the entries slice for the `start` and `limit` arguments. Without a
+-- limit it serves everything from `start` (original behaviour).
+function M.entries(format)
+    if ngx.var.arg_limit then
+        M.paginate("entries", format)
+    elseif ngx.var.arg_start then
+        M.tail("entries/index." .. format)
+    else
+        M.conditional()
+    end
 end
 
 
-function M.slice_json()
-    M.slice("/entries/index.json", registers.slice_json)
+-- Serves the records slice for the `start` and `limit` arguments.
+function M.records(format)
+    if ngx.var.arg_start or ngx.var.arg_limit then
+        M.paginate("records", format)
+    else
+        M.conditional()
+    end
 end
 
 
-function M.slice(location, slicer)
-    local res = ngx.location.capture(location)
-    local err, slice = slicer(res.body, ngx.var.arg_start)
+-- Serves a `start`/`limit` slice of the given collection out of the
+-- fixed-size pages generated by the build.
+function M.paginate(collection, format)
+    ngx.req.clear_header("Accept-Encoding")
+
+    local location = "/" .. collection .. "/pages/"
+    local res = ngx.location.capture(location .. "index.json")
+    local manifest = cjson.decode(res.body)
+
+    if res.status ~= ngx.HTTP_OK or manifest == nil then
+        M.ngx_error(errors.internal_server_error())
+    end
+
+    local err, range = registers.page_range(manifest,
+                                            ngx.var.arg_start,
+                                            ngx.var.arg_limit)
+
+    if err then
+        M.ngx_error(err)
+    end
+
+    local pages = {}
+
+    for number = range.first_page, range.last_page do
+        local page = ngx.location.capture(location .. number .. "." .. format)
+        table.insert(pages, page.body)
+    end
+
+    local err, slice = registers.slice_pages(pages, range,
+                                             manifest["page-size"], format)
 
     if err then
         M.ngx_error(err)
     end
 
-    ngx.say(slice)
+    ngx.print(slice)
+    ngx.exit(ngx.HTTP_OK)
+end
+
+
+-- Serves the given index from the `start` element onwards. The byte offset
+-- of the element is looked up in the sidecar written by the build so the
+-- response is the index header followed by the rest of the file, without
+-- parsing it.
+function M.tail(resource)
+    local err, position = registers.offset_position(ngx.var.arg_start)
+
+    if err then
+        M.ngx_error(err)
+    end
+
+    local path = M.resource_path(resource)
+    local offsets = io.open(path .. ".offsets", "rb")
+    local index = io.open(path, "rb")
+
+    if offsets == nil or index == nil then
+        M.ngx_error(errors.internal_server_error())
+    end
+
+    local header_size = registers.decode_offset(
+        offsets:read(registers.OFFSET_SIZE))
+    offsets:seek("set", position)
+    local offset = registers.decode_offset(
+        offsets:read(registers.OFFSET_SIZE))
+    offsets:close()
+
+    if header_size == nil or offset == nil then
+        index:close()
+        M.ngx_error(errors.not_found())
+    end
+
+    ngx.print(index:read(header_size))
+    index:seek("set", offset)
+
+    while true do
+        local chunk = index:read(M.CHUNK_SIZE)
+
+        if chunk == nil then
+            break
+        end
+
+        ngx.print(chunk)
+    end
+
+    index:close()
+    ngx.exit(ngx.HTTP_OK)
+end
+
+
+-- Sets the ETag of the file being served and ends the request with
+-- 304 Not Modified when the client already has it. Items and entries get an
+-- ETag from their hash or number, any other file one derived from the
+-- register version recorded by the build in `etags.json`. The content coding
+-- the file is served with is part of the ETag.
+function M.conditional()
+    local version, encodings = M.manifest()
+    local filename = ngx.var.request_filename
+    local header = nil
+
+    if (ngx.req.http_version() or 0) >= 1.1 then
+        header = ngx.var.http_accept_encoding
+    end
+
+    local coding = registers.content_coding(encodings, filename, header)
+    local etag = registers.immutable_etag(ngx.var.uri, coding)
+        or registers.etag(version, filename, coding)
+
+    if etag == nil then
+        return
+    end
+
+    ngx.header["ETag"] = etag
+
+    if registers.etag_matches(ngx.var.http_if_none_match, etag) then
+        ngx.exit(ngx.HTTP_NOT_MODIFIED)
+    end
+end
+
+
+-- The register version and the comma separated pre-compressed encodings
+-- recorded by the build in `etags.json`, or nil if they are unknown.
+--
+-- They are kept in the `registers` shared dictionary for `MANIFEST_TTL`
+-- seconds so the file is read and decoded once in a while instead of on
+-- every request.
+function M.manifest()
+    local cache = ngx.shared.registers
+    local value = cache:get("manifest")
+
+    if value == nil then
+        local manifest = M.read_manifest() or {}
+        local version = manifest.version
+        local encodings = manifest.encodings
+
+        if type(version) ~= "string" then
+            version = ""
+        end
+
+        if type(encodings) ~= "table" then
+            encodings = {}
+        end
+
+        value = version .. "," .. table.concat(encodings, ",")
+        cache:set("manifest", value, M.MANIFEST_TTL)
+    end
+
+    local version, encodings = string.match(value, "^([^,]*),(.*)$")
+
+    if version == "" then
+        return nil, nil
+    end
+
+    return version, encodings
+end
+
+
+-- Reads and decodes `etags.json`. Returns nil if it is missing or invalid.
+function M.read_manifest()
+    local file = io.open(M.resource_path("etags.json"), "rb")
+
+    if file == nil then
+        return nil
+    end
+
+    local manifest = cjson.decode(file:read("*a"))
+    file:close()
+
+    if type(manifest) ~= "table" then
+        return nil
+    end
+
+    return manifest
+end
+
+
+-- Computes the directory a record lives in when the build uses sharded
+-- directories: the first two hex characters of the sha-256 of the key.
+function M.key_shard(key)
+    local resty_sha256 = require("resty.sha256")
+    local resty_string = require("resty.string")
+    local hasher = resty_sha256:new()
+
+    hasher:update(key)
+
+    return string.sub(resty_string.to_hex(hasher:final()), 1, 2)
+end
+
+
+-- The absolute path of the given build resource.
+function M.resource_path(resource)
+    return ngx.config.prefix() .. "public/" .. resource
 end
 
 
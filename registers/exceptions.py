@@ -6,6 +6,19 @@ RegistersExceptions for the registers package.
 class RegistersException(Exception):
     """Found an entry with a reference to a missing blob."""
 
+    def __reduce__(self):
+        # Subclasses take custom arguments but store only the message, so
+        # they are rebuilt from their class, message and attributes to
+        # survive pickling (e.g. the trip back from a worker process).
+        return (_restore, (type(self), self.args), self.__dict__)
+
+
+def _restore(cls, args):
+    err = cls.__new__(cls)
+    err.args = args
+
+    return err
+
 
 class OrphanEntry(RegistersException):
     """Found an entry with a reference to a missing blob."""
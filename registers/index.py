@@ -0,0 +1,260 @@
+# -*- coding: utf-8 -*-
+
+"""
+This module implements the register index, the minimal state of a register
+needed to create and seal patches without loading the register: the Merkle
+frontier of the data log, the latest blob hash for every key and the
+metadata commands the schema derives from.
+
+The index can be kept in a sidecar file next to the RSF file. It records the
+offset it read the RSF file up to so only the commands appended since have to
+be read again.
+
+
+:copyright: © 2019 Crown Copyright (Government Digital Service)
+:license: MIT, see LICENSE for more details.
+"""
+
+import json
+import os
+from typing import Dict, List, Optional, cast
+from . import merkle
+from .blob import Blob
+from .entry import Entry, Scope
+from .exceptions import InconsistentLog, OrphanEntry
+from .hash import Hash
+from .register import Register
+from .rsf import Action, Command, add_item, append_entry
+from .rsf.parser import parse_command, parse_hash
+from .schema import Schema
+
+
+SUFFIX = ".index"
+TAIL_SIZE = 64
+VERSION = 1
+
+
+class Index:
+    """
+    Represents the state of a register needed to create patches.
+
+    >>> index = Index()
+    >>> index.update("tests/fixtures/country.rsf")
+    454
+    >>> from registers import rsf, Register
+    >>> register = Register(rsf.read("tests/fixtures/country.rsf"))
+    >>> index.digest() == register.log.digest()
+    True
+    >>> index.records["GB"] == register.record("GB").blob.digest()
+    True
+    """
+
+    def __init__(self, frontier: Optional[merkle.Frontier] = None,
+                 records: Optional[Dict[str, Hash]] = None,
+                 metadata: Optional[List[Command]] = None,
+                 offset: int = 0, tail: bytes = b""):
+        self.frontier = frontier or merkle.Frontier()
+        self.records = records or {}
+        self.offset = offset
+        self.tail = tail
+        self._metadata = metadata or []
+        self._metablobs: Dict[Hash, Blob] = {
+            cast(Blob, command.value).digest(): cast(Blob, command.value)
+            for command in self._metadata
+            if command.action == Action.AddItem}
+
+    def digest(self) -> Hash:
+        """
+        The root hash of the data log.
+        """
+
+        return Hash("sha-256", self.frontier.root_hash.hex())
+
+    @property
+    def size(self) -> int:
+        """
+        The number of entries in the data log.
+        """
+
+        return self.frontier.width
+
+    def metadata(self) -> Register:
+        """
+        A register with the metadata log only.
+        """
+
+        return Register(list(self._metadata))
+
+    def schema(self) -> Schema:
+        """
+        Computes the current schema out of the metadata.
+        """
+
+        return self.metadata().schema()
+
+    def matches(self, rsf_file: str) -> bool:
+        """
+        Checks if the index was read from the given RSF file, i.e. the file is
+        at least as long as the index offset and the bytes right before it are
+        the ones the index ended with.
+        """
+
+        if os.path.getsize(rsf_file) < self.offset:
+            return False
+
+        with open(rsf_file, "rb") as handle:
+            handle.seek(self.offset - len(self.tail))
+
+            return handle.read(len(self.tail)) == self.tail
+
+    def update(self, rsf_file: str) -> int:
+        """
+        Reads the commands of the RSF file from the index offset to the end
+        of the file. Returns the number of commands read.
+        """
+
+        complete = self.offset == 0
+        blobs: Dict[Hash, Blob] = {}
+        number = 0
+
+        with open(rsf_file, "rb") as handle:
+            handle.seek(self.offset)
+
+            for line in handle:
+                self.fold(parse_command(line.decode("utf-8")), blobs,
+                          complete)
+                self.offset += len(line)
+                number += 1
+
+            start = max(self.offset - TAIL_SIZE, 0)
+            handle.seek(start)
+            self.tail = handle.read(self.offset - start)
+
+        return number
+
+    def fold(self, command: Command, blobs: Dict[Hash, Blob],
+             complete: bool = True):
+        """
+        Applies a command to the index. ``blobs`` collects the items added so
+        far in the same read.
+
+        Items of user entries are only checked when ``complete`` is true, as
+        they might have been added before the index offset.
+        """
+
+        if command.action == Action.AssertRootHash:
+            digest = cast(Hash, command.value)
+
+            if digest != self.digest():
+                raise InconsistentLog(digest, self.digest(), self.size)
+
+        elif command.action == Action.AddItem:
+            blob = cast(Blob, command.value)
+            blobs[blob.digest()] = blob
+
+        elif command.action == Action.AppendEntry:
+            entry = cast(Entry, command.value)
+
+            if entry.scope == Scope.System:
+                item = blobs.get(entry.blob_hash,
+                                 self._metablobs.get(entry.blob_hash))
+
+                if item is None:
+                    raise OrphanEntry(entry)
+
+                self._metablobs[entry.blob_hash] = item
+                self._metadata.extend([add_item(item), append_entry(entry)])
+
+            else:
+                if complete and entry.blob_hash not in blobs:
+                    raise OrphanEntry(entry)
+
+                entry.set_position(self.size + 1)
+                self.frontier.append(entry.bytes())
+                self.records[entry.key] = entry.blob_hash
+
+    def to_dict(self) -> Dict:
+        """
+        The sidecar representation of the index.
+        """
+
+        return {
+            "version": VERSION,
+            "offset": self.offset,
+            "tail": self.tail.hex(),
+            "width": self.frontier.width,
+            "frontier": [[height, digest.hex()]
+                         for height, digest in self.frontier.nodes],
+            "records": {key: str(value)
+                        for key, value in self.records.items()},
+            "metadata": [str(command) for command in self._metadata]
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "Index":
+        """
+        Restores an index from its sidecar representation.
+        """
+
+        frontier = merkle.Frontier.restore(
+            [(height, bytes.fromhex(digest))
+             for height, digest in data["frontier"]], data["width"])
+
+        return cls(frontier,
+                   {key: parse_hash(value)
+                    for key, value in data["records"].items()},
+                   [parse_command(line) for line in data["metadata"]],
+                   data["offset"],
+                   bytes.fromhex(data["tail"]))
+
+
+def sidecar_path(rsf_file: str) -> str:
+    """
+    The default sidecar file for the given RSF file.
+
+    >>> sidecar_path("country.rsf")
+    'country.rsf.index'
+    """
+
+    return f"{rsf_file}{SUFFIX}"
+
+
+def load(rsf_file: str, sidecar: Optional[str] = None) -> Index:
+    """
+    Loads the index of the given RSF file.
+
+    When a sidecar is given the index is read from it and only the commands
+    appended to the RSF file since are read. It is read from scratch when the
+    sidecar does not exist or does not match the RSF file, and saved back if
+    anything was read.
+    """
+
+    index = None
+
+    if sidecar and os.path.exists(sidecar):
+        with open(sidecar, "r") as handle:
+            data = json.load(handle)
+
+        if data.get("version") == VERSION:
+            index = Index.from_dict(data)
+
+    if index is None or not index.matches(rsf_file):
+        index = Index()
+
+    if index.update(rsf_file) and sidecar:
+        dump(index, sidecar)
+
+    return index
+
+
+def dump(index: Index, sidecar: str):
+    """
+    Writes the index to the given sidecar file atomically.
+    """
+
+    temp = f"{sidecar}.{os.getpid()}.tmp"
+
+    with open(temp, "w") as handle:
+        json.dump(index.to_dict(), handle, separators=(",", ":"))
+
+    os.replace(temp, sidecar)
@@ -7,7 +7,9 @@ This module implements the Log representation and utilities to work with it.
 :license: MIT, see LICENSE for more details.
 """
 
-from typing import List, Dict, Union, Optional, cast, Tuple
+from collections import ChainMap
+from typing import (List, Dict, MutableMapping, Union, Optional, cast,
+                    Tuple)
 from .rsf.parser import Command, Action
 from .exceptions import (OrphanEntry, InsertException, DuplicatedEntry,
                          ValidationError, InconsistentLog)
@@ -146,10 +148,14 @@ def collect(commands: List[Command],  # pylint: disable=too-many-branches
                     ensures backwards compatibility with current registers.
                     For example, the country register has a duplicate entry
                     for `field:country`.
+
+    Blobs are looked up through a layered view over the blobs added by the
+    given commands and the blobs of both logs, which are never copied.
     """
     data = log or Log()
     metadata = metalog or Log()
-    blobs = {**data.blobs, **metadata.blobs}
+    blobs: MutableMapping[Hash, Blob] = ChainMap({}, data.blobs,
+                                                 metadata.blobs)
     errors: List[ValidationError] = []
 
     for command in commands:
@@ -178,7 +184,7 @@ def slice(log: Log, start_position: int) -> List[Command]:
 def _collect_command(command: Command,
                      data: Log,
                      metadata: Log,
-                     blobs: Dict[Hash, Blob],
+                     blobs: MutableMapping[Hash, Blob],
                      errors: List[ValidationError],
                      relaxed: bool):
     if command.action == Action.AssertRootHash:
@@ -8,7 +8,7 @@ This module implements the Merkle tree algorithm.
 """
 
 from hashlib import sha256
-from typing import List, Callable, Optional, Tuple
+from typing import Iterable, List, Callable, Optional, Tuple
 
 
 Leaf = bytes
@@ -91,6 +91,100 @@ class Tree:
         return len(self._leaves)
 
 
+class Frontier:
+    """
+    Computes the root hash of a Merkle tree incrementally, one leaf at a
+    time, keeping only the roots of the perfect subtrees on its right edge:
+    at most log2(n) digests instead of the whole tree.
+
+    It gives the same root hash as ``Tree``:
+
+    >>> leaves = [bytes([i]) for i in range(7)]
+    >>> frontier = Frontier(leaves[:3])
+    >>> for leaf in leaves[3:]:
+    ...     frontier.append(leaf)
+    >>> frontier.root_hash == Tree(leaves).root_hash
+    True
+    >>> Frontier().root_hash == Tree([]).root_hash
+    True
+    """
+
+    def __init__(self, leaves: Iterable[Leaf] = ()):
+        self._hash_fun = sha256
+        self._nodes: List[Tuple[int, Digest]] = []
+        self._width = 0
+
+        for leaf in leaves:
+            self.append(leaf)
+
+    @classmethod
+    def restore(cls, nodes: List[Tuple[int, Digest]], width: int):
+        """
+        Restores a frontier from its ``nodes`` and ``width``.
+
+        >>> frontier = Frontier([b"a", b"b", b"c"])
+        >>> copy = Frontier.restore(frontier.nodes, frontier.width)
+        >>> copy.root_hash == frontier.root_hash
+        True
+        """
+
+        frontier = cls()
+        frontier._nodes = list(nodes)
+        frontier._width = width
+
+        return frontier
+
+    def append(self, leaf: Leaf):
+        """
+        Appends a leaf merging every pair of perfect subtrees of the same
+        height.
+        """
+
+        height = 0
+        node = hash_leaf(leaf, self._hash_fun)
+
+        while self._nodes and self._nodes[-1][0] == height:
+            _, left = self._nodes.pop()
+            node = hash_node(left, node, self._hash_fun)
+            height += 1
+
+        self._nodes.append((height, node))
+        self._width += 1
+
+    @property
+    def root_hash(self) -> Digest:
+        """
+        The root hash.
+        """
+
+        if not self._nodes:
+            return hash_empty(self._hash_fun)
+
+        node = self._nodes[-1][1]
+
+        for _, left in reversed(self._nodes[:-1]):
+            node = hash_node(left, node, self._hash_fun)
+
+        return node
+
+    @property
+    def width(self) -> int:
+        """
+        The number of leaves appended.
+        """
+
+        return self._width
+
+    @property
+    def nodes(self) -> List[Tuple[int, Digest]]:
+        """
+        The height and digest of the root of each perfect subtree on the
+        right edge, left to right.
+        """
+
+        return list(self._nodes)
+
+
 def build_levels(leaves: List[Leaf], fun: Callable) -> List[Level]:
     """
     Builds all levels from the given list of leaves.
@@ -14,10 +14,10 @@ progress can be found here:
 """
 
 
-from typing import List
+from typing import List, Tuple
 from .core import (Action, Command,  # NOQA
                    assert_root_hash, add_item, append_entry)
-from .parser import parse, load  # NOQA
+from .parser import parse, parse_command, load  # NOQA
 
 
 def read(filepath: str) -> List[Command]:
@@ -32,6 +32,30 @@ def read(filepath: str) -> List[Command]:
         return parse(handle)
 
 
+def read_canonical(filepath: str) -> Tuple[List[Command], bool]:
+    """
+    Reads an RSF file and checks whether it is canonical, i.e. byte for byte
+    the serialisation of the commands read from it (see ``dump``). Line
+    endings, whitespace and JSON layout are normalised when parsed so a file
+    that is not canonical cannot stand in for its commands.
+
+    >>> commands, canonical = read_canonical("tests/fixtures/country.rsf")
+    >>> canonical
+    True
+    """
+
+    commands = []
+    canonical = True
+
+    with open(filepath, 'r', newline="") as handle:
+        for line in handle:
+            command = parse_command(line)
+            commands.append(command)
+            canonical = canonical and line == f"{command}\n"
+
+    return commands, canonical
+
+
 def dump(commands: List[Command]) -> str:
     """
     Stringifies the given list of commands.
@@ -10,12 +10,15 @@ Cardinality, Datatype and helper functions to operate on them.
 """
 
 
-from typing import List, Optional, cast
+from typing import TYPE_CHECKING, List, Optional, cast
 import json
 from enum import Enum
 from .exceptions import AttributeAlreadyExists, MissingAttributeIdentifier
 from .blob import Blob
 
+if TYPE_CHECKING:
+    from .validator import Validator  # pylint: disable=cyclic-import
+
 
 DATATYPES = ["curie",
              "datetime",
@@ -161,6 +164,14 @@ class Schema:
     def __init__(self, primary_key_id: str, attrs: List[Attribute] = None):
         self._primary_key = primary_key_id
         self._attrs = attrs or []
+        self._validator: Optional["Validator"] = None
+        self._cache_size: Optional[int] = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_validator"] = None
+
+        return state
 
     @property
     def attributes(self):
@@ -195,6 +206,7 @@ class Schema:
             raise AttributeAlreadyExists(attr)
 
         self._attrs.append(attr)
+        self._validator = None
 
     def get(self, uid) -> Optional[Attribute]:
         """
@@ -206,6 +218,31 @@ class Schema:
 
         return None
 
+    def compile_validator(self,
+                          cache_size: Optional[int] = None) -> "Validator":
+        """
+        The validator specialised for the schema (``validator.Validator``).
+        It is compiled once and cached until an attribute is inserted.
+
+        ``cache_size`` sets the size of the cache of value checks, 0 to turn
+        it off, for this and later calls. The default is
+        ``validator.VALUE_CACHE_SIZE``.
+        """
+
+        if cache_size is not None and cache_size != self._cache_size:
+            self._cache_size = cache_size
+            self._validator = None
+
+        if self._validator is None:
+            from .validator import Validator  # pylint: disable=all
+
+            if self._cache_size is None:
+                self._validator = Validator(self)
+            else:
+                self._validator = Validator(self, self._cache_size)
+
+        return self._validator
+
     def to_dict(self):
         """
         Schema json representation.
@@ -8,11 +8,14 @@ This module implements the validation functions for values.
 """
 
 import re
+from functools import lru_cache
 from urllib.parse import urlparse
-from typing import Dict, Union, List, cast
+from typing import (Callable, Dict, Iterable, Union, List, Optional, Tuple,
+                    cast)
 from .schema import Schema, Cardinality, Datatype, Attribute
 from .exceptions import (MissingPrimaryKey, CardinalityMismatch,
                          RepresentationError, UnknownAttribute,
+                         ValidationError,
                          InvalidCurieValue,
                          InvalidDatetimeValue,
                          InvalidNameValue,
@@ -23,39 +26,157 @@ from .exceptions import (MissingPrimaryKey, CardinalityMismatch,
                          InvalidUrlValue)
 
 
-def validate(data: Dict[str, Union[str, List[str]]], schema: Schema) -> bool:
+Data = Dict[str, Union[str, List[str]]]
+Check = Tuple[Callable[[str], object], Callable[[str], ValidationError]]
+
+VALUE_CACHE_SIZE = 4096
+
+
+def validate(data: Data, schema: Schema) -> bool:
     """
     Validates a blob-like dictionary against the given schema.
 
     If the given data is invalid it raises a ``ValidationError`` exception.
     """
 
-    if data.get(schema.primary_key) is None:
-        raise MissingPrimaryKey(schema.primary_key, data)
+    return schema.compile_validator().validate(data)
 
-    for key, value in data.items():
-        attr = schema.get(key)
 
-        if attr is None:
-            raise UnknownAttribute(key, value)
+class Validator:
+    """
+    Validator specialised for a schema: attributes are looked up in a dict
+    and each of them is bound to the check of its datatype upfront.
 
-        if value is None:
-            continue
+    The outcome of checking each token is memoised in a ``ValueCache`` of
+    ``cache_size`` entries unless it is 0.
 
-        if isinstance(value, List):
-            if attr.cardinality is not Cardinality.Many:
-                raise CardinalityMismatch(key, attr.cardinality.value, value)
+    Use ``Schema.compile_validator`` which caches it on the schema.
+    """
 
-            for token in value:
-                validate_value(token, attr)
+    def __init__(self, schema: Schema, cache_size: int = VALUE_CACHE_SIZE):
+        self.primary_key = schema.primary_key
+        self.cache = ValueCache(cache_size) if cache_size > 0 else None
+        self._attrs = {attr.uid: attr for attr in schema.attributes}
+        self._checks: Dict[str, Optional[Check]] = {}
 
-        else:
-            if attr.cardinality is not Cardinality.One:
-                raise CardinalityMismatch(key, attr.cardinality.value, value)
+        for attr in schema.attributes:
+            check = CHECKS.get(attr.datatype)
 
-            validate_value(value, attr)
+            if check is not None and self.cache is not None:
+                check = (self.cache.wrap(attr.datatype, check[0]), check[1])
 
-    return True
+            self._checks[attr.uid] = check
+
+    def attribute(self, uid: str) -> Optional[Attribute]:
+        """
+        Gets the attribute for the given identifier.
+        """
+
+        return self._attrs.get(uid)
+
+    def validate(self, data: Data, datatypes: bool = True) -> bool:
+        """
+        Validates a blob-like dictionary.
+
+        If the given data is invalid it raises a ``ValidationError``
+        exception. Values are not checked against the datatype of their
+        attribute unless ``datatypes`` is true, e.g. when they have already
+        been checked with ``validate_column``.
+        """
+
+        if data.get(self.primary_key) is None:
+            raise MissingPrimaryKey(self.primary_key, data)
+
+        for key, value in data.items():
+            attr = self._attrs.get(key)
+
+            if attr is None:
+                raise UnknownAttribute(key, value)
+
+            if value is None:
+                continue
+
+            if isinstance(value, List):
+                if attr.cardinality is not Cardinality.Many:
+                    raise CardinalityMismatch(key, attr.cardinality.value,
+                                              value)
+
+                for token in value:
+                    self.validate_value(token, attr, datatypes)
+
+            else:
+                if attr.cardinality is not Cardinality.One:
+                    raise CardinalityMismatch(key, attr.cardinality.value,
+                                              value)
+
+                self.validate_value(value, attr, datatypes)
+
+        return True
+
+    def validate_value(self, value: str, attr: Attribute,
+                       datatype: bool = True):
+        """
+        Validates a value against the given attribute. Only its
+        representation is checked unless ``datatype`` is true.
+        """
+
+        if not isinstance(value, str):
+            raise RepresentationError(attr.uid, value, attr.datatype.value)
+
+        check = self._checks[attr.uid]
+
+        if datatype and check is not None and not check[0](value):
+            raise check[1](value)
+
+
+class ValueCache:
+    """
+    Bounded LRU caches of the outcome of checking a token against a
+    datatype, one of ``maxsize`` entries per datatype. Registers repeat a
+    handful of values (dates, curies, urls) across many rows so most checks
+    are hits.
+
+    >>> cache = ValueCache(2)
+    >>> check = cache.wrap(Datatype.Integer, validate_integer)
+    >>> [check(token) for token in ["1", "x", "1", "2", "x"]]
+    [True, False, True, True, False]
+    >>> cache.hits, cache.misses
+    (1, 4)
+    """
+
+    def __init__(self, maxsize: int = VALUE_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._checks: Dict[Datatype, Callable[[str], bool]] = {}
+
+    def wrap(self, datatype: Datatype,
+             check: Callable[[str], object]) -> Callable[[str], bool]:
+        """
+        The memoised version of the check for the given datatype.
+        """
+
+        if datatype not in self._checks:
+            self._checks[datatype] = lru_cache(maxsize=self.maxsize)(
+                lambda value: bool(check(value)))
+
+        return self._checks[datatype]
+
+    @property
+    def hits(self) -> int:
+        """
+        The number of checks answered from the cache.
+        """
+
+        return sum(check.cache_info().hits  # type: ignore
+                   for check in self._checks.values())
+
+    @property
+    def misses(self) -> int:
+        """
+        The number of checks computed.
+        """
+
+        return sum(check.cache_info().misses  # type: ignore
+                   for check in self._checks.values())
 
 
 def validate_value(value: str, attr: Attribute):
@@ -82,38 +203,83 @@ PERIOD_RE = re.compile(r'^P(\d+Y)?(\d+M)?(\d+D)?(T(\d+H)?(\d+M)?(\d+S)?)?$')
 TIMESTAMP_RE = re.compile(r'^\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}Z$')
 
 
-def validate_value_datatype(value: str, datatype: Datatype) -> bool:
+def validate_column(values: Iterable[Optional[str]],
+                    attr: Attribute) -> List[Tuple[int, ValidationError]]:
     """
-    Validates a value against the given datatype.
-
-    If the given value is invalid it raises a ``InvalidValue`` exception.
+    Validates a column of values (single tokens, not multivalues) against the
+    given attribute in one pass and returns the index and error of every
+    invalid value. ``None`` values are skipped.
+
+    For datatypes checked by a regular expression the values are joined by
+    newlines and scanned at once with a multiline expression matching the
+    lines the datatype expression does not match. Columns with ``None``
+    values or values with a newline, and datatypes with extra rules (period,
+    url), are checked one by one.
+
+    >>> from .schema import integer
+    >>> [(index, str(err)) for index, err
+    ...  in validate_column(["1", "-2", "x", None, "03"], integer("n"))]
+    [(2, "'x' is not a valid 'integer'."), (4, "'03' is not a valid \
+'integer'.")]
     """
 
-    if datatype is Datatype.Curie and not validate_curie(value):
-        raise InvalidCurieValue(value)
+    column = list(values)
+    check = CHECKS.get(attr.datatype)
+    pattern = COLUMN_RES.get(attr.datatype)
+
+    if check is None or pattern is None:
+        return _validate_cells(column, attr)
+
+    try:
+        buffer = "\n".join(cast(List[str], column))
+    except TypeError:
+        return _validate_cells(column, attr)
+
+    if buffer.count("\n") != len(column) - 1:
+        return _validate_cells(column, attr)
+
+    failures: List[Tuple[int, ValidationError]] = []
+    index = offset = 0
 
-    if datatype is Datatype.Datetime and not validate_datetime(value):
-        raise InvalidDatetimeValue(value)
+    for match in pattern.finditer(buffer):
+        index += buffer.count("\n", offset, match.start())
+        offset = match.start()
+        failures.append((index, check[1](match.group())))
 
-    if datatype is Datatype.Name and not validate_name(value):
-        raise InvalidNameValue(value)
+    return failures
 
-    if datatype is Datatype.Hash and not validate_hash(value):
-        raise InvalidHashValue(value)
 
-    if datatype is Datatype.Integer and not validate_integer(value):
-        raise InvalidIntegerValue(value)
+def _validate_cells(column: List[Optional[str]],
+                    attr: Attribute) -> List[Tuple[int, ValidationError]]:
+    check = CHECKS.get(attr.datatype)
+    failures: List[Tuple[int, ValidationError]] = []
 
-    if datatype is Datatype.Period and not validate_period(value):
-        raise InvalidPeriodValue(value)
+    for index, value in enumerate(column):
+        if value is None:
+            continue
+
+        if not isinstance(value, str):
+            failures.append((index, RepresentationError(
+                attr.uid, value, attr.datatype.value)))
+
+        elif check is not None and not check[0](value):
+            failures.append((index, check[1](value)))
 
-    if datatype is Datatype.Timestamp and not validate_timestamp(value):
-        raise InvalidTimestampValue(value)
+    return failures
 
-    if datatype is Datatype.Url and not validate_url(value):
-        raise InvalidUrlValue(value)
 
-    # Datatype.String and Datatype.Text are assumed to be valid.
+def validate_value_datatype(value: str, datatype: Datatype) -> bool:
+    """
+    Validates a value against the given datatype.
+
+    If the given value is invalid it raises a ``InvalidValue`` exception.
+    """
+
+    check = CHECKS.get(datatype)
+
+    if check is not None and not check[0](value):
+        raise check[1](value)
+
     return True
 
 
@@ -226,3 +392,27 @@ def _is_valid_duration(value):
 
 def _is_valid_period_part(value):
     return DATETIME_RE.match(value) or _is_valid_duration(value)
+
+
+# Datatype.String and Datatype.Text are assumed to be valid.
+CHECKS: Dict[Datatype, Check] = {
+    Datatype.Curie: (CURIE_RE.match, InvalidCurieValue),
+    Datatype.Datetime: (DATETIME_RE.match, InvalidDatetimeValue),
+    Datatype.Name: (NAME_RE.match, InvalidNameValue),
+    Datatype.Hash: (HASH_RE.match, InvalidHashValue),
+    Datatype.Integer: (INTEGER_RE.match, InvalidIntegerValue),
+    Datatype.Period: (validate_period, InvalidPeriodValue),
+    Datatype.Timestamp: (TIMESTAMP_RE.match, InvalidTimestampValue),
+    Datatype.Url: (validate_url, InvalidUrlValue),
+}
+
+# Matches the lines of a newline-joined column that the anchored (^...$)
+# datatype expression does not match.
+COLUMN_RES = {datatype: re.compile(f"^(?!(?:{regex.pattern[1:-1]})$).*$",
+                                   re.MULTILINE)
+              for datatype, regex in [(Datatype.Curie, CURIE_RE),
+                                      (Datatype.Datetime, DATETIME_RE),
+                                      (Datatype.Name, NAME_RE),
+                                      (Datatype.Hash, HASH_RE),
+                                      (Datatype.Integer, INTEGER_RE),
+                                      (Datatype.Timestamp, TIMESTAMP_RE)]}
@@ -11,18 +11,40 @@ Multivalues have the delimiter semi-colon ``;`` and it can't be changed.
 :license: MIT, see LICENSE for more details.
 """
 
-from typing import List, NewType, Dict, cast, Optional, TextIO
+from typing import (Callable, Iterable, Iterator, List, NamedTuple, NewType,
+                    Dict, cast, Optional, Set, TextIO, Tuple)
 import csv
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
 from io import StringIO
+from itertools import islice
 from .blob import Blob, Value
 from .entry import Entry
 from .record import Record
-from .schema import Cardinality, Schema
-from .exceptions import RegistersException, UnknownAttribute, InvalidKey
-from .validator import validate, validate_key
+from .schema import Attribute, Cardinality, Schema
+from .exceptions import (RegistersException, UnknownAttribute, InvalidKey,
+                         MissingPrimaryKey, ValidationError)
+from .validator import validate_column, validate_key
 
 
 Row = NewType("Row", List[str])
+Outcome = Tuple[Optional[Blob], Optional[RegistersException]]
+
+
+class CellError(NamedTuple):
+    """
+    A validation error found in a cell. ``column`` is ``None`` for values
+    found beyond the header.
+    """
+
+    column: Optional[str]
+    value: Optional[str]
+    reason: str
+
+
+Report = Tuple[Optional[Blob], List[CellError]]
+
+CHUNK_SIZE = 1000
 
 
 def serialise(stream: TextIO, obj, headers: List[str]):
@@ -148,11 +170,214 @@ def deserialise(buffer: TextIO, schema: Schema) -> List[Blob]:
     schema.
     """
 
+    return list(deserialise_stream(buffer, schema))
+
+
+def deserialise_stream(buffer: TextIO, schema: Schema,
+                       jobs: Optional[int] = None,
+                       chunk_size: int = CHUNK_SIZE) -> Iterator[Blob]:
+    """
+    Reads an XSV stream lazily and yields the blobs coerced with the given
+    schema one at a time, so memory does not grow with the number of rows.
+
+    If ``jobs`` is greater than 1 rows are coerced and validated in chunks of
+    ``chunk_size`` by a pool of processes. Blobs are yielded in input order
+    and the first invalid row raises the same exception as the serial path.
+    """
+
+    rows = read_rows(buffer)
+
+    if jobs is None or jobs < 2:
+        for row in rows:
+            yield coerce(row, schema)
+
+        return
+
+    for outcomes in map_chunks(coerce_chunk, rows, schema, jobs, chunk_size):
+        yield from unwrap(outcomes)
+
+
+def deserialise_report(buffer: TextIO, schema: Schema,
+                       jobs: Optional[int] = None,
+                       chunk_size: int = CHUNK_SIZE) -> Iterator[Report]:
+    """
+    Reads an XSV stream lazily like ``deserialise_stream`` but instead of
+    raising the first error it yields, for every row, either the blob or
+    every error found in the row (see ``coerce_all``).
+    """
+
+    rows = read_rows(buffer)
+
+    if jobs is None or jobs < 2:
+        for chunk in chunks(rows, chunk_size):
+            yield from coerce_all_chunk(chunk, schema)
+
+        return
+
+    for reports in map_chunks(coerce_all_chunk, rows, schema, jobs,
+                              chunk_size):
+        yield from reports
+
+
+def read_rows(buffer: TextIO) -> Iterator[Dict[str, str]]:
+    """
+    Reads the rows of an XSV stream sniffing the separator.
+    """
+
     dialect = csv.Sniffer().sniff(buffer.read(2048))
     buffer.seek(0)
 
-    return [coerce(row, schema) for row
-            in csv.DictReader(buffer, dialect=dialect)]
+    return csv.DictReader(buffer, dialect=dialect)
+
+
+def map_chunks(fun: Callable[[List[Dict[str, str]], Schema], List],
+               rows: Iterable[Dict[str, str]], schema: Schema, jobs: int,
+               chunk_size: int = CHUNK_SIZE) -> Iterator[List]:
+    """
+    Applies ``fun`` to chunks of rows in a pool of ``jobs`` processes and
+    yields the results in input order, with at most ``2 * jobs`` chunks in
+    flight.
+    """
+
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        pending: "deque[Future]" = deque()
+
+        for chunk in chunks(rows, chunk_size):
+            pending.append(executor.submit(fun, chunk, schema))
+
+            if len(pending) >= 2 * jobs:
+                yield pending.popleft().result()
+
+        while pending:
+            yield pending.popleft().result()
+
+
+def chunks(rows: Iterable[Dict[str, str]],
+           size: int) -> Iterator[List[Dict[str, str]]]:
+    """
+    Splits the given rows in lists of the given size.
+
+    >>> list(chunks(iter([{"a": "1"}, {"a": "2"}, {"a": "3"}]), 2))
+    [[{'a': '1'}, {'a': '2'}], [{'a': '3'}]]
+    """
+
+    iterator = iter(rows)
+
+    while True:
+        chunk = list(islice(iterator, size))
+
+        if not chunk:
+            return
+
+        yield chunk
+
+
+def coerce_chunk(rows: List[Dict[str, str]], schema: Schema) -> List[Outcome]:
+    """
+    Coerces every row of the chunk. Each outcome is either the blob or the
+    validation error.
+    """
+
+    outcomes: List[Outcome] = []
+
+    for row in rows:
+        try:
+            outcomes.append((coerce(row, schema), None))
+        except RegistersException as err:
+            outcomes.append((None, err))
+
+    return outcomes
+
+
+def coerce_all_chunk(rows: List[Dict[str, str]],
+                     schema: Schema) -> List[Report]:
+    """
+    Coerces every row of the chunk collecting every error.
+
+    Values are checked against their datatype column by column (see
+    ``invalid_rows``) so the rows without an invalid value are coerced
+    without checking them again. The others are coerced cell by cell to
+    collect their errors (``coerce_all``).
+
+    >>> from . import Schema, schema
+    >>> sch = Schema("foo", [schema.name("foo"), schema.integer("n")])
+    >>> rows = [{"foo": "a", "n": "1"}, {"foo": "b", "n": "x"}]
+    >>> [(blob, [error.value for error in errors])
+    ...  for blob, errors in coerce_all_chunk(rows, sch)]
+    [({"foo":"a","n":"1"}, []), (None, ['x'])]
+    """
+
+    invalid = invalid_rows(rows, schema)
+    reports: List[Report] = []
+
+    for index, row in enumerate(rows):
+        if index not in invalid:
+            try:
+                reports.append((coerce(row, schema, datatypes=False), []))
+                continue
+            except RegistersException:
+                pass
+
+        reports.append(coerce_all(row, schema))
+
+    return reports
+
+
+def invalid_rows(rows: List[Dict[str, str]], schema: Schema) -> Set[int]:
+    """
+    Finds the rows with a value that is not valid for the datatype of its
+    attribute, checking each column at once (``validator.validate_column``).
+    Returns their indexes.
+
+    >>> from . import Schema, schema
+    >>> sch = Schema("foo", [schema.name("foo"), schema.integer_set("ns")])
+    >>> invalid_rows([{"foo": "a", "ns": "1;2"}, {"foo": "b", "ns": "3;x"},
+    ...               {"foo": "c", "ns": ""}], sch)
+    {1}
+    """
+
+    validator = schema.compile_validator()
+    columns: Dict[str, Tuple[List[int], List[str]]] = {}
+
+    for index, row in enumerate(rows):
+        for key, value in row.items():
+            if key is None or value is None or value.strip() in ["", ";"]:
+                continue
+
+            attr = validator.attribute(key.strip())
+
+            if attr is None:
+                continue
+
+            tokens = deserialise_value(value, attr.cardinality)
+            owners, values = columns.setdefault(attr.uid, ([], []))
+
+            for token in tokens if isinstance(tokens, List) else [tokens]:
+                owners.append(index)
+                values.append(cast(str, token))
+
+    invalid: Set[int] = set()
+
+    for uid, (owners, values) in columns.items():
+        attr = cast(Attribute, validator.attribute(uid))
+
+        for position, _ in validate_column(values, attr):
+            invalid.add(owners[position])
+
+    return invalid
+
+
+def unwrap(outcomes: List[Outcome]) -> Iterator[Blob]:
+    """
+    Yields the blobs of the given outcomes up to the first error, which is
+    raised.
+    """
+
+    for blob, err in outcomes:
+        if err is not None:
+            raise err
+
+        yield cast(Blob, blob)
 
 
 def deserialise_value(token: str, cardinality: Cardinality) -> Optional[Value]:
@@ -212,10 +437,12 @@ def split_token(token: str) -> List[str]:
     return next(stream)
 
 
-def coerce(data: Dict[str, str], schema: Schema) -> Blob:
+def coerce(data: Dict[str, str], schema: Schema,
+           datatypes: bool = True) -> Blob:
     """
     Takes a dictionary and attempts to coerce it as a Blob and validate
-    against the given Schema.
+    against the given Schema. Values are not checked against their datatype
+    unless ``datatypes`` is true (see ``Validator.validate``).
 
     >>> from . import Blob, Schema, schema
     >>> attrs = [schema.string("foo"), schema.integer_set("xs")]
@@ -253,13 +480,14 @@ def coerce(data: Dict[str, str], schema: Schema) -> Blob:
     """
 
     clean_data = {}
+    validator = schema.compile_validator()
 
     for key, value in data.items():
         if value is None or value.strip() in ["", ";"]:
             continue
 
         key = key.strip()
-        attr = schema.get(key)
+        attr = validator.attribute(key)
 
         if attr is None:
             raise UnknownAttribute(key, value)
@@ -270,6 +498,69 @@ def coerce(data: Dict[str, str], schema: Schema) -> Blob:
         clean_data[key] = cast(Value, deserialise_value(value,
                                                         attr.cardinality))
 
-    validate(clean_data, schema)
+    validator.validate(clean_data, datatypes)
 
     return Blob(clean_data)
+
+
+def coerce_all(data: Dict[str, str], schema: Schema) -> Report:
+    """
+    Coerces the given dictionary like ``coerce`` but instead of raising the
+    first error it returns every error found in it, one per cell.
+
+    >>> from . import Schema, schema
+    >>> attrs = [schema.name("foo"), schema.integer_set("xs")]
+    >>> sch = Schema("foo", attrs)
+    >>> for error in coerce_all({"foo": "abc", "xs": "1;x;y"}, sch)[1]:
+    ...     print(error.column, error.value, error.reason)
+    xs x 'x' is not a valid 'integer'.
+    xs y 'y' is not a valid 'integer'.
+    >>> coerce_all({"foo": "abc", "xs": "1"}, sch)[1]
+    []
+    """
+
+    try:
+        return coerce(data, schema), []
+    except RegistersException as err:
+        first = err
+
+    validator = schema.compile_validator()
+    errors: List[CellError] = []
+
+    for key, value in data.items():
+        if key is None:
+            errors.append(CellError(None, ";".join(cast(List[str], value)),
+                                    "Found more values than columns."))
+            continue
+
+        if value is None or value.strip() in ["", ";"]:
+            continue
+
+        key = key.strip()
+        attr = validator.attribute(key)
+
+        if attr is None:
+            errors.append(CellError(key, value,
+                                    str(UnknownAttribute(key, value))))
+            continue
+
+        if key == schema.primary_key and not validate_key(value):
+            errors.append(CellError(key, value, str(InvalidKey(value))))
+            continue
+
+        tokens = deserialise_value(value, attr.cardinality)
+
+        for token in tokens if isinstance(tokens, List) else [tokens]:
+            try:
+                validator.validate_value(cast(str, token), attr)
+            except ValidationError as err:
+                errors.append(CellError(key, token, str(err)))
+
+    pk_value = data.get(schema.primary_key)
+
+    if pk_value is None or pk_value.strip() == "":
+        errors.append(CellError(schema.primary_key, pk_value,
+                                str(MissingPrimaryKey(schema.primary_key,
+                                                      data))))
+
+    return None, errors or [CellError(None, None, str(first))]
@@ -0,0 +1,370 @@
+# pylint: disable=missing-docstring
+import gzip
+import json
+import os
+import shutil
+from pathlib import Path
+from zipfile import ZipFile
+from click.testing import CliRunner
+from registers import commands, rsf, Register
+from registers.commands import build
+from registers.commands.estimate import Estimator
+from registers.commands.writers import DirectoryWriter, SqliteStore
+
+
+COUNTRY_RSF = os.path.abspath("tests/fixtures/country.rsf")
+
+
+def test_build_precompress():
+    runner = CliRunner()
+
+    with runner.isolated_filesystem():
+        result = runner.invoke(commands.build.build_command,
+                               ["--precompress", "gzip", COUNTRY_RSF])
+
+        assert result.exit_code == 0
+
+        path = Path("build/country/records/index.json")
+        compressed = Path("build/country/records/index.json.gz")
+
+        assert gzip.decompress(compressed.read_bytes()) == path.read_bytes()
+        assert not Path("build/country/archive.zip.gz").exists()
+
+
+def test_build_precompress_unknown_encoding():
+    runner = CliRunner()
+    result = runner.invoke(commands.build.build_command,
+                           ["--precompress", "zstd", COUNTRY_RSF])
+
+    assert result.exit_code == 2
+
+
+def test_build_pages(tmp_path):
+    register = Register(rsf.read(COUNTRY_RSF))
+    path = tmp_path.joinpath("entries")
+    writer = DirectoryWriter(tmp_path)
+    cache = build.entry_cache()
+    fragments = cache.collection(register.log.entries)
+    build.build_pages(writer, "entries", fragments, cache.header, size=100)
+
+    manifest = json.loads(path.joinpath("index.json").read_text())
+    last_page = json.loads(path.joinpath("3.json").read_text())
+
+    assert manifest["total"] == 209
+    assert manifest["pages"][2] == {"page": 3, "start": 201, "end": 209}
+    assert [entry["entry-number"] for entry in last_page] == \
+        [str(number) for number in range(201, 210)]
+    assert len(path.joinpath("3.json").read_text().splitlines()) == 11
+
+
+def test_build_etags(tmp_path):
+    register = Register(rsf.read(COUNTRY_RSF))
+    build.build_etags(DirectoryWriter(tmp_path), register)
+
+    manifest = json.loads(tmp_path.joinpath("etags.json").read_text())
+    version = manifest["version"]
+
+    assert len(version) == 64
+    assert manifest["resources"]["records/index.csv"] == f'"{version}.csv"'
+    assert "items/index.json" in manifest["resources"]
+    assert manifest["encodings"] == []
+
+
+def test_build_etags_encodings(tmp_path):
+    register = Register(rsf.read(COUNTRY_RSF))
+    build.build_etags(DirectoryWriter(tmp_path), register, ["gzip"])
+
+    manifest = json.loads(tmp_path.joinpath("etags.json").read_text())
+    version = manifest["version"]
+    resources = manifest["resources"]
+
+    assert manifest["encodings"] == ["gzip"]
+    assert resources["records/index.json"] == f'"{version}.json"'
+    assert resources["records/index.json.gz"] == f'"{version}.json.gzip"'
+    assert "archive.zip.gz" not in resources
+
+
+def test_build_shard_dirs(tmp_path):
+    register = Register(rsf.read(COUNTRY_RSF))
+    writer = DirectoryWriter(tmp_path)
+    build.build_records(writer, register, shard_dirs=True)
+    build.build_trails(writer, register, shard_dirs=True)
+
+    assert tmp_path.joinpath("records/b4/GB.json").exists()
+    assert tmp_path.joinpath("records/b4/GB/entries.json").exists()
+    assert tmp_path.joinpath("records/index.json").exists()
+    assert not tmp_path.joinpath("records/GB.json").exists()
+
+
+def test_build_sqlite():
+    runner = CliRunner()
+
+    with runner.isolated_filesystem():
+        result = runner.invoke(commands.build.build_command,
+                               ["--output-format", "sqlite", COUNTRY_RSF])
+
+        assert result.exit_code == 0
+        assert not Path("build/country").exists()
+
+        store = SqliteStore(Path("build/country.sqlite"))
+        content_type, content = store.get("records/GB.json")
+
+        assert content_type == "application/json"
+        assert json.loads(content)["GB"]["key"] == "GB"
+        assert store.get("entries/index.json.offsets") is not None
+
+
+def test_build_tar_with_target():
+    runner = CliRunner()
+
+    with runner.isolated_filesystem():
+        result = runner.invoke(commands.build.build_command,
+                               ["--output-format", "tar", "--target",
+                                "docker", COUNTRY_RSF])
+
+        assert result.exit_code == 1
+
+
+def test_build_archive_full():
+    runner = CliRunner()
+
+    with runner.isolated_filesystem():
+        result = runner.invoke(commands.build.build_command,
+                               ["--archive-full", "--archive-level", "9",
+                                "--shard-dirs", COUNTRY_RSF])
+
+        assert result.exit_code == 0
+
+        with ZipFile("build/country/archive.zip") as archive:
+            names = archive.namelist()
+
+            assert archive.testzip() is None
+            assert "country/entry/209.json" in names
+            assert len(names) == 4 + 209 + 209
+            assert archive.read("country/record/index.json") == \
+                Path("build/country/records/index.json").read_bytes()
+
+
+def test_build_profile_json():
+    runner = CliRunner()
+
+    with runner.isolated_filesystem():
+        result = runner.invoke(commands.build.build_command,
+                               ["--profile-json", "profile.json",
+                                COUNTRY_RSF])
+
+        assert result.exit_code == 0
+
+        report = json.loads(Path("profile.json").read_text())
+        phases = {phase["phase"]: phase for phase in report["phases"]}
+
+        assert list(phases) == ["load", "blobs", "entries", "records",
+                                "trails", "commands", "context", "openapi",
+                                "etags", "archive"]
+        assert phases["load"]["files"] == 0
+        assert phases["entries"]["files"] > 209 * 2
+        assert report["total"]["bytes"] == sum(
+            file.stat().st_size for file in Path("build").rglob("*")
+            if file.is_file())
+
+
+def test_build_commands_copy(tmp_path):
+    commands, canonical = rsf.read_canonical(COUNTRY_RSF)
+    register = Register(commands)
+    build.build_commands(DirectoryWriter(tmp_path), register, COUNTRY_RSF,
+                         canonical=canonical)
+
+    assert tmp_path.joinpath("commands.rsf").read_bytes() == \
+        Path(COUNTRY_RSF).read_bytes()
+
+
+def test_build_commands_normalised(tmp_path):
+    source = tmp_path.joinpath("country.rsf")
+    source.write_bytes(Path(COUNTRY_RSF).read_bytes().rstrip(b"\n"))
+    register = Register(rsf.read(str(source)))
+    build.build_commands(DirectoryWriter(tmp_path), register, str(source))
+
+    assert tmp_path.joinpath("commands.rsf").read_text() == \
+        rsf.dump(register.commands)
+
+
+def test_build_commands_crlf(tmp_path):
+    source = tmp_path.joinpath("country.rsf")
+    source.write_bytes(Path(COUNTRY_RSF).read_bytes().replace(b"\n",
+                                                              b"\r\n"))
+    commands, canonical = rsf.read_canonical(str(source))
+    register = Register(commands)
+
+    assert not canonical
+
+    build.build_commands(DirectoryWriter(tmp_path), register, str(source))
+
+    assert tmp_path.joinpath("commands.rsf").read_bytes() == \
+        Path(COUNTRY_RSF).read_bytes()
+
+
+def test_build_commands_non_canonical_line(tmp_path):
+    lines = Path(COUNTRY_RSF).read_text().splitlines(keepends=True)
+    lines[10] = lines[10].replace('":"', '": "').replace("\n", "  \n")
+    source = tmp_path.joinpath("country.rsf")
+    source.write_text("".join(lines))
+    commands, canonical = rsf.read_canonical(str(source))
+    register = Register(commands)
+
+    assert not canonical
+
+    build.build_commands(DirectoryWriter(tmp_path), register, str(source),
+                         source_size=source.stat().st_size,
+                         canonical=canonical)
+
+    assert tmp_path.joinpath("commands.rsf").read_text() == \
+        rsf.dump(register.commands)
+
+
+def test_build_commands_changed_source(tmp_path):
+    source = tmp_path.joinpath("country.rsf")
+    shutil.copyfile(COUNTRY_RSF, source)
+    commands, canonical = rsf.read_canonical(str(source))
+    register = Register(commands)
+    size = source.stat().st_size
+
+    with open(source, "a") as handle:
+        handle.write(f"{commands[-2]}\n{commands[-1]}\n")
+
+    build.build_commands(DirectoryWriter(tmp_path), register, str(source),
+                         source_size=size, canonical=canonical)
+
+    assert canonical
+    assert tmp_path.joinpath("commands.rsf").read_bytes() == \
+        Path(COUNTRY_RSF).read_bytes()
+
+
+def test_build_shards_merge():
+    runner = CliRunner()
+    options = ["--archive-full", "--shard-dirs", COUNTRY_RSF]
+
+    def tree(path):
+        return {file.relative_to(path): file.read_bytes()
+                for file in Path(path).rglob("*") if file.is_file()}
+
+    with runner.isolated_filesystem():
+        result = runner.invoke(commands.build.build_command, options)
+        assert result.exit_code == 0
+        expected = tree("build")
+        shutil.rmtree("build")
+
+        for shard in ["1/2", "2/2"]:
+            result = runner.invoke(commands.build.build_command,
+                                   ["--shard", shard] + options)
+            assert result.exit_code == 0
+            assert not Path("build/country/records/index.json").exists()
+
+        result = runner.invoke(commands.build.build_command,
+                               ["--merge"] + options)
+        assert result.exit_code == 0
+        assert tree("build") == expected
+
+
+def test_build_threaded_writer():
+    runner = CliRunner()
+
+    def tree(path):
+        return {file.relative_to(path): file.read_bytes()
+                for file in Path(path).rglob("*") if file.is_file()}
+
+    with runner.isolated_filesystem():
+        result = runner.invoke(commands.build.build_command,
+                               ["--shard-dirs", COUNTRY_RSF])
+        expected = tree("build")
+
+        result = runner.invoke(commands.build.build_command,
+                               ["--writer", "threads", "--jobs", "4",
+                                "--shard-dirs", COUNTRY_RSF])
+
+        assert result.exit_code == 0
+        assert "MiB/s" in result.output
+        assert tree("build") == expected
+
+
+def test_build_estimate():
+    runner = CliRunner()
+
+    with runner.isolated_filesystem():
+        result = runner.invoke(commands.build.build_command,
+                               ["--estimate", COUNTRY_RSF])
+
+        assert result.exit_code == 0
+        assert not Path("build").exists()
+
+        rows = [line.split() for line in result.output.splitlines()]
+
+        assert ["entries", str(209 * 2)] in [row[:2] for row in rows]
+        assert rows[-1][0] == "total"
+
+
+def test_build_estimate_archive(tmp_path):
+    register = Register(rsf.read(COUNTRY_RSF))
+
+    for archive_full, names in [(False, build.ARCHIVE_FAMILIES),
+                                (True, build.ARCHIVE_FULL_FAMILIES)]:
+        estimator = Estimator(tmp_path)
+        build.estimate_resources(estimator, register,
+                                 archive_full=archive_full)
+        families = {family["family"]: family
+                    for family in estimator.families}
+
+        assert families["archive"]["bytes"] == sum(
+            families[name]["json-gzip-bytes"] for name in names)
+
+
+def test_build_blob_store():
+    runner = CliRunner()
+
+    with runner.isolated_filesystem():
+        for _ in range(2):
+            result = runner.invoke(commands.build.build_command,
+                                   ["--blob-store", "store", "--shard-dirs",
+                                    COUNTRY_RSF])
+
+            assert result.exit_code == 0
+
+        item = next(Path("build/country/items").glob("*/sha-256:*.json"))
+        stored = [file for file in Path("store").rglob("*") if file.is_file()]
+
+        assert "418 files from store, 0 of them new" in result.output
+        assert len(stored) == 418
+        assert item.stat().st_nlink == 2
+        assert json.loads(item.read_text())
+
+
+def test_build_staging_reuse():
+    runner = CliRunner()
+
+    with runner.isolated_filesystem():
+        result = runner.invoke(commands.build.build_command, [COUNTRY_RSF])
+        inode = Path("build/country/records/GB.json").stat().st_ino
+
+        result = runner.invoke(commands.build.build_command, [COUNTRY_RSF])
+
+        assert result.exit_code == 0
+        assert "Reused" in result.output
+        assert Path("build/country/records/GB.json").stat().st_ino == inode
+        assert sorted(os.listdir("build")) == ["country"]
+
+
+def test_build_publish_file(tmp_path):
+    staging = build.staging_path(tmp_path.joinpath("country.sqlite"))
+    staging.parent.mkdir()
+    staging.write_text("new")
+    tmp_path.joinpath("country.sqlite").write_text("old")
+    build.publish(staging, tmp_path.joinpath("country.sqlite"))
+
+    assert tmp_path.joinpath("country.sqlite").read_text() == "new"
+    assert not staging.parent.exists()
+
+
+def test_build_docker_twice(tmp_path):
+    build.build_docker(tmp_path)
+    build.build_docker(tmp_path)
+
+    assert tmp_path.joinpath("lua/utils.lua").exists()
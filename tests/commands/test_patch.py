@@ -1,6 +1,13 @@
 # pylint: disable=missing-docstring
+import json
+import os
+import shutil
 from click.testing import CliRunner
-from registers import commands
+from registers import commands, index, rsf
+
+
+FEC_RSF = os.path.abspath("tests/fixtures/further-education-college-uk.rsf")
+FEC_TSV = os.path.abspath("tests/fixtures/fec_patch.tsv")
 
 
 def test_patch_create():
@@ -31,21 +38,22 @@ add-item	{"further-education-college-uk":"313","name":"The Northern School of Ar
 append-entry	user	313	2019-03-31T00:00:00Z	sha-256:2b13d0314bcf1afd1c7fd760a3bfa4b620d28d6ad0a4b70f3c1ed9b0fcf09505
 assert-root-hash	sha-256:470e653143735f8c71cd087058c9bff6aa136730627ba5ccc0b44b6bd024170a
 """.lstrip()  # NOQA
-    runner = CliRunner()
+    runner = CliRunner(mix_stderr=False)
     result = runner.invoke(commands.patch.create_command,
                            ['--rsf', register_filename,
                             '--timestamp', timestamp,
                             tsv_filename])
 
     assert result.exit_code == 0
-    assert result.output == expected
+    assert result.stdout == expected
+    assert "Value cache: " in result.stderr
 
 
 def test_patch_create_apply():
     orig_rsf = "tests/fixtures/further-education-college-uk.rsf"
     orig_tsv = "tests/fixtures/fec_patch.tsv"
     timestamp = "2019-03-31T00:00:00Z"
-    runner = CliRunner()
+    runner = CliRunner(mix_stderr=False)
 
     with open(orig_rsf, "r") as handler_rsf, open(orig_tsv, "r") as handler_tsv:  # NOQA
         register_filename = "fec.rsf"
@@ -66,4 +74,237 @@ def test_patch_create_apply():
                                     tsv_filename])
 
             assert result.exit_code == 0
-            assert result.output == expected
+            assert result.stdout == expected
+
+
+def test_patch_create_apply_invalid():
+    orig_rsf = "tests/fixtures/further-education-college-uk.rsf"
+    runner = CliRunner()
+
+    with open(orig_rsf, "r") as handler_rsf:
+        original = handler_rsf.read()
+
+    with runner.isolated_filesystem():
+        with open("fec.rsf", "w") as handler:
+            handler.write(original)
+
+        with open("patch.tsv", "w") as handler:
+            handler.write("further-education-college-uk\tname\n"
+                          "999\tNew College\n"
+                          "bad key!\tOther College\n")
+
+        result = runner.invoke(commands.patch.create_command,
+                               ["--rsf", "fec.rsf", "--apply", "patch.tsv"])
+
+        with open("fec.rsf", "r") as handler:
+            assert handler.read() == original
+
+        assert result.exit_code == 1
+
+
+def test_patch_create_invalid():
+    runner = CliRunner()
+
+    with runner.isolated_filesystem():
+        with open("patch.tsv", "w") as handler:
+            handler.write("further-education-college-uk\tname\n"
+                          "999\tNew College\n"
+                          "bad key!\tOther College\n")
+
+        result = runner.invoke(commands.patch.create_command,
+                               ["--rsf", FEC_RSF, "patch.tsv"])
+
+        assert result.exit_code == 1
+        assert "assert-root-hash" not in result.output
+        assert "add-item" not in result.output
+
+
+def test_patch_create_empty():
+    runner = CliRunner()
+
+    with runner.isolated_filesystem():
+        with open("patch.tsv", "w") as handler:
+            handler.write("further-education-college-uk\tname\n")
+
+        result = runner.invoke(commands.patch.create_command,
+                               ["--rsf", FEC_RSF, "patch.tsv"])
+
+        assert result.exit_code == 1
+        assert "A patch must receive some data" in result.output
+        assert "assert-root-hash" not in result.output
+
+
+def test_patch_create_report():
+    orig_rsf = "tests/fixtures/further-education-college-uk.rsf"
+    runner = CliRunner()
+
+    with open(orig_rsf, "r") as handler_rsf:
+        original = handler_rsf.read()
+
+    with runner.isolated_filesystem():
+        with open("fec.rsf", "w") as handler:
+            handler.write(original)
+
+        with open("patch.tsv", "w") as handler:
+            handler.write("further-education-college-uk\tname\tstart-date\n"
+                          "999\tNew College\t2019-01-01\n"
+                          "bad key!\tOther College\t2019-01-01\n"
+                          "998\tLast College\tyesterday\n")
+
+        result = runner.invoke(commands.patch.create_command,
+                               ["--rsf", "fec.rsf", "--apply",
+                                "--report", "report.json", "patch.tsv"])
+
+        with open("fec.rsf", "r") as handler:
+            assert handler.read() == original
+
+        with open("report.json", "r") as handler:
+            report = json.load(handler)
+
+        assert result.exit_code == 1
+        assert [(error["row"], error["column"], error["value"])
+                for error in report] == [
+                    (2, "further-education-college-uk", "bad key!"),
+                    (3, "start-date", "yesterday")]
+
+        result = runner.invoke(commands.patch.create_command,
+                               ["--rsf", "fec.rsf", "--max-errors", "1",
+                                "--report", "report.json", "patch.tsv"])
+
+        with open("report.json", "r") as handler:
+            assert len(json.load(handler)) == 1
+
+        assert "Stopped after 1 errors." in result.output
+
+
+def test_patch_create_skip_unchanged():
+    orig_rsf = "tests/fixtures/further-education-college-uk.rsf"
+    orig_tsv = "tests/fixtures/fec_patch.tsv"
+    runner = CliRunner()
+
+    with open(orig_rsf, "r") as handler_rsf, open(orig_tsv, "r") as handler_tsv:  # NOQA
+        original = handler_rsf.read()
+        rows = handler_tsv.read()
+
+    with runner.isolated_filesystem():
+        with open("fec.rsf", "w") as handler:
+            handler.write(original)
+
+        with open("patch.tsv", "w") as handler:
+            handler.write(rows)
+
+        result = runner.invoke(commands.patch.create_command,
+                               ["--rsf", "fec.rsf", "--apply", "patch.tsv"])
+        assert result.exit_code == 0
+
+        with open("patch.tsv", "w") as handler:
+            handler.write(rows.replace("168\tNorth Shropshire College",
+                                       "168\tNorth Shropshire"))
+            handler.write("999\tNew College\t\t\t\n")
+
+        result = runner.invoke(commands.patch.create_command,
+                               ["--rsf", "fec.rsf", "--skip-unchanged",
+                                "patch.tsv"])
+
+        assert result.exit_code == 0
+        assert "Skipped 9 unchanged rows, found 1 changed and 1 new." \
+            in result.output
+        assert len([line for line in result.output.splitlines()
+                    if line.startswith("append-entry")]) == 2
+
+
+def test_patch_create_skip_all_unchanged():
+    runner = CliRunner()
+
+    with runner.isolated_filesystem():
+        shutil.copyfile(FEC_RSF, "fec.rsf")
+
+        result = runner.invoke(commands.patch.create_command,
+                               ["--rsf", "fec.rsf", "--apply", FEC_TSV])
+        assert result.exit_code == 0
+
+        with open("fec.rsf", "r") as handler:
+            applied = handler.read()
+
+        result = runner.invoke(commands.patch.create_command,
+                               ["--rsf", "fec.rsf", "--skip-unchanged",
+                                FEC_TSV])
+
+        assert result.exit_code == 0
+        assert "Skipped 10 unchanged rows, found 0 changed and 0 new." \
+            in result.output
+        assert "assert-root-hash" not in result.output
+
+        result = runner.invoke(commands.patch.create_command,
+                               ["--rsf", "fec.rsf", "--skip-unchanged",
+                                "--apply", FEC_TSV])
+
+        assert result.exit_code == 0
+        assert "Skipped 10 unchanged rows" in result.output
+
+        with open("fec.rsf", "r") as handler:
+            assert handler.read() == applied
+
+
+def test_patch_create_index():
+    runner = CliRunner()
+
+    with runner.isolated_filesystem():
+        shutil.copy(FEC_RSF, "fec.rsf")
+        shutil.copy(FEC_TSV, "patch.tsv")
+
+        result = runner.invoke(commands.patch.create_command,
+                               ["--rsf", "fec.rsf", "--index", "--apply",
+                                "patch.tsv"])
+
+        assert result.exit_code == 0
+        assert os.path.exists("fec.rsf.index")
+        assert index.load("fec.rsf", "fec.rsf.index").to_dict() == \
+            index.load("fec.rsf").to_dict()
+
+
+def test_patch_apply_many():
+    runner = CliRunner()
+    timestamp = "2019-03-31T00:00:00Z"
+
+    with runner.isolated_filesystem():
+        os.mkdir("patches")
+        shutil.copy(FEC_RSF, "fec.rsf")
+        shutil.copy(FEC_RSF, "expected.rsf")
+
+        with open("new.tsv", "w") as handler:
+            handler.write("further-education-college-uk\tname\n"
+                          "999\tNew College\n")
+
+        for name, tsv_file in [("1.rsf", FEC_TSV), ("2.rsf", "new.tsv")]:
+            cmds = []
+            commands.patch.create(tsv_file, "expected.rsf", timestamp,
+                                  cmds.append)
+
+            with open(os.path.join("patches", name), "w") as handler:
+                handler.write(rsf.dump(cmds))
+
+            commands.patch.apply(os.path.join("patches", name),
+                                 "expected.rsf")
+
+        with open("fec.rsf", "r") as handler:
+            original = handler.read()
+
+        result = runner.invoke(commands.patch.apply_command,
+                               ["--rsf", "fec.rsf", "patches/2.rsf",
+                                "patches/1.rsf"])
+
+        assert result.exit_code == 1
+        assert "patches/2.rsf" in result.output
+
+        with open("fec.rsf", "r") as handler:
+            assert handler.read() == original
+
+        result = runner.invoke(commands.patch.apply_command,
+                               ["--rsf", "fec.rsf", "patches"])
+
+        assert result.exit_code == 0
+
+        with open("fec.rsf", "r") as handler, \
+                open("expected.rsf", "r") as expected:
+            assert handler.read() == expected.read()
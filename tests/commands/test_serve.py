@@ -0,0 +1,75 @@
+# pylint: disable=missing-docstring
+import json
+import os
+from pathlib import Path
+from wsgiref.util import setup_testing_defaults
+from click.testing import CliRunner
+from registers import commands
+from registers.commands.serve import Application
+from registers.commands.writers import open_store
+
+
+COUNTRY_RSF = os.path.abspath("tests/fixtures/country.rsf")
+
+
+def request(app, path, query="", accept=None):
+    environ = {"PATH_INFO": path, "QUERY_STRING": query}
+
+    if accept:
+        environ["HTTP_ACCEPT"] = accept
+
+    setup_testing_defaults(environ)
+    response = {}
+
+    def start_response(status, headers):
+        response["status"] = status
+        response["headers"] = dict(headers)
+
+    body = b"".join(app(environ, start_response))
+
+    return response["status"], response["headers"], body
+
+
+def build_app(*args):
+    runner = CliRunner()
+    result = runner.invoke(commands.build.build_command, [*args, COUNTRY_RSF])
+
+    assert result.exit_code == 0
+
+    extension = "tar" if "tar" in args else "sqlite"
+
+    return Application(open_store(Path(f"build/country.{extension}")))
+
+
+def test_serve_sqlite():
+    with CliRunner().isolated_filesystem():
+        app = build_app("--output-format", "sqlite")
+
+        status, headers, body = request(app, "/records/GB")
+        assert status == "200 OK"
+        assert headers["Content-Type"] == "application/json"
+        assert json.loads(body)["GB"]["key"] == "GB"
+
+        status, headers, body = request(app, "/entries", "start=200",
+                                        accept="text/csv")
+        assert headers["Content-Type"] == "text/csv; charset=UTF-8"
+        assert len(body.splitlines()) == 11
+
+        status, _, body = request(app, "/records.json", "start=3&limit=2")
+        assert len(json.loads(body)) == 2
+
+        status, _, body = request(app, "/entries", "limit=6000")
+        assert status == "400 Bad Request"
+        assert json.loads(body)["type"] == "unexpected_parameter"
+
+        status, _, _ = request(app, "/records/XX")
+        assert status == "404 Not Found"
+
+
+def test_serve_tar_shard_dirs():
+    with CliRunner().isolated_filesystem():
+        app = build_app("--output-format", "tar", "--shard-dirs")
+
+        status, _, body = request(app, "/record/GB/entries.json")
+        assert status == "200 OK"
+        assert json.loads(body)[0]["key"] == "GB"
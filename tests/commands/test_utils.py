@@ -1,6 +1,9 @@
+import json
+import struct
 from io import StringIO
-from registers import Blob, Entry, Hash, Scope, Record
+from registers import rsf, Blob, Entry, Hash, Scope, Record, Register
 from registers.commands import utils
+from registers.commands.writers import DirectoryWriter
 
 
 def test_record_json():
@@ -30,3 +33,74 @@ def test_record_json():
     actual = stream.read()
 
     assert actual == expected
+
+
+def write_entries(path):
+    register = Register(rsf.read("tests/fixtures/country.rsf"))
+    cache = utils.FragmentCache(Entry.headers(),
+                                key=lambda entry: entry.position)
+    utils.write_fragments_resource(DirectoryWriter(path), "index",
+                                   cache.collection(register.log.entries),
+                                   cache.header, offsets=True)
+
+
+def test_json_resource_with_offsets(tmp_path):
+    write_entries(tmp_path)
+
+    data = tmp_path.joinpath("index.json").read_bytes()
+    sidecar = tmp_path.joinpath("index.json.offsets").read_bytes()
+    offsets = [offset for (offset,) in struct.iter_unpack(">Q", sidecar)]
+    tail = json.loads(data[:offsets[0]] + data[offsets[150]:])
+
+    assert len(offsets) == 209
+    assert tail[0]["entry-number"] == "151"
+    assert len(tail) == 59
+
+
+def test_csv_resource_with_offsets(tmp_path):
+    write_entries(tmp_path)
+
+    data = tmp_path.joinpath("index.csv").read_bytes()
+    sidecar = tmp_path.joinpath("index.csv.offsets").read_bytes()
+    offsets = [offset for (offset,) in struct.iter_unpack(">Q", sidecar)]
+
+    assert data[:offsets[0]] == b"index-entry-number,entry-number,\
+entry-timestamp,key,item-hash\r\n"
+    assert data[offsets[208]:].startswith(b"209,209,")
+
+
+def test_fragments_resource_keys(tmp_path):
+    register = Register(rsf.read("tests/fixtures/country.rsf"))
+    cache = utils.FragmentCache(Record.headers(register.schema()))
+    records = register.records()
+    utils.write_fragments_resource(DirectoryWriter(tmp_path), "index",
+                                   cache.collection(records), cache.header,
+                                   keys=list(records.keys()))
+
+    data = json.loads(tmp_path.joinpath("index.json").read_text())
+
+    assert data["GB"]["GB"]["key"] == "GB"
+    assert not tmp_path.joinpath("index.json.offsets").exists()
+    assert cache.get("GB", None) is cache.collection(records)[
+        list(records.keys()).index("GB")]
+
+
+def test_fragments_resource_layout(tmp_path):
+    register = Register(rsf.read("tests/fixtures/country.rsf"))
+    cache = utils.FragmentCache(Record.headers(register.schema()))
+    records = register.records()
+    writer = DirectoryWriter(tmp_path)
+    utils.write_fragments_resource(writer, "index",
+                                   cache.collection(records), cache.header,
+                                   keys=list(records.keys()))
+    utils.write_fragments_resource(writer, "empty", [], cache.header)
+    utils.write_fragment_resource(writer, "GB", cache.get("GB", None),
+                                  cache.header)
+
+    def pretty(obj):
+        return json.dumps(obj, ensure_ascii=False, indent=2,
+                          cls=utils.JsonEncoder)
+
+    assert tmp_path.joinpath("index.json").read_text() == pretty(records)
+    assert tmp_path.joinpath("empty.json").read_text() == "[]"
+    assert tmp_path.joinpath("GB.json").read_text() == pretty(records["GB"])
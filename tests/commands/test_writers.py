@@ -0,0 +1,119 @@
+# pylint: disable=missing-docstring
+import gzip
+import os
+import pytest
+from io import BytesIO
+from zipfile import ZipFile, ZIP_STORED
+from registers.commands.build import gzip_stream
+from registers.commands.writers import (BlobStore, CompressingWriter,
+                                        DirectoryWriter,
+                                        ThreadedDirectoryWriter, ZipStream,
+                                        deflate)
+
+
+def test_zip_stream_stored():
+    buffer = BytesIO()
+    stream = ZipStream(buffer)
+    stream.add("a/b.json", deflate(b"[]", level=0))
+    stream.close()
+
+    with ZipFile(buffer) as archive:
+        assert archive.getinfo("a/b.json").compress_type == ZIP_STORED
+        assert archive.read("a/b.json") == b"[]"
+
+
+def test_zip_stream_zip64_members():
+    buffer = BytesIO()
+    stream = ZipStream(buffer)
+    member = deflate(b"{}")
+
+    for idx in range(70000):
+        stream.add(f"{idx}.json", member)
+
+    stream.close()
+
+    with ZipFile(buffer) as archive:
+        assert len(archive.namelist()) == 70000
+        assert archive.read("69999.json") == b"{}"
+
+
+def test_directory_writer_replaces_hardlinks(tmp_path):
+    shared = tmp_path.joinpath("shared.json")
+    shared.write_bytes(b"shared")
+    build = tmp_path.joinpath("build")
+    build.mkdir()
+    os.link(shared, build.joinpath("written.json"))
+    os.link(shared, build.joinpath("streamed.json"))
+    os.link(shared, build.joinpath("copied.rsf"))
+    source = tmp_path.joinpath("source.rsf")
+    source.write_bytes(b"source")
+
+    writer = DirectoryWriter(build)
+    writer.write("written.json", b"written")
+
+    with writer.open("streamed.json") as stream:
+        stream.write(b"streamed")
+
+    writer.copy("copied.rsf", source)
+
+    assert shared.read_bytes() == b"shared"
+    assert build.joinpath("written.json").read_bytes() == b"written"
+    assert build.joinpath("streamed.json").read_bytes() == b"streamed"
+    assert build.joinpath("copied.rsf").read_bytes() == b"source"
+
+
+def test_threaded_directory_writer_counts(tmp_path):
+    previous = tmp_path.joinpath("previous")
+    store = BlobStore(tmp_path.joinpath("store"))
+    names = [f"records/{number}.json" for number in range(200)]
+    items = [f"items/sha-256:{number:064x}.json" for number in range(200)]
+
+    with DirectoryWriter(previous) as writer:
+        for name in names:
+            writer.write(name, name.encode("utf-8"))
+
+    with ThreadedDirectoryWriter(tmp_path.joinpath("build"), 4, store=store,
+                                 previous=previous) as writer:
+        for name in names + items:
+            writer.write(name, name.encode("utf-8"))
+
+    assert writer.reused == len(names)
+    assert store.written == len(items)
+    assert store.linked == len(items)
+
+
+def test_threaded_directory_writer_error(tmp_path):
+    store = BlobStore(tmp_path.joinpath("store"))
+    writer = ThreadedDirectoryWriter(tmp_path.joinpath("build"), 1,
+                                     queue_size=1, store=store)
+
+    def fail(*_args):
+        raise ValueError("Broken store")
+
+    store.link = fail  # type: ignore
+
+    with pytest.raises(ValueError, match="Broken store"):
+        for number in range(10):
+            writer.write(f"items/sha-256:{number:064x}.json", b"{}")
+
+        writer.close()
+
+
+def test_compressing_writer_copy(tmp_path, monkeypatch):
+    source = tmp_path.joinpath("source.rsf")
+    source.write_bytes(b"assert-root-hash\tsha-256:abc\n" * 1000)
+
+    def fail(*_args):
+        raise AssertionError("Copied files must not be read in memory")
+
+    monkeypatch.setattr(CompressingWriter, "process", fail)
+    build = tmp_path.joinpath("build")
+
+    with CompressingWriter(DirectoryWriter(build), {".gz": gzip_stream},
+                           [".rsf"]) as writer:
+        writer.copy("commands.rsf", source)
+
+    assert build.joinpath("commands.rsf").read_bytes() == source.read_bytes()
+    assert gzip.decompress(build.joinpath("commands.rsf.gz").read_bytes()) \
+        == source.read_bytes()
+    assert writer.files == 2
@@ -0,0 +1,60 @@
+# pylint: disable=missing-docstring
+import shutil
+import pytest
+from registers import index, rsf, Register
+from registers.exceptions import InconsistentLog
+
+
+FEC_RSF = "tests/fixtures/further-education-college-uk.rsf"
+FEC_PATCH = "tests/fixtures/fec_old_patch.rsf"
+
+
+def test_index_matches_register():
+    register = Register(rsf.read(FEC_RSF))
+    state = index.load(FEC_RSF)
+
+    assert state.digest() == register.log.digest()
+    assert state.size == register.log.size
+    assert state.records == {key: record.blob.digest()
+                             for key, record in register.records().items()}
+    assert state.schema().primary_key == register.schema().primary_key
+
+
+def test_index_sidecar(tmp_path):
+    rsf_file = str(tmp_path.joinpath("fec.rsf"))
+    sidecar = index.sidecar_path(rsf_file)
+    shutil.copy(FEC_RSF, rsf_file)
+
+    index.load(rsf_file, sidecar)
+
+    with open(FEC_PATCH, "r") as source, open(rsf_file, "a") as target:
+        target.write(source.read())
+
+    state = index.load(rsf_file, sidecar)
+    register = Register(rsf.read(rsf_file))
+
+    assert state.digest() == register.log.digest()
+    assert index.load(rsf_file, sidecar).to_dict() == state.to_dict()
+
+
+def test_index_sidecar_mismatch(tmp_path):
+    rsf_file = str(tmp_path.joinpath("fec.rsf"))
+    sidecar = index.sidecar_path(rsf_file)
+    shutil.copy(FEC_RSF, rsf_file)
+    index.load(rsf_file, sidecar)
+    shutil.copy("tests/fixtures/country.rsf", rsf_file)
+
+    state = index.load(rsf_file, sidecar)
+
+    assert state.digest() == Register(rsf.read(rsf_file)).log.digest()
+
+
+def test_index_inconsistent_log(tmp_path):
+    rsf_file = str(tmp_path.joinpath("fec.rsf"))
+    shutil.copy(FEC_RSF, rsf_file)
+
+    with open(rsf_file, "a") as target:
+        target.write(f"assert-root-hash\tsha-256:{'0' * 64}\n")
+
+    with pytest.raises(InconsistentLog):
+        index.load(rsf_file)
@@ -1,5 +1,5 @@
 import pytest
-from registers.log import collect
+from registers.log import Log, collect
 from registers.rsf import parse
 
 
@@ -38,3 +38,40 @@ append-entry	user	GB	2019-04-03T00:00:00Z	sha-256:6b18693874513ba13da54d61aafa7c
     actual = result["errors"]
 
     assert len(actual) == 1
+
+
+class UncopiableBlobs(dict):
+    """
+    A blob mapping that only allows lookups and inserts.
+    """
+
+    def __iter__(self):
+        raise AssertionError("The blobs must not be iterated")
+
+    def keys(self):
+        raise AssertionError("The blobs must not be copied")
+
+    def copy(self):
+        raise AssertionError("The blobs must not be copied")
+
+
+def test_collect_existing_blob():
+    commands = parse("""
+add-item	{"citizen-names":"Briton;British citizen","country":"GB","name":"United Kingdom","official-name":"The United Kingdom of Great Britain and Northern Ireland"}
+append-entry	user	GB	2019-04-03T00:00:00Z	sha-256:6b18693874513ba13da54d61aafa7cad0c8f5573f3431d6f1c04b07ddb27d6bb
+""".strip().splitlines()) # NOQA
+    result = collect(commands)
+    blobs = UncopiableBlobs(result["data"].blobs)
+    data = Log(result["data"].entries, blobs)
+    patch = parse("""
+append-entry	user	UK	2019-04-04T00:00:00Z	sha-256:6b18693874513ba13da54d61aafa7cad0c8f5573f3431d6f1c04b07ddb27d6bb
+add-item	{"country":"FR","name":"France"}
+append-entry	user	FR	2019-04-05T00:00:00Z	sha-256:85faa81dc332a4648f873ae120384d3e4a84e321e4fa464be226a9e794431176
+""".strip().splitlines()) # NOQA
+    actual = collect(patch, data, result["metadata"])
+
+    assert actual["errors"] == []
+    assert actual["data"].blobs is blobs
+    assert actual["data"].stats() == {"total-entries": 3, "total-blobs": 2}
+    assert actual["data"].find("UK").blob == actual["data"].find("GB").blob
+    assert actual["data"].find("FR").blob.digest() in blobs
@@ -116,3 +116,15 @@ def test_audit_path(idx, size, expected):
     actual = [digest.hex() for digest in merkle.path(tree, idx)]
 
     assert actual == expected
+
+
+@pytest.mark.parametrize("size", range(0, 34))
+def test_frontier(size):
+    leaves = [bytes([i]) for i in range(size)]
+    frontier = merkle.Frontier()
+
+    for leaf in leaves:
+        frontier.append(leaf)
+
+    assert frontier.width == size
+    assert frontier.root_hash == merkle.Tree(leaves).root_hash
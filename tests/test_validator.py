@@ -1,9 +1,10 @@
 import pytest
 from registers.validator import (validate, validate_value_datatype,
-                                 validate_key)
+                                 validate_key, validate_column)
 from registers.schema import Schema, Cardinality, Datatype, Attribute
 from registers.exceptions import (MissingPrimaryKey, CardinalityMismatch,
                                   RepresentationError, UnknownAttribute,
+                                  ValidationError,
                                   InvalidCurieValue,
                                   InvalidDatetimeValue,
                                   InvalidNameValue,
@@ -342,3 +343,68 @@ def test_invalid_key_value():
     assert not validate_key("ALPHA--")
     assert not validate_key("C__34")
     assert not validate_key("C_/34")
+
+
+def test_compile_validator_cached():
+    schema = Schema(
+        "id",
+        [Attribute("id", Datatype.String, Cardinality.One),
+         Attribute("x", Datatype.Integer, Cardinality.Many)]
+    )
+    validator = schema.compile_validator()
+
+    assert schema.compile_validator() is validator
+    assert validator.validate({"id": "foo", "x": ["1", "2"]})
+
+    with pytest.raises(InvalidIntegerValue):
+        validator.validate({"id": "foo", "x": ["1", "a"]})
+
+    with pytest.raises(UnknownAttribute):
+        validator.validate({"id": "foo", "y": "1"})
+
+    schema.insert(Attribute("y", Datatype.Url, Cardinality.One))
+
+    assert schema.compile_validator() is not validator
+    assert validate({"id": "foo", "y": "https://example.org"}, schema)
+
+
+@pytest.mark.parametrize("datatype", list(Datatype))
+def test_validate_column(datatype):
+    attr = Attribute("x", datatype, Cardinality.One)
+    values = ["1", "", "-1", "01", "1\n", "a\nb", "2019-01-01",
+              "2019-01-01T10:11:12Z", "P1Y", "P", "2019/P1D", "foo:bar",
+              "Foo", "sha-256:" + "a" * 64, None]
+    expected = []
+
+    for index, value in enumerate(values):
+        if value is None:
+            continue
+
+        try:
+            validate_value_datatype(value, datatype)
+        except ValidationError as err:
+            expected.append((index, type(err), str(err)))
+
+    assert [(index, type(err), str(err)) for index, err
+            in validate_column(values, attr)] == expected
+
+
+def test_value_cache():
+    schema = Schema(
+        "id",
+        [Attribute("id", Datatype.String, Cardinality.One),
+         Attribute("url", Datatype.Url, Cardinality.Many)]
+    )
+    data = {"id": "foo", "url": ["https://example.org"] * 3}
+
+    assert schema.compile_validator().validate(data)
+    assert schema.compile_validator().cache.hits == 2
+
+    with pytest.raises(InvalidUrlValue):
+        schema.compile_validator().validate({"id": "foo", "url": ["x"]})
+
+    assert schema.compile_validator(cache_size=0).cache is None
+    assert schema.compile_validator().validate(data)
+
+    with pytest.raises(InvalidUrlValue):
+        schema.compile_validator().validate({"id": "foo", "url": ["x"]})
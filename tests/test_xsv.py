@@ -1,6 +1,7 @@
 import pytest
 from registers import rsf, xsv, schema, Schema, Blob, Register
-from registers.exceptions import InvalidKey
+from registers.exceptions import (InvalidKey, InvalidIntegerValue,
+                                  UnknownAttribute)
 from io import StringIO
 
 
@@ -70,3 +71,49 @@ def test_coerce_wrong_key():
 
     with pytest.raises(InvalidKey):
         xsv.coerce(data, sch)
+
+
+def test_deserialise_stream_parallel(isa_register, isa_tsv_patch):
+    filename = "tests/fixtures/2019-02-07_update_isa-main.tsv"
+
+    with open(filename, "r", newline="") as handle:
+        blobs = list(xsv.deserialise_stream(handle, isa_register.schema(),
+                                            jobs=2, chunk_size=2))
+
+    assert blobs == isa_tsv_patch
+
+
+@pytest.mark.parametrize("tsv,error", [
+    ("foo\tx\nfirst\t1\nsecond\t2\n_3\t3\nfourth\t4\n", InvalidKey),
+    ("foo\tx\nfirst\t1\nsecond\t2\nthird\tx\nfourth\t4\n",
+     InvalidIntegerValue),
+    ("foo\ty\nfirst\t\nsecond\t\nthird\ty\nfourth\t\n", UnknownAttribute),
+])
+def test_deserialise_stream_parallel_error(tsv, error):
+    sch = Schema("foo", [schema.string("foo"), schema.integer("x")])
+
+    with pytest.raises(error) as serial:
+        list(xsv.deserialise_stream(StringIO(tsv), sch))
+
+    with pytest.raises(error) as parallel:
+        list(xsv.deserialise_stream(StringIO(tsv), sch, jobs=2,
+                                    chunk_size=1))
+
+    assert type(parallel.value) is type(serial.value)
+    assert parallel.value.args == serial.value.args
+
+
+def test_coerce_all_chunk():
+    sch = Schema("foo", [schema.string("foo"), schema.integer("x"),
+                         schema.datetime("d"), schema.integer_set("xs")])
+    rows = [{"foo": "a", "x": "1", "d": "2019-01-01", "xs": "1;2"},
+            {"foo": "b", "x": "y", "d": "2019-01-01", "xs": "1;2"},
+            {"foo": "c", "x": "1", "d": "2019-13-01", "xs": "1;z"},
+            {"foo": "d e", "x": "1", "d": "", "xs": ""},
+            {"foo": "e", "x": "01", "d": "2019", "xs": ";"},
+            {"foo": "f", "x": "1", "d": "2019", "bar": "1"},
+            {"foo": "", "x": "1", "d": "2019", "xs": "3"}]
+
+    expected = [xsv.coerce_all(row, sch) for row in rows]
+
+    assert xsv.coerce_all_chunk(rows, sch) == expected